@@ -1,3 +1,4 @@
+from bisect import bisect_left
 from cStringIO import StringIO
 from datetime import datetime
 from functools import partial
@@ -8,25 +9,40 @@ from os.path import join, basename, split, dirname
 from sys import stderr
 from mimetypes import guess_type
 
-from flask import (Blueprint, Flask, current_app, send_file, request, redirect,
-                   jsonify, render_template, url_for)
+from flask import (Blueprint, Flask, Response, current_app, send_file, request,
+                   redirect, jsonify, render_template, stream_with_context,
+                   url_for)
 from funcy import merge
+from jinja2 import Markup
 from pyelasticsearch import ElasticSearch
 from werkzeug.exceptions import NotFound
 
-from dxr.es import (filtered_query, frozen_config, frozen_configs,
-                    es_alias_or_not_found)
+from dxr.es import (CatalogCache, filtered_query, frozen_config,
+                    frozen_configs, es_alias_or_not_found, sources)
 from dxr.exceptions import BadTerm
 from dxr.filters import FILE, LINE
-from dxr.lines import html_line, tags_per_line, finished_tags, Ref, Region
+from dxr.lines import (html_line, tags_per_line, finished_tags, MenuTable,
+                       Ref, Region, unpack_rendering)
+from dxr.localsearch import LocalSearch
 from dxr.mime import icon, is_binary_image, is_textual_image, decode_data
+from dxr.pages import page_store
 from dxr.plugins import plugins_named
-from dxr.query import Query, filter_menu_items
+from dxr.query import Query, decode_cursor, encode_cursor, filter_menu_items
+from dxr.searchcache import search_cache
 from dxr.utils import (non_negative_int, decode_es_datetime, DXR_BLUEPRINT,
                        format_number, append_by_line, build_offset_map,
                        split_content_lines)
 from dxr.vcs import file_contents_at_rev
 
+# How many LINE docs to fetch at a time when showing a file. Pages of longer
+# files are streamed, a batch of lines at a time, unless a skimmer needs the
+# whole file.
+LINE_BATCH_SIZE = 5000
+
+# How many template chunks to gather before sending them along, when
+# streaming a page
+STREAM_BUFFER_SIZE = 500
+
 # Look in the 'dxr' package for static files, etc.:
 dxr_blueprint = Blueprint(DXR_BLUEPRINT,
                           'dxr',
@@ -106,8 +122,13 @@ def make_app(config):
     # Log to Apache's error log in production:
     app.logger.addHandler(StreamHandler(stderr))
 
-    # Make an ES connection pool shared among all threads:
-    app.es = ElasticSearch(config.es_hosts)
+    # Make an ES connection pool shared among all threads, or stand in for
+    # one:
+    app.es = (LocalSearch(config.local_index_folder) if
+              config.local_index_folder else
+              ElasticSearch(config.es_hosts))
+    app.catalog = CatalogCache(config.catalog_cache_ttl)
+    app.search_cache = search_cache(config)
 
     return app
 
@@ -131,19 +152,25 @@ def search(tree):
     query_text = req.get('q', '')
     offset = non_negative_int(req.get('offset'), 0)
     limit = min(non_negative_int(req.get('limit'), 100), 1000)
+    after = decode_cursor(req.get('cursor'))
 
     # Make a Query:
     query = Query(partial(current_app.es.search,
                           index=frozen['es_alias']),
                   query_text,
-                  plugins_named(frozen['enabled_plugins']))
+                  plugins_named(frozen['enabled_plugins']),
+                  candidate_budget=config.regexp_candidate_budget,
+                  scan_budget=config.regexp_scan_budget,
+                  scan_timeout=config.regexp_scan_timeout,
+                  cache=current_app.search_cache,
+                  index=frozen.get('es_index'))
 
     # Fire off one of the two search routines:
     searcher = _search_json if _request_wants_json() else _search_html
-    return searcher(query, tree, query_text, offset, limit, config)
+    return searcher(query, tree, query_text, offset, limit, after, config)
 
 
-def _search_json(query, tree, query_text, offset, limit, config):
+def _search_json(query, tree, query_text, offset, limit, after, config):
     """Try a "direct search" (for exact identifier matches, etc.). If we have a direct hit,
     then return {redirect: hit location}. If that doesn't work, fall back to a normal
     search, and if that yields a single result and redirect is true then return
@@ -157,7 +184,11 @@ def _search_json(query, tree, query_text, offset, limit, config):
           a bubble indicating as much.
     We only redirect to a direct/unique result if the original query contained a
     'redirect=true' parameter, which the user can elicit by hitting enter on the query
-    input."""
+    input.
+
+    A 'cursor' parameter, copied from the 'cursor' of a previous response, picks
+    up where that one left off, costing the same however deep the paging goes.
+    'offset' then counts from there."""
 
     # If we're asked to redirect and have a direct hit, then return the url to that.
     if request.values.get('redirect') == 'true':
@@ -173,10 +204,11 @@ def _search_json(query, tree, query_text, offset, limit, config):
             }
             return jsonify({'redirect': url_for('.browse', _anchor=line, **params)})
     try:
-        count_and_results = query.results(offset, limit)
+        count_and_results = query.results(offset, limit, after)
         # If we're asked to redirect and there's a single result, redirect to the result.
         if (request.values.get('redirect') == 'true' and
-            count_and_results['result_count'] == 1):
+            count_and_results['result_count'] == 1 and
+            count_and_results['result_count_is_exact']):
             _, path, line = next(count_and_results['results'])
             line = line[0][0] if line else None
             params = {
@@ -200,10 +232,13 @@ def _search_json(query, tree, query_text, offset, limit, config):
         'results': results,
         'result_count': count_and_results['result_count'],
         'result_count_formatted': format_number(count_and_results['result_count']),
+        'result_count_is_exact': count_and_results['result_count_is_exact'],
+        'is_truncated': count_and_results['is_truncated'],
+        'cursor': encode_cursor(count_and_results['position']),
         'tree_tuples': _tree_tuples('.search', q=query_text)})
 
 
-def _search_html(query, tree, query_text, offset, limit, config):
+def _search_html(query, tree, query_text, offset, limit, after, config):
     """Return the rendered template for search.html.
 
     """
@@ -286,11 +321,17 @@ def raw_rev(tree, revision, path):
 @dxr_blueprint.route('/<tree>/lines/')
 def lines(tree):
     """Return lines start:end of path in tree, where start, end, path are URL params.
+
+    If the ``decorated`` param is "true", return them rendered, for the
+    windowed view of a long file.
+
     """
     req = request.values
     path = req.get('path', '')
     from_line = max(0, int(req.get('start', '')))
     to_line = int(req.get('end', ''))
+    if req.get('decorated') == 'true':
+        return _decorated_lines(tree, path, max(1, from_line), to_line)
     ctx_found = []
     possible_hits = current_app.es.search(
             {
@@ -314,6 +355,126 @@ def lines(tree):
     return jsonify({'lines': ctx_found, 'path': path})
 
 
+def _decorated_lines(tree, path, first, last):
+    """Return JSON holding lines ``first`` through ``last`` of a file, at most
+    a batch or a window of them, whichever is more, rendered by
+    text_file_body.html.
+
+    Lines know where they start within the file, so the work doesn't depend
+    on how far in they are. With compact rendering, though, the FILE doc's
+    whole blob gets decoded.
+
+    """
+    config = current_app.dxr_config
+    frozen = frozen_config(tree)
+    files = filtered_query(frozen['es_alias'],
+                           FILE,
+                           filter={'path': path},
+                           size=1,
+                           include=['rendering'])
+    if not files:
+        raise NotFound
+    file_doc = files[0]
+    docs = _line_batch(frozen['es_alias'],
+                       path,
+                       _line_fields(file_doc),
+                       after=first - 1,
+                       size=min(max(0, last - first + 1),
+                                _first_batch_size(config)))[1]
+    first = docs[0]['number'][0] if docs else first
+    # Prefix the menu IDs so they don't collide with those of the page or of
+    # other ranges spliced into it.
+    menus = MenuTable('l%i-' % first)
+    decorate = _line_decorator(file_doc, config.trees[tree], menus)[0]
+    decorated = [decorate(doc, doc['offset'][0]) for doc in docs]
+    return jsonify({
+        'path': path,
+        'start': first,
+        'end': first + len(docs) - 1,
+        'html': render_template('text_file_body.html',
+                                annotation_sets=[a for _, a in decorated],
+                                first_line=first,
+                                line_count=len(decorated),
+                                code_lines=[html for html, _ in decorated],
+                                menus=menus,
+                                is_binary=False)})
+
+
+def _line_fields(file_doc):
+    """Return the fields of a file's LINE docs it takes to show them."""
+    # With compact rendering, the decorations are all on the FILE doc.
+    return (['number', 'offset', 'content'] if 'rendering' in file_doc else
+            ['number', 'offset', 'content', 'refs', 'regions', 'annotations'])
+
+
+def _first_batch_size(config):
+    """Return how many LINE docs to fetch at first when showing a file or a
+    range of its lines: enough to fill a window, if it's bigger than a
+    batch."""
+    return max(config.browse_window, LINE_BATCH_SIZE)
+
+
+def _line_batch(alias, path, include, after=0, size=None):
+    """Return how many lines of a file there are after line number ``after``,
+    and the LINE docs of the first ``size`` of them (default:
+    :const:`LINE_BATCH_SIZE`), in order.
+
+    The content field of each doc, if fetched, is dereferenced. We can do this
+    because we do not store empty lines in ES.
+
+    """
+    hits = current_app.es.search(
+        {
+            'query': {
+                'filtered': {
+                    'query': {'match_all': {}},
+                    'filter': {
+                        'and': [
+                            {'term': {'path': path}},
+                            {'range': {'number': {'gt': after}}}
+                        ]
+                    }
+                }
+            },
+            '_source': {'include': include},
+            'sort': ['number']
+        },
+        size=LINE_BATCH_SIZE if size is None else size,
+        doc_type=LINE,
+        index=alias)['hits']
+    docs = sources(hits['hits'])
+    for doc in docs:
+        if 'content' in doc:
+            doc['content'] = doc['content'][0]
+    return hits['total'], docs
+
+
+def _line_docs(alias, path, include, docs=None):
+    """Yield all the LINE docs of a file, in order, fetching them a batch at
+    a time.
+
+    Each batch picks up after the line number the last one ended at, so it
+    costs no more than the first.
+
+    :arg docs: The first batch, if it's been fetched already
+
+    """
+    after = 0
+    if docs is not None:
+        for doc in docs:
+            yield doc
+        if not docs:
+            return
+        after = docs[-1]['number'][0]
+    while True:
+        _, docs = _line_batch(alias, path, include, after)
+        for doc in docs:
+            yield doc
+        if len(docs) < LINE_BATCH_SIZE:
+            break
+        after = docs[-1]['number'][0]
+
+
 @dxr_blueprint.route('/<tree>/source/')
 @dxr_blueprint.route('/<tree>/source/<path:path>')
 def browse(tree, path=''):
@@ -334,7 +495,7 @@ def browse(tree, path=''):
             FILE,
             filter={'path': path},
             size=1,
-            include=['link', 'links', 'is_binary'])
+            include=['link', 'links', 'is_binary', 'rendering'])
         if not files:
             raise NotFound
         file_doc = files[0]
@@ -342,17 +503,32 @@ def browse(tree, path=''):
             # Then this path is a symlink, so redirect to the real thing.
             return redirect(url_for('.browse', tree=tree, path=file_doc['link'][0]))
 
-        lines = filtered_query(
-            frozen['es_alias'],
-            LINE,
-            filter={'path': path},
-            sort=['number'],
-            size=1000000,
-            include=['content', 'refs', 'regions', 'annotations'])
-        # Deref the content field in each document. We can do this because we
-        # do not store empty lines in ES.
-        for doc in lines:
-            doc['content'] = doc['content'][0]
+        # Serve the page rendered at index time, if there is one and no
+        # skimmer has anything to add to it. They have to judge by the FILE
+        # doc alone, since fetching the lines is what we're trying to avoid.
+        pages = page_store(config)
+        if (pages and 'es_index' in frozen and
+                not _is_skimmed(path, [], file_doc, config.trees[tree])):
+            body = pages.get(frozen['es_index'], path)
+            if body is not None:
+                return _browse_file(tree, path, [], file_doc, config, False,
+                                    frozen['generated_date'], body=body)
+
+        include = _line_fields(file_doc)
+        line_count, lines = _line_batch(frozen['es_alias'], path, include,
+                                        size=_first_batch_size(config))
+        is_windowed = (config.browse_window and
+                       line_count > config.browse_window)
+        if ((is_windowed or len(lines) < line_count) and
+                not _is_skimmed(path, lines, file_doc, config.trees[tree])):
+            if is_windowed:
+                return _window_file(tree, path, lines[:config.browse_window],
+                                    line_count, file_doc, config, frozen)
+            return _stream_file(tree, path, lines, line_count, file_doc,
+                                include, config, frozen)
+        if len(lines) < line_count:
+            # Skimmers want the whole file at once.
+            lines = list(_line_docs(frozen['es_alias'], path, include, lines))
 
         return _browse_file(tree, path, lines, file_doc, config,
                             file_doc.get('is_binary', [False])[0],
@@ -448,6 +624,29 @@ def skim_file(skimmers, num_lines):
     return links, refses, regionses, annotations_by_line
 
 
+def _process_link_templates(sections):
+    """Look for {{line}} in the links of given sections, and duplicate them onto
+    a 'template' field.
+    """
+    for section in sections:
+        for link in section['items']:
+            if '{{line}}' in link['href']:
+                link['template'] = link['href']
+                link['href'] = link['href'].replace('{{line}}', '')
+
+
+def _sidebar_links(sections):
+    """Return data structure to build nav sidebar from. ::
+
+        [('Section Name', [{'icon': ..., 'title': ..., 'href': ...}])]
+
+    """
+    _process_link_templates(sections)
+    # Sort by order, resolving ties by section name:
+    return sorted(sections, key=lambda section: (section['order'],
+                                                 section['heading']))
+
+
 def _build_common_file_template(tree, path, is_binary, date, config):
     """Return a dictionary of the common required file template parameters.
     """
@@ -470,7 +669,7 @@ def _build_common_file_template(tree, path, is_binary, date, config):
 
 
 def _browse_file(tree, path, line_docs, file_doc, config, is_binary,
-                 date=None, contents=None, image_rev=None):
+                 date=None, contents=None, image_rev=None, body=None):
     """Return a rendered page displaying a source file.
 
     :arg string tree: name of tree on which file is found
@@ -485,28 +684,9 @@ def _browse_file(tree, path, line_docs, file_doc, config, is_binary,
         the `content` field of all line_docs
     :arg image_rev: revision number of a textual or binary image, for images
         displayed at a certain rev
+    :arg body: the body of a text file's page, as pre-rendered at index time
+        from text_file_body.html, in which case line_docs are ignored
     """
-    def process_link_templates(sections):
-        """Look for {{line}} in the links of given sections, and duplicate them onto
-        a 'template' field.
-        """
-        for section in sections:
-            for link in section['items']:
-                if '{{line}}' in link['href']:
-                    link['template'] = link['href']
-                    link['href'] = link['href'].replace('{{line}}', '')
-
-    def sidebar_links(sections):
-        """Return data structure to build nav sidebar from. ::
-
-            [('Section Name', [{'icon': ..., 'title': ..., 'href': ...}])]
-
-        """
-        process_link_templates(sections)
-        # Sort by order, resolving ties by section name:
-        return sorted(sections, key=lambda section: (section['order'],
-                                                     section['heading']))
-
     if not date:
         # Then assume that the file is generated now. Remark: we can't use this
         # as the default param because that is only evaluated once, so the same
@@ -519,15 +699,25 @@ def _browse_file(tree, path, line_docs, file_doc, config, is_binary,
         return render_template(
             'image_file.html',
             **merge(common, {
-                'sections': sidebar_links(links),
+                'sections': _sidebar_links(links),
                 'revision': image_rev}))
     elif is_binary:
         return render_template(
             'text_file.html',
             **merge(common, {
-                'lines': [],
+                'annotation_sets': [],
+                'line_count': 0,
+                'code_lines': [],
                 'is_binary': True,
-                'sections': sidebar_links(links)}))
+                'sections': _sidebar_links(links)}))
+    elif body is not None:
+        return render_template(
+            'text_file.html',
+            **merge(common, {
+                'body': Markup(body),
+                'sections': _sidebar_links(links),
+                'query': request.args.get('q', ''),
+                'bubble': request.args.get('redirect_type')}))
     else:
         # We concretize the lines into a list because we iterate over it multiple times
         lines = [doc['content'] for doc in line_docs]
@@ -557,30 +747,195 @@ def _browse_file(tree, path, line_docs, file_doc, config, is_binary,
                     for plugin in tree_config.enabled_plugins
                     if plugin.file_to_skim]
         skim_links, refses, regionses, annotationses = skim_file(skimmers, len(line_docs))
-        index_refs = (Ref.es_to_triple(ref, tree_config) for ref in
-                      chain.from_iterable(doc.get('refs', [])
-                                          for doc in line_docs))
-        index_regions = (Region.es_to_triple(region) for region in
-                         chain.from_iterable(doc.get('regions', [])
-                                             for doc in line_docs))
+        if 'rendering' in file_doc:
+            # Decode the whole file's decorations in one go.
+            (index_refs, index_regions,
+             index_annotations) = unpack_rendering(file_doc['rendering'],
+                                                   tree_config)
+        else:
+            index_refs = (Ref.es_to_triple(ref, tree_config) for ref in
+                          chain.from_iterable(doc.get('refs', [])
+                                              for doc in line_docs))
+            index_regions = (Region.es_to_triple(region) for region in
+                             chain.from_iterable(doc.get('regions', [])
+                                                 for doc in line_docs))
+            index_annotations = (doc.get('annotations', [])
+                                 for doc in line_docs)
         tags = finished_tags(lines,
                              chain(chain.from_iterable(refses), index_refs),
                              chain(chain.from_iterable(regionses), index_regions))
+        menus = MenuTable()
         return render_template(
             'text_file.html',
             **merge(common, {
-                # Someday, it would be great to stream this and not concretize
-                # the whole thing in RAM. The template will have to quit
-                # looping through the whole thing 3 times.
-                'lines': [(html_line(doc['content'], tags_in_line, offset),
-                           doc.get('annotations', []) + skim_annotations)
-                          for doc, tags_in_line, offset, skim_annotations
-                              in izip(line_docs, tags_per_line(tags), offsets, annotationses)],
-                'sections': sidebar_links(links + skim_links),
+                # Big files that need no skimming are streamed instead; see
+                # _stream_file().
+                'annotation_sets': [index_annotations_in_line + skim_annotations
+                                    for index_annotations_in_line, skim_annotations
+                                    in izip(index_annotations, annotationses)],
+                'line_count': len(lines),
+                'code_lines': [html_line(doc['content'], tags_in_line, offset,
+                                         menus)
+                               for doc, tags_in_line, offset
+                               in izip(line_docs, tags_per_line(tags), offsets)],
+                'menus': menus,
+                'sections': _sidebar_links(links + skim_links),
                 'query': request.args.get('q', ''),
                 'bubble': request.args.get('redirect_type')}))
 
 
+def _is_skimmed(path, line_docs, file_doc, tree_config):
+    """Return whether any skimmer is interested in a file, judging by its
+    FILE doc and the first batch of its lines (which may be empty)."""
+    contents = u''.join(doc['content'] for doc in line_docs)
+    return any(plugin.file_to_skim(path,
+                                   contents,
+                                   plugin.name,
+                                   tree_config,
+                                   file_doc,
+                                   line_docs).is_interesting()
+               for plugin in tree_config.enabled_plugins
+               if plugin.file_to_skim)
+
+
+def _stream_file(tree, path, first_lines, line_count, file_doc, include,
+                 config, frozen):
+    """Return a response which streams the page of a text file too long to
+    fetch in one batch, decorating its lines as they arrive rather than
+    holding them all in RAM.
+
+    This is for files no skimmer wants to see, since skimmers need the whole
+    text at once.
+
+    :arg first_lines: The first batch of the file's LINE docs
+    :arg line_count: How many lines the file has
+    :arg include: The fields of the LINE docs to fetch
+    :arg frozen: The frozen config of the tree
+
+    """
+    alias = frozen['es_alias']
+    menus = MenuTable()
+    decorate, annotation_sets = _line_decorator(file_doc, config.trees[tree],
+                                                menus)
+    if annotation_sets is None:
+        # The annotations come before the code on the page, so they get a
+        # pass of their own.
+        annotation_sets = (doc.get('annotations', []) for doc in
+                           _line_docs(alias, path, ['number', 'annotations']))
+
+    def code_lines():
+        for doc in _line_docs(alias, path, include, first_lines):
+            html, _ = decorate(doc, doc['offset'][0])
+            yield html
+
+    return _stream_template(
+        'text_file.html',
+        **merge(_build_common_file_template(tree, path, False,
+                                            frozen['generated_date'],
+                                            config),
+                {'annotation_sets': annotation_sets,
+                 'line_count': line_count,
+                 'code_lines': code_lines(),
+                 'menus': menus,
+                 'sections': _sidebar_links(file_doc.get('links', [])),
+                 'query': request.args.get('q', ''),
+                 'bubble': request.args.get('redirect_type')}))
+
+
+def _window_file(tree, path, window_lines, line_count, file_doc, config,
+                 frozen):
+    """Return the page of a long text file showing only its first window of
+    lines. The rest are fetched from :func:`lines()` as the reader scrolls.
+
+    :arg window_lines: The LINE docs of the lines to show
+    :arg line_count: How many lines the file has
+    :arg frozen: The frozen config of the tree
+
+    """
+    menus = MenuTable()
+    decorate = _line_decorator(file_doc, config.trees[tree], menus)[0]
+    decorated = [decorate(doc, doc['offset'][0]) for doc in window_lines]
+    return render_template(
+        'text_file.html',
+        **merge(_build_common_file_template(tree, path, False,
+                                            frozen['generated_date'],
+                                            config),
+                {'annotation_sets': [a for _, a in decorated],
+                 'line_count': len(decorated),
+                 'code_lines': [html for html, _ in decorated],
+                 'menus': menus,
+                 'window_size': config.browse_window,
+                 'total_lines': line_count,
+                 'sections': _sidebar_links(file_doc.get('links', [])),
+                 'query': request.args.get('q', ''),
+                 'bubble': request.args.get('redirect_type')}))
+
+
+def _line_decorator(file_doc, tree_config, menus):
+    """Return a function for rendering a file's lines one at a time, plus the
+    annotations of all its lines if they came along in the FILE doc (or else
+    None).
+
+    :arg menus: The :class:`~dxr.lines.MenuTable` of the page the lines go on
+
+    The function takes a LINE doc, whose content is dereferenced, and the
+    offset of the line's start within the file, and it returns the line's
+    Markup and annotations. Stored tags are balanced within their lines
+    already, so each line can be finished on its own.
+
+    """
+    if 'rendering' in file_doc:
+        # The whole file's decorations come in one blob, sorted by offset.
+        refs, regions, annotations_by_line = unpack_rendering(
+            file_doc['rendering'], tree_config)
+        ref_starts = [start for start, _, _ in refs]
+        region_starts = [start for start, _, _ in regions]
+
+        def decorations(doc, start, end):
+            return (refs[bisect_left(ref_starts, start):
+                         bisect_left(ref_starts, end)],
+                    regions[bisect_left(region_starts, start):
+                            bisect_left(region_starts, end)],
+                    annotations_by_line[doc['number'][0] - 1])
+    else:
+        annotations_by_line = None
+
+        def decorations(doc, start, end):
+            return ([Ref.es_to_triple(ref, tree_config)
+                     for ref in doc.get('refs', [])],
+                    [Region.es_to_triple(region)
+                     for region in doc.get('regions', [])],
+                    doc.get('annotations', []))
+
+    def decorate(doc, start):
+        text = doc['content']
+        refs_in_line, regions_in_line, annotations = decorations(
+            doc, start, start + len(text))
+        tags = finished_tags([text],
+                             _shifted(refs_in_line, start),
+                             _shifted(regions_in_line, start))
+        return (html_line(text, next(tags_per_line(tags)), 0, menus),
+                annotations)
+
+    return decorate, annotations_by_line
+
+
+def _shifted(tags, offset):
+    """Return (start, end, payload) triples moved ``offset`` to the left."""
+    return [(start - offset, end - offset, payload)
+            for start, end, payload in tags]
+
+
+def _stream_template(template_name, **context):
+    """Return a response which renders a template as its loops go, sending
+    it along a buffer at a time."""
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(STREAM_BUFFER_SIZE)
+    return Response(stream_with_context(stream))
+
+
 @dxr_blueprint.route('/<tree>/rev/<revision>/<path:path>')
 def rev(tree, revision, path):
     """Display a page showing the file at path at specified revision by
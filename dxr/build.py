@@ -1,38 +1,67 @@
 from datetime import datetime
 from errno import ENOENT
-from fnmatch import fnmatchcase
-from itertools import chain, izip, repeat
+from hashlib import sha1
+from itertools import chain, islice, izip, repeat
+import json
 import os
-from os import stat, makedirs
+from os import listdir, stat, makedirs
 from os.path import islink, relpath, join, split
 from shutil import rmtree
 import subprocess
+from subprocess import CalledProcessError
 import sys
 from sys import exc_info
+from tempfile import mkdtemp
+from time import time
 from traceback import format_exc
 from uuid import uuid1
 
 from binaryornot.helpers import is_binary_string
-from concurrent.futures import as_completed, ProcessPoolExecutor
+from concurrent.futures import (as_completed, wait, FIRST_COMPLETED,
+                                ProcessPoolExecutor, ThreadPoolExecutor)
 from click import progressbar
-from flask import current_app
+from flask import current_app, render_template
 from funcy import ichunks, first
-from pyelasticsearch import (ElasticSearch, IndexAlreadyExistsError,
-                             bulk_chunks, Timeout, ConnectionError)
+from pyelasticsearch import (ElasticSearch, ElasticHttpNotFoundError,
+                             IndexAlreadyExistsError, bulk_chunks, Timeout,
+                             ConnectionError)
 
 from dxr.app import make_app, dictify_links
 from dxr.config import FORMAT
-from dxr.es import UNINDEXED_STRING, UNANALYZED_STRING, TREE, create_index_and_wait
+from dxr.es import (UNINDEXED_STRING, UNANALYZED_STRING, TREE,
+                    BulkSizer, BulkUploader, ShardWriter, bulk_with_backoff,
+                    create_index_and_wait, scan_hits)
 from dxr.exceptions import BuildError
 from dxr.filters import LINE, FILE
-from dxr.lines import es_lines, finished_tags
+from dxr.indexcache import index_cache, file_hash
+from dxr.lines import (es_line, finished_tags, html_line, MenuTable,
+                       tags_per_line, RenderingPacker)
+from dxr.localsearch import LocalSearch, build_local_index
+from dxr.manifest import rescan, scan, tree_manifest
 from dxr.mime import decode_data
+from dxr.pages import page_store
 from dxr.utils import (open_log, deep_update, append_update,
                        append_update_by_line, append_by_line, bucket,
-                       split_content_lines, unicode_for_display)
+                       build_offset_map, split_content_lines, stable_repr,
+                       unicode_for_display)
 from dxr.vcs import VcsCache
 
 
+# Post-build state for indexing workers: the tree, its TreeToIndexes, the
+# index cache, and so on. The master sets this just before the indexing pool forks its
+# workers, which then inherit it rather than having it pickled into every
+# chunk. (Pickling a big clang or python TreeToIndex can take seconds.)
+_worker_state = {}
+
+# Budgets for the chunks of files handed to indexing workers: see
+# weighted_chunks(). A few MB keeps per-chunk overhead negligible while
+# leaving plenty of chunks to spread around.
+CHUNK_BYTES = 4 * 1024 * 1024
+CHUNK_FILES = 500
+# Folders are cheap and uniform, except for the odd README, so count suffices.
+CHUNK_FOLDERS = 500
+
+
 def full_traceback(callable, *args, **kwargs):
     """Work around the wretched exception reporting of concurrent.futures.
 
@@ -48,25 +77,138 @@ def full_traceback(callable, *args, **kwargs):
         raise Exception(format_exc())
 
 
-def index_and_deploy_tree(tree, verbose=False):
+def index_and_deploy_tree(tree, verbose=False, incremental=False,
+                          export_folder=None):
     """Index a tree, and make it accessible.
 
     :arg tree: The TreeConfig of the tree to build
+    :arg incremental: Whether to reuse the docs of files that haven't changed
+        since the tree's live index was built
+    :arg export_folder: If not None, write the index out to a folder named
+        after the tree within this one rather than sending it to ES, and leave
+        deployment to :func:`load_and_deploy_tree()`
 
     """
     config = tree.config
+    if config.local_index_folder and not export_folder:
+        # There's no ES to send things to. Export to a scratch folder, and
+        # compile that into a local index.
+        scratch = mkdtemp(prefix='dxr-export-')
+        try:
+            index_and_deploy_tree(tree, verbose, export_folder=scratch)
+            if 'index' not in config.skip_stages:
+                load_and_deploy_tree(tree, scratch)
+        finally:
+            rmtree(scratch)
+        return
+
     es = ElasticSearch(config.es_hosts,
                        timeout=config.es_indexing_timeout,
                        max_retries=config.es_indexing_retries)
-    index_name = index_tree(tree, es, verbose=verbose)
+    # Take stock of the tree, mostly so VcsCache can find repos. We look again
+    # after building.
+    rescan(tree)
+    vcs_cache = VcsCache(tree)
+    if export_folder:
+        export_folder = join(export_folder, tree.name)
+    index_name = index_tree(tree, es, vcs_cache, verbose=verbose,
+                            incremental=incremental,
+                            export_folder=export_folder)
     if 'index' not in tree.config.skip_stages:
-        deploy_tree(tree, es, index_name)
+        if export_folder:
+            with open(join(export_folder, 'tree.json'), 'w') as file:
+                json.dump({'format': FORMAT,
+                           'tree': tree.name,
+                           'generated_date': config.generated_date,
+                           'vcs_revisions': vcs_cache.revisions()},
+                          file)
+        else:
+            deploy_tree(tree, es, index_name, vcs_cache.revisions())
+
+
+def load_and_deploy_tree(tree, export_folder):
+    """Load an index written by ``index_and_deploy_tree(export_folder=...)``
+    into a fresh ES index, and make it accessible.
+
+    The shards of bulk actions are sent in parallel, ``workers`` at a time.
+    If ``local_index_folder`` is configured, they are compiled into a
+    :mod:`~dxr.localsearch` index instead.
 
+    :arg export_folder: The folder passed to :func:`index_and_deploy_tree()`
 
-def deploy_tree(tree, es, index_name):
+    """
+    config = tree.config
+    folder = join(export_folder, tree.name)
+    try:
+        with open(join(folder, 'tree.json')) as file:
+            meta = json.load(file)
+        with open(join(folder, 'settings.json')) as file:
+            settings = json.load(file)
+    except IOError:
+        raise BuildError("There is no complete export of tree '%s' in %s." %
+                         (tree.name, export_folder))
+    if meta['format'] != FORMAT:
+        raise BuildError("The export of tree '%s' is of format %s, but this "
+                         "DXR speaks format %s." %
+                         (tree.name, meta['format'], FORMAT))
+
+    index = tree.es_index.format(format=FORMAT,
+                                 tree=tree.name,
+                                 unique=uuid1(),
+                                 config_path_hash=config.path_hash())
+    shards = [name for name in listdir(folder)
+              if name.endswith(ShardWriter.SUFFIX)]
+    if config.local_index_folder:
+        es = LocalSearch(config.local_index_folder)
+        print 'Compiling local index %s.' % index
+        index_folder = join(config.local_index_folder, index)
+        try:
+            build_local_index(index_folder,
+                              [join(folder, name) for name in shards])
+        except Exception:
+            rmtree(index_folder, ignore_errors=True)
+            raise
+    else:
+        es = ElasticSearch(config.es_hosts,
+                           timeout=config.es_indexing_timeout,
+                           max_retries=config.es_indexing_retries)
+        create_index_and_wait(es, index, settings=settings)
+        try:
+            sizer = BulkSizer(config.es_bulk_latency,
+                              config.es_bulk_max_docs,
+                              config.es_bulk_max_bytes)
+
+            def load_shard(name):
+                doc_type = name.split('-', 1)[0]
+                for chunk in sizer.chunks(ShardWriter.actions(join(folder,
+                                                                   name))):
+                    bulk_with_backoff(es, chunk, index, doc_type, sizer)
+
+            with ThreadPoolExecutor(max_workers=max(tree.workers, 1)) as pool:
+                futures = [pool.submit(load_shard, name) for name in shards]
+                for future in show_progress(futures, 'Loading shards'):
+                    future.result()
+            finish_index(es, index)
+        except Exception:
+            try:
+                es.delete_index(index)
+            except Exception:
+                pass
+            raise
+    deploy_tree(tree, es, index, meta['vcs_revisions'],
+                generated_date=meta['generated_date'])
+
+
+def deploy_tree(tree, es, index_name, vcs_revisions=None,
+                generated_date=None):
     """Point the ES aliases and catalog records to a newly built tree, and
     delete any obsoleted index.
 
+    :arg vcs_revisions: A map of VCS roots, relative to the source folder, to
+        the revisions that were indexed, for later incremental builds
+    :arg generated_date: The "generated on" date to show, if other than the
+        one in the config
+
     """
     config = tree.config
 
@@ -74,7 +216,10 @@ def deploy_tree(tree, es, index_name):
     alias = config.es_alias.format(format=FORMAT,
                                    tree=tree.name,
                                    config_path_hash=config.path_hash())
-    swap_alias(alias, index_name, es)
+    old_index = swap_alias(alias, index_name, es)
+    pages = page_store(config)
+    if old_index and pages:
+        pages.delete(old_index)
 
     # Create catalog index if it doesn't exist.
     try:
@@ -101,14 +246,24 @@ def deploy_tree(tree, es, index_name):
                             'format': UNANALYZED_STRING,
                             # In case es_alias changes in the conf file:
                             'es_alias': UNINDEXED_STRING,
+                            # The index behind the alias, whose pre-rendered
+                            # pages the web app should serve:
+                            'es_index': UNINDEXED_STRING,
                             # Needed so new trees or edited descriptions can show
                             # up without a WSGI restart:
                             'description': UNINDEXED_STRING,
                             # ["clang", "pygmentize"]:
                             'enabled_plugins': UNINDEXED_STRING,
-                            'generated_date': UNINDEXED_STRING
-                            # We may someday also need to serialize some plugin
-                            # configuration here.
+                            # So incremental builds can tell whether the
+                            # plugins' config has changed:
+                            'index_config': UNINDEXED_STRING,
+                            'generated_date': UNINDEXED_STRING,
+                            # [{"root": "some/repo", "revision": "a1b2c3"}],
+                            # so incremental builds know what changed:
+                            'vcs_revisions': {
+                                'type': 'object',
+                                'enabled': False
+                            }
                         }
                     }
                 }
@@ -123,15 +278,22 @@ def deploy_tree(tree, es, index_name):
              doc=dict(name=tree.name,
                       format=FORMAT,
                       es_alias=alias,
+                      es_index=index_name,
                       description=tree.description,
                       enabled_plugins=[p.name for p in tree.enabled_plugins],
-                      generated_date=config.generated_date),
+                      index_config=index_config(tree),
+                      generated_date=generated_date or config.generated_date,
+                      vcs_revisions=[{'root': root, 'revision': revision}
+                                     for root, revision in
+                                     sorted((vcs_revisions or {}).items())]),
              id='%s/%s' % (FORMAT, tree.name))
 
 
 def swap_alias(alias, index, es):
     """Point an ES alias to a new index, and delete the old index.
 
+    Return the name of the old index, or None if there wasn't one.
+
     :arg index: The new index name
 
     """
@@ -146,12 +308,195 @@ def swap_alias(alias, index, es):
     # Delete the old index.
     if old_index:
         es.delete_index(old_index)
+    return old_index
+
 
+def previous_build(tree, es, vcs_cache):
+    """Work out which files are unchanged since a tree's live index was built.
 
-def index_tree(tree, es, verbose=False):
+    Return the name of the live index and a predicate that takes a path
+    relative to the source folder and says whether that file is unchanged
+    according to version control. Untracked files always count as changed.
+    If an incremental build isn't possible, say why, and return (None, None).
+
+    """
+    def give_up(reason):
+        print 'Doing a full build, since %s' % reason
+        return None, None
+
+    config = tree.config
+    try:
+        frozen = es.get(config.es_catalog_index,
+                        TREE,
+                        '%s/%s' % (FORMAT, tree.name))['_source']
+        old_index = first(es.aliases(frozen['es_alias']))
+    except (ElasticHttpNotFoundError, KeyError):
+        return give_up('there is no live index of this format.')
+    if not old_index:
+        return give_up('there is no live index of this format.')
+    if frozen['enabled_plugins'] != [p.name for p in tree.enabled_plugins]:
+        return give_up('the enabled plugins have changed.')
+    if frozen.get('index_config') != index_config(tree):
+        return give_up('the config of the plugins or of compact_rendering '
+                       'has changed.')
+
+    old_revisions = dict((r['root'], r['revision']) for r in
+                         frozen.get('vcs_revisions', []))
+    changes = {}  # Vcs -> set of paths relative to its root
+    for root, vcs in vcs_cache.repos.iteritems():
+        revision = old_revisions.get(relpath(root, tree.source_folder))
+        if revision is None:
+            return give_up('no revision was recorded for %s.' % root)
+        try:
+            changes[vcs] = vcs.changed_paths(revision)
+        except NotImplementedError:
+            return give_up("%s can't list changed files." % vcs.get_vcs_name())
+        except CalledProcessError:
+            return give_up("%s doesn't know revision %s." % (root, revision))
+
+    def is_unchanged(rel_path):
+        vcs = vcs_cache.vcs_for_path(rel_path)
+        return (vcs is not None and
+                relpath(join(tree.source_folder, rel_path),
+                        vcs.get_root_dir()) not in changes[vcs])
+
+    return old_index, is_unchanged
+
+
+def index_config(tree):
+    """Return a hash of the config that shapes the docs of a tree's files,
+    so an incremental build can tell if it can keep any of them."""
+    return sha1(stable_repr(
+        [tree.compact_rendering] +
+        [(p.name, tree._section.get(p.name, {}))
+         for p in tree.enabled_plugins])).hexdigest()
+
+
+def copy_docs(es, old_index, index, paths, sizer):
+    """Copy the FILE and LINE docs of some files from one index to another.
+
+    Folders are left out, since we reindex them all anyway.
+
+    :arg paths: A set of unicode paths, relative to the source folder, whose
+        docs to copy
+    :arg sizer: The :class:`~dxr.es.BulkSizer` to size the bulk requests with
+
+    """
+    def docs():
+        for hit in scan_hits(
+                es,
+                old_index,
+                {'query': {'filtered': {
+                    'query': {'match_all': {}},
+                    'filter': {'not': {'term': {'is_folder': True}}}}}}):
+            source = hit['_source']
+            path = source['path'][0]
+            if path in paths:
+                # FILE docs are IDed by path and are the parents of LINE docs.
+                if hit['_type'] == FILE:
+                    yield es.index_op(source, doc_type=FILE, id=path)
+                else:
+                    yield es.index_op(source,
+                                      doc_type=LINE,
+                                      id=line_id(path, source['number'][0]),
+                                      parent=path)
+
+    with aligned_progressbar(sizer.chunks(docs()),
+                             show_eta=False,
+                             label='Copying unchanged') as chunks:
+        for chunk in chunks:
+            bulk_with_backoff(es, chunk, index, None, sizer)
+
+
+def line_id(path, number):
+    """Return the ID of a LINE doc.
+
+    LINE docs get IDs of their own, rather than ones ES makes up, so a bulk
+    request can be resent after a timeout without duplicating any lines.
+
+    """
+    return u'%s:%i' % (path, number)
+
+
+def index_settings(tree):
+    """Return the settings and mappings with which to create a tree's index."""
+    return {
+        'settings': {
+            'index': {
+                'number_of_shards': tree.es_shards,  # Fewer should be faster, assuming enough RAM.
+                'number_of_replicas': 0  # for speed
+            },
+            # Default analyzers and mappings are in the core plugin.
+            'analysis': reduce(
+                    deep_update,
+                    (p.analyzers for p in tree.enabled_plugins),
+                    {}),
+
+            # DXR indices are immutable once built. Turn the refresh interval
+            # down to keep the segment count low while indexing. It will make
+            # for less merging later. We could also simply call "optimize"
+            # after we're done indexing, but it is unthrottled; we'd have to
+            # use shard allocation to do the indexing on one box and then move
+            # it elsewhere for actual use.
+            'refresh_interval':
+                '%is' % tree.config.es_refresh_interval
+        },
+        'mappings': reduce(deep_update,
+                           (p.mappings for p in tree.enabled_plugins),
+                           {})
+    }
+
+
+def finish_index(es, index):
+    """Make a freshly filled index searchable and give it a replica.
+
+    Also report how big it came out, so changes to what we store can be
+    measured.
+
+    """
+    # refresh() times out in prod. Wait until it doesn't. That probably means
+    # things are ready to rock again.
+    with aligned_progressbar(repeat(None), label='Refreshing index') as bar:
+        for _ in bar:
+            try:
+                es.refresh(index=index)
+            except (ConnectionError, Timeout) as exc:
+                pass
+            else:
+                break
+
+    stats = es.send_request('GET', [index, '_stats', 'docs,store'])
+    primaries = stats['_all']['primaries']
+    print 'Index %s holds %s docs in %.1f MB.' % (
+        index,
+        primaries['docs']['count'],
+        primaries['store']['size_in_bytes'] / 1024.0 / 1024)
+
+    es.update_settings(
+        index,
+        {
+            'settings': {
+                'index': {
+                    'number_of_replicas': 1  # fairly arbitrary
+                }
+            }
+        })
+
+
+def index_tree(tree, es, vcs_cache, verbose=False, incremental=False,
+               export_folder=None):
     """Index a single tree into ES and the filesystem, and return the
     name of the new ES index.
 
+    :arg vcs_cache: The tree's :class:`~dxr.vcs.VcsCache`
+    :arg incremental: Whether to copy the docs of files that are unchanged,
+        according to version control, from the tree's live index rather than
+        reindexing them. If that's not possible, do a full build.
+    :arg export_folder: If not None, don't touch ES. Instead, write the index
+        settings and gzipped shards of bulk actions to this folder, to be
+        loaded later by :func:`load_and_deploy_tree()`. Incompatible with
+        ``incremental``.
+
     """
     def new_pool():
         return ProcessPoolExecutor(max_workers=tree.workers)
@@ -206,7 +551,6 @@ def index_tree(tree, es, verbose=False):
         ensure_folder(join(tree.temp_folder, 'plugins', plugin.name),
                       not skip_cleanup)
 
-    vcs_cache = VcsCache(tree)
     tree_indexers = [p.tree_to_index(p.name, tree, vcs_cache) for p in
                      tree.enabled_plugins if p.tree_to_index]
     try:
@@ -216,36 +560,12 @@ def index_tree(tree, es, verbose=False):
                                          tree=tree.name,
                                          unique=uuid1(),
                                          config_path_hash=config.path_hash())
-            create_index_and_wait(
-                es,
-                index,
-                settings={
-                    'settings': {
-                        'index': {
-                            'number_of_shards': tree.es_shards,  # Fewer should be faster, assuming enough RAM.
-                            'number_of_replicas': 0  # for speed
-                        },
-                        # Default analyzers and mappings are in the core plugin.
-                        'analysis': reduce(
-                                deep_update,
-                                (p.analyzers for p in tree.enabled_plugins),
-                                {}),
-
-                        # DXR indices are immutable once built. Turn the
-                        # refresh interval down to keep the segment count low
-                        # while indexing. It will make for less merging later.
-                        # We could also simply call "optimize" after we're
-                        # done indexing, but it is unthrottled; we'd have to
-                        # use shard allocation to do the indexing on one box
-                        # and then move it elsewhere for actual use.
-                        'refresh_interval':
-                            '%is' % config.es_refresh_interval
-                    },
-                    'mappings': reduce(deep_update,
-                                       (p.mappings for p in
-                                            tree.enabled_plugins),
-                                       {})
-                })
+            if export_folder:
+                ensure_folder(export_folder, clean=True)
+                with open(join(export_folder, 'settings.json'), 'w') as file:
+                    json.dump(index_settings(tree), file)
+            else:
+                create_index_and_wait(es, index, settings=index_settings(tree))
         else:
             index = None
             print "Skipping indexing (due to 'index' in 'skip_stages')"
@@ -258,41 +578,68 @@ def index_tree(tree, es, verbose=False):
         if not skip_build:
             # Set up env vars, and build:
             build_tree(tree, tree_indexers, verbose)
+            # The build may have added files to the source folder. Update the
+            # manifest before forking any more workers, so they inherit it.
+            rescan(tree)
         else:
             print "Skipping rebuild (due to 'build' in 'skip_stages')"
 
         # Post-build, and index files:
         if not skip_indexing:
+            unchanged = set()
+            if incremental:
+                old_index, is_unchanged = previous_build(tree, es, vcs_cache)
+                if old_index:
+                    unchanged = set(
+                        path for path in tree_manifest(tree).paths
+                        if is_unchanged(relpath(path, tree.source_folder)))
+                    unchanged_ids = set(
+                        unicode_for_display(relpath(path, tree.source_folder))
+                        for path in unchanged)
+                    copy_docs(es, old_index, index, unchanged_ids,
+                              BulkSizer(config.es_bulk_latency,
+                                        config.es_bulk_max_docs,
+                                        config.es_bulk_max_bytes))
+                    pages = page_store(config)
+                    if pages:
+                        pages.copy(old_index, index, unchanged_ids)
+
             with new_pool() as pool:
                 tree_indexers = farm_out('post_build')
-                index_files(tree, tree_indexers, index, pool, es)
-
-            # refresh() times out in prod. Wait until it doesn't. That
-            # probably means things are ready to rock again.
-            with aligned_progressbar(repeat(None), label='Refreshing index') as bar:
-                for _ in bar:
-                    try:
-                        es.refresh(index=index)
-                    except (ConnectionError, Timeout) as exc:
-                        pass
-                    else:
-                        break
+            cache = index_cache(tree, tree_indexers)
+
+            # ProcessPoolExecutor forks its workers upon the first submit, so
+            # a fresh pool's workers inherit whatever we set up now.
+            _worker_state.update(
+                tree=tree,
+                tree_indexers=tree_indexers,
+                cache=cache,
+                bulk_sizer=BulkSizer(config.es_bulk_latency,
+                                     config.es_bulk_max_docs,
+                                     config.es_bulk_max_bytes),
+                export_folder=export_folder,
+                # Exports may be loaded into indices of any name, so there's
+                # nowhere to put pages for them.
+                pages=None if export_folder else page_store(config))
+            try:
+                with new_pool() as pool:
+                    index_files(tree, index, pool, es, unchanged)
+            finally:
+                _worker_state.clear()
+            if cache:
+                print 'Evicted %s entries from the index cache.' % cache.prune()
 
-            es.update_settings(
-                index,
-                {
-                    'settings': {
-                        'index': {
-                            'number_of_replicas': 1  # fairly arbitrary
-                        }
-                    }
-                })
+            if not export_folder:
+                finish_index(es, index)
     except Exception as exc:
         # If anything went wrong, delete the index, because we're not
         # going to have a way of returning its name if we raise an
         # exception.
-        if not skip_indexing:
+        if not skip_indexing and not export_folder:
             delete_index_quietly(es, index)
+            pages = page_store(config)
+            if pages:
+                pages.delete(index)
         raise
 
     print "Finished '%s' in %s." % (tree.name, datetime.now() - start_time)
@@ -319,6 +666,33 @@ def show_progress(futures, message):
             yield future
 
 
+def submit_lazily(pool, calls, max_in_flight):
+    """Submit calls to a pool as earlier ones finish, and yield (tag, future)
+    pairs in order of completion.
+
+    Only ``max_in_flight`` calls are outstanding at once, and ``calls`` is
+    consumed only as fast as the pool drains, so memory use in the master
+    stays constant however many calls there are.
+
+    :arg calls: An iterable of (tag, callable, args, kwargs) tuples. The tag
+        is passed back alongside the call's future.
+
+    """
+    calls = iter(calls)
+    tags = {}  # future -> tag
+
+    def submit(how_many):
+        for tag, callable, args, kwargs in islice(calls, how_many):
+            tags[pool.submit(callable, *args, **kwargs)] = tag
+
+    submit(max_in_flight)
+    while tags:
+        done, _ = wait(tags.keys(), return_when=FIRST_COMPLETED)
+        submit(len(done))
+        for future in done:
+            yield tags.pop(future), future
+
+
 def save_scribbles(obj, method):
     """Call obj.method(), then return obj and the result so the master process
     can see anything method() scribbled on it.
@@ -342,22 +716,6 @@ def ensure_folder(folder, clean=False):
         makedirs(folder)
 
 
-def _unignored_folders(folders, source_path, ignore_filenames, ignore_paths):
-    """Yield the folders from ``folders`` which are not ignored by the given
-    patterns and paths.
-
-    :arg source_path: Relative path to the source directory
-    :arg ignore_filenames: Filename-based globs to be ignored
-    :arg ignore_paths: Path-based globs to be ignored
-
-    """
-    for folder in folders:
-        if not any(fnmatchcase(folder, p) for p in ignore_filenames):
-            folder_path = '/' + join(source_path, folder).replace(os.sep, '/') + '/'
-            if not any(fnmatchcase(folder_path, p) for p in ignore_paths):
-                yield folder
-
-
 def unicode_contents(path, encoding_guess):  # TODO: Make accessible to TreeToIndex.post_build.
     """Return the unicode contents of a file if we can figure out a decoding,
     or else None.
@@ -384,61 +742,62 @@ def unignored(folder, ignore_paths, ignore_filenames, want_folders=False):
     """Return an iterable of bytestring absolute paths to unignored source
     tree files or the folders that contain them.
 
-    Returned files include both binary and text ones.
+    Returned files include both binary and text ones. This walks the folder
+    afresh. Within a build, prefer :func:`~dxr.manifest.tree_manifest()`,
+    which walks the tree only once.
 
     :arg want_folders: If falsey, return files. If truthy, return folders
         instead.
 
     """
-    # On Linux (which is what we guarantee support for), paths are bags of
-    # bytes; they may not even be representable as Unicode code points.
-    if isinstance(folder, unicode):
-        folder = folder.encode('utf8')
-
-    def raise_(exc):
-        raise exc
-
-    # TODO: Expose a lot of pieces of this as routines plugins can call.
-    for root, folders, files in os.walk(folder, topdown=True, onerror=raise_):
-        # Find relative path
-        rel_path = relpath(root, folder)
-        if rel_path == '.':
-            rel_path = ''
-
-        if not want_folders:
-            for f in files:
-                # Ignore file if it matches an ignore pattern
-                if any(fnmatchcase(f, e) for e in ignore_filenames):
-                    continue  # Ignore the file.
-
-                path = join(rel_path, f)
-
-                # Ignore file if its path (relative to the root) matches an
-                # ignore path.
-                if any(fnmatchcase("/" + path.replace(os.sep, "/"), e) for e in ignore_paths):
-                    continue  # Ignore the file.
-
-                yield join(root, f)
-
-        # Exclude folders that match an ignore pattern.
-        # os.walk listens to any changes we make in `folders`.
-        folders[:] = _unignored_folders(
-            folders, rel_path, ignore_filenames, ignore_paths)
-        if want_folders:
-            for f in folders:
-                yield join(root, f)
-
-def index_file(tree, tree_indexers, path, es, index):
+    manifest = scan(folder, ignore_filenames, ignore_paths)
+    return manifest.folders if want_folders else manifest.paths
+
+
+def plugin_output(file_to_index, is_link, index_by_line):
+    """Return everything a FileToIndex has to say about its file, or None if
+    it isn't interested in the file.
+
+    Return a dict of lists, suitable for storing in an
+    :class:`~dxr.indexcache.IndexCache`.
+
+    """
+    if not file_to_index.is_interesting():
+        return None
+    output = {'needles': list(file_to_index.needles()),
+              'links': ([] if is_link else
+                        [(order, heading, list(items)) for order, heading, items
+                         in file_to_index.links()]),
+              'refs': [],
+              'regions': [],
+              'needles_by_line': [],
+              'annotations_by_line': []}
+    if index_by_line:
+        output['refs'] = list(file_to_index.refs())
+        output['regions'] = list(file_to_index.regions())
+        output['needles_by_line'] = [list(pairs) for pairs in
+                                     file_to_index.needles_by_line()]
+        output['annotations_by_line'] = [
+            list(annotations) for annotations in
+            file_to_index.annotations_by_line()]
+    return output
+
+
+def index_file(tree, tree_indexers, path, es, index, cache=None,
+               uploader=None, pages=None):
     """Index a single file into ES, and build a static HTML representation of it.
 
     For the moment, we execute plugins in series, figuring that we have plenty
-    of files to keep our processors busy in most trees that take very long. I'm
-    a little afraid of the cost of passing potentially large TreesToIndex to
-    worker processes. That goes at 52MB/s on my OS X laptop, measuring by the
-    size of the pickled object and including the pickling and unpickling time.
+    of files to keep our processors busy in most trees that take very long.
 
     :arg path: Bytestring absolute path to the file to index
     :arg index: The ES index name
+    :arg cache: An :class:`~dxr.indexcache.IndexCache` to consult before
+        asking plugins about the file, or None
+    :arg uploader: A :class:`~dxr.es.BulkUploader` to hand docs off to, or
+        None to send them synchronously
+    :arg pages: A :class:`~dxr.pages.PageStore` to put the rendered body of
+        the file's page into, or None
 
     """
     try:
@@ -466,23 +825,34 @@ def index_file(tree, tree_indexers, path, es, index):
         refses, regionses = [], []
     needles = {}
     linkses = []
+    # Symlinks don't get cached; their needles depend on their targets.
+    content_hash = cache and not is_link and file_hash(path)
 
     for tree_indexer in tree_indexers:
-        file_to_index = tree_indexer.file_to_index(rel_path, contents)
-        if file_to_index.is_interesting():
+        key = content_hash and cache.key(tree_indexer.plugin_name,
+                                         rel_path,
+                                         content_hash)
+        output = key and cache.get(key, tree)
+        if output is None:
+            output = plugin_output(
+                tree_indexer.file_to_index(rel_path, contents),
+                is_link,
+                index_by_line)
+            if key:
+                cache.put(key, output)
+        if output:
             # Per-file stuff:
-            append_update(needles, file_to_index.needles())
-            if not is_link:
-                linkses.append(file_to_index.links())
+            append_update(needles, output['needles'])
+            linkses.append(output['links'])
 
             # Per-line stuff:
             if index_by_line:
-                refses.append(file_to_index.refs())
-                regionses.append(file_to_index.regions())
+                refses.append(output['refs'])
+                regionses.append(output['regions'])
                 append_update_by_line(needles_by_line,
-                                      file_to_index.needles_by_line())
+                                      output['needles_by_line'])
                 append_by_line(annotations_by_line,
-                               file_to_index.annotations_by_line())
+                               output['annotations_by_line'])
 
     def docs():
         """Yield documents for bulk indexing.
@@ -491,10 +861,7 @@ def index_file(tree, tree_indexers, path, es, index):
         needles_by_line because they will no longer be used.
         """
         # Index a doc of type 'file' so we can build folder listings.
-        # At the moment, we send to ES in the same worker that does the
-        # indexing. We could interpose an external queueing system, but I'm
-        # willing to potentially sacrifice a little speed here for the easy
-        # management of self-throttling.
+        file_id = unicode_for_display(rel_path)
         file_info = stat(path)
         folder_name, file_name = split(rel_path)
         # Hard-code the keys that are hard-coded in the browse()
@@ -510,61 +877,118 @@ def index_file(tree, tree_indexers, path, es, index):
         links = dictify_links(chain.from_iterable(linkses))
         if links:
             doc['links'] = links
-        yield es.index_op(doc, doc_type=FILE)
+        # With compact rendering, the FILE doc goes last, once it can carry
+        # the packed-up decorations of all the lines.
+        packer = (RenderingPacker() if index_by_line and tree.compact_rendering
+                  else None)
+        if not packer:
+            # The path is the ID so LINE docs can name this as their parent.
+            yield es.index_op(doc, doc_type=FILE, id=file_id)
 
         # Index all the lines.
         if index_by_line:
-            for total, annotations_for_this_line, tags in izip(
+            # The HTML of each line, for text_file_body.html:
+            page_lines = [] if pages else None
+            menus = MenuTable()
+            for (total, annotations_for_this_line, line_tags, text,
+                 offset) in izip(
                     needles_by_line,
                     annotations_by_line,
-                    es_lines(finished_tags(lines,
-                                           chain.from_iterable(refses),
-                                           chain.from_iterable(regionses)))):
-                # Duplicate the file-wide needles into this line:
-                total.update(needles)
-
-                # We bucket tags into refs and regions for ES because later at
-                # request time we want to be able to merge them individually
-                # with those from skimmers.
-                refs_and_regions = bucket(tags, lambda index_obj: "regions" if
-                                          isinstance(index_obj['payload'], basestring) else
-                                          "refs")
-                if 'refs' in refs_and_regions:
-                    total['refs'] = refs_and_regions['refs']
-                if 'regions' in refs_and_regions:
-                    total['regions'] = refs_and_regions['regions']
-                if annotations_for_this_line:
-                    total['annotations'] = annotations_for_this_line
-                yield es.index_op(total)
+                    tags_per_line(finished_tags(
+                        lines,
+                        chain.from_iterable(refses),
+                        chain.from_iterable(regionses))),
+                    lines,
+                    build_offset_map(lines)):
+                # File-wide needles stay on the FILE doc, but we keep the
+                # path here for fetching and sorting lines:
+                total['path'] = [file_id]
+                tags = es_line(line_tags)
+                if pages:
+                    page_lines.append(html_line(text, line_tags, offset,
+                                                menus))
+
+                if packer:
+                    packer.add_line(tags, annotations_for_this_line)
+                else:
+                    # We bucket tags into refs and regions for ES because
+                    # later at request time we want to be able to merge them
+                    # individually with those from skimmers.
+                    refs_and_regions = bucket(
+                        tags,
+                        lambda index_obj: ("regions" if isinstance(
+                            index_obj['payload'], basestring) else "refs"))
+                    if 'refs' in refs_and_regions:
+                        total['refs'] = refs_and_regions['refs']
+                    if 'regions' in refs_and_regions:
+                        total['regions'] = refs_and_regions['regions']
+                    if annotations_for_this_line:
+                        total['annotations'] = annotations_for_this_line
+                yield es.index_op(total,
+                                  id=line_id(file_id, total['number'][0]),
+                                  parent=file_id)
 
                 # Because needles_by_line holds a reference, total is not
                 # garbage collected. Since we won't use it again, we can clear
                 # the contents, saving substantial memory on long files.
                 total.clear()
 
+            if pages:
+                pages.put(index,
+                          file_id,
+                          render_template('text_file_body.html',
+                                          annotation_sets=annotations_by_line,
+                                          line_count=len(page_lines),
+                                          code_lines=page_lines,
+                                          menus=menus,
+                                          is_binary=False))
+
+        if packer:
+            doc['rendering'] = packer.blob()
+            yield es.index_op(doc, doc_type=FILE, id=file_id)
+
     # Indexing a 277K-line file all in one request makes ES time out (>60s),
-    # so we chunk it up. 300 docs is optimal according to the benchmarks in
-    # https://bugzilla.mozilla.org/show_bug.cgi?id=1122685. So large docs like
-    # images don't make our chunk sizes ridiculous, there's a size ceiling as
-    # well: 10000 is based on the 300 and an average of 31 chars per line.
-    for chunk in bulk_chunks(docs(), docs_per_chunk=300, bytes_per_chunk=10000):
-        es.bulk(chunk, index=index, doc_type=LINE)
+    # so we chunk it up.
+    if uploader:
+        for chunk in uploader.sizer.chunks(docs()):
+            uploader.upload(chunk)
+    else:
+        # 300 docs is optimal according to the benchmarks in
+        # https://bugzilla.mozilla.org/show_bug.cgi?id=1122685. So large docs
+        # like images don't make our chunk sizes ridiculous, there's a size
+        # ceiling as well: 10000 is based on the 300 and an average of 31
+        # chars per line.
+        for chunk in bulk_chunks(docs(), docs_per_chunk=300,
+                                 bytes_per_chunk=10000):
+            es.bulk(chunk, index=index, doc_type=LINE)
 
 
-def index_chunk(tree,
-                tree_indexers,
-                paths,
+def index_chunk(paths,
                 index,
+                are_folders=False,
                 swallow_exc=False,
                 worker_number=None):
-    """Index a pile of files.
+    """Index a pile of files or folders.
+
+    This is the entrypoint for indexer pool workers. The tree, its
+    TreeToIndexes, the index cache, and the bulk request sizer come from
+    ``_worker_state``, inherited from the master. The sizer persists across
+    all the chunks a worker does, so what it learns carries over.
 
-    This is the entrypoint for indexer pool workers.
+    Return a pair: a failure (a tuple of formatted traceback, exception type,
+    exception value, and path) or None, and the (docs, bytes) bulk request
+    size the worker has settled on.
 
+    :arg are_folders: Whether ``paths`` are folders rather than files
     :arg worker_number: A unique number assigned to this worker so it knows
         what to call its log file
 
     """
+    tree = _worker_state['tree']
+    tree_indexers = _worker_state['tree_indexers']
+    cache = _worker_state['cache']
+    sizer = _worker_state['bulk_sizer']
+    pages = _worker_state['pages']
     path = '(no file yet)'
     try:
         # So we can use Flask's url_from():
@@ -575,72 +999,177 @@ def index_chunk(tree,
                 log = (worker_number and
                        open_log(tree.log_folder,
                                 'index-chunk-%s.log' % worker_number))
-                for path in paths:
-                    log and log.write('Starting %s.\n' % path)
-                    index_file(tree, tree_indexers, path, es, index)
-                log and log.write('Finished chunk.\n')
+                # Render the next file while the last one's docs are on their
+                # way to ES.
+                with bulk_sink(es, index,
+                               FILE if are_folders else LINE) as uploader:
+                    if are_folders:
+                        index_folders(tree, paths, es, uploader)
+                    else:
+                        for path in paths:
+                            log and log.write('Starting %s.\n' % path)
+                            index_file(tree, tree_indexers, path, es, index,
+                                       cache, uploader, pages)
+                log and log.write('Finished chunk. Bulk requests are up to '
+                                  '%s docs or %s bytes.\n' % (sizer.docs,
+                                                               sizer.bytes))
             finally:
                 log and log.close()
     except Exception as exc:
         if swallow_exc:
             type, value, traceback = exc_info()
-            return format_exc(), type, value, path
+            return (format_exc(), type, value, path), None
         else:
             raise
+    return None, (sizer.docs, sizer.bytes)
+
+
+def bulk_sink(es, index, doc_type):
+    """Return a :class:`~dxr.es.BulkUploader` for sending docs to an index,
+    or, if we're exporting rather than talking to ES, a
+    :class:`~dxr.es.ShardWriter` that quacks the same way.
+
+    The choice and the bulk request sizer come from ``_worker_state``.
 
+    """
+    sizer = _worker_state['bulk_sizer']
+    export_folder = _worker_state['export_folder']
+    if export_folder:
+        return ShardWriter(export_folder, doc_type, sizer)
+    return BulkUploader(es, index, doc_type, sizer)
+
+
+def index_folders(tree, folders, es, uploader):
+    """Index some folders into ES.
+
+    :arg folders: Bytestring absolute paths of folders
+    :arg uploader: The :class:`~dxr.es.BulkUploader` or
+        :class:`~dxr.es.ShardWriter` to send the docs through
 
-def index_folders(tree, index, es):
-    """Index the folder hierarchy into ES."""
+    """
     folder_indexers = [(p.name, p.folder_to_index)
                        for p in tree.enabled_plugins if p.folder_to_index]
-    with aligned_progressbar(unignored(tree.source_folder,
-                                       tree.ignore_paths,
-                                       tree.ignore_filenames,
-                                       want_folders=True),
-                     show_eta=False,  # never even close
-                     label='Indexing folders') as folders:
+
+    def docs():
         for folder in folders:
             needles = {'is_folder': True}
             for name, folder_to_index in folder_indexers:
                 needles.update(dict(folder_to_index(name, tree, folder).needles()))
-            es.index(index, FILE, needles)
+            # Folders are IDed by path, like files, so resent requests
+            # can't duplicate them.
+            yield es.index_op(needles, id=needles['path'][0])
 
+    for chunk in uploader.sizer.chunks(docs()):
+        uploader.upload(chunk)
 
-def index_files(tree, tree_indexers, index, pool, es):
-    """Divide source files into groups, and send them out to be indexed."""
 
-    def path_chunks(tree):
-        """Return an iterable of worker-sized iterables of paths."""
-        return ichunks(500, unignored(tree.source_folder,
-                                      tree.ignore_paths,
-                                      tree.ignore_filenames))
+def weighted_chunks(files, max_bytes, max_files):
+    """Group paths into chunks of roughly equal indexing cost.
+
+    Cost is dominated by file size, so rather than a fixed number of files,
+    give each chunk a byte budget. A file too big to share a chunk goes out on
+    its own, without waiting for the chunk in progress to fill up. That way,
+    no worker gets stuck chewing through a pile of giant generated files
+    while the others sit idle, and, since chunks are handed out as workers
+    free up, idle workers take up whatever work remains.
+
+    :arg files: An iterable of (absolute path, size) pairs
+    :arg max_bytes: The byte budget of a chunk
+    :arg max_files: The most files to put in a chunk, however small, to bound
+        the per-file overhead a single chunk can accumulate
 
-    index_folders(tree, index, es)
+    """
+    chunk, chunk_bytes = [], 0
+    for path, size in files:
+        if size >= max_bytes:
+            yield [path]
+            continue
+        if chunk and (chunk_bytes + size > max_bytes or
+                      len(chunk) >= max_files):
+            yield chunk
+            chunk, chunk_bytes = [], 0
+        chunk.append(path)
+        chunk_bytes += size
+    if chunk:
+        yield chunk
+
+
+def index_files(tree, index, pool, es, unchanged=frozenset()):
+    """Divide source folders and files into groups, and send them out to be
+    indexed.
+
+    Folders go first, so their chunks are done by the time the last files are
+    but still overlap with indexing the first ones. Chunks carry only paths;
+    the workers of ``pool`` must not have been forked before ``_worker_state``
+    was filled out.
+
+    :arg unchanged: A set of absolute paths of files whose docs have already
+        been copied from a previous index and thus should be skipped
 
+    """
+    def path_chunks(tree):
+        """Return an iterable of (are_folders, worker-sized list of paths)."""
+        manifest = tree_manifest(tree)
+        return chain(
+            ((True, folders) for folders in ichunks(CHUNK_FOLDERS,
+                                                    manifest.folders)),
+            ((False, paths) for paths in
+             weighted_chunks(((path, size) for path, size, _ in manifest.files
+                              if path not in unchanged),
+                             CHUNK_BYTES,
+                             CHUNK_FILES)))
+
+    settled_sizes = {}  # chunk number -> (docs, bytes)
     if not tree.workers:
-        for paths in path_chunks(tree):
-            index_chunk(tree,
-                        tree_indexers,
-                        paths,
-                        index,
-                        swallow_exc=False)
+        for are_folders, paths in path_chunks(tree):
+            _, settled_sizes[0] = index_chunk(paths,
+                                              index,
+                                              are_folders=are_folders,
+                                              swallow_exc=False)
     else:
-        futures = [pool.submit(index_chunk,
-                               tree,
-                               tree_indexers,
-                               paths,
-                               index,
-                               worker_number=worker_number,
-                               swallow_exc=True)
-                   for worker_number, paths in enumerate(path_chunks(tree), 1)]
-        for future in show_progress(futures, 'Indexing files'):
-            result = future.result()
-            if result:
-                formatted_tb, type, value, path = result
-                print 'A worker failed while indexing %s:' % path
-                print formatted_tb
-                # Abort everything if anything fails:
-                raise type, value  # exits with non-zero
+        calls = (((worker_number, are_folders, len(paths)),
+                  index_chunk,
+                  (paths, index),
+                  dict(are_folders=are_folders,
+                       worker_number=worker_number,
+                       swallow_exc=True))
+                 for worker_number, (are_folders, paths) in
+                 enumerate(path_chunks(tree), 1))
+        # Keep enough chunks queued that no worker goes idle waiting for the
+        # master to submit more, but not so many that they pile up in RAM.
+        finished = submit_lazily(pool, calls, 2 * tree.workers)
+        start = time()
+        counts = {True: 0, False: 0}  # are_folders -> number done
+
+        def throughput(_):
+            elapsed = time() - start
+            return '%s folders, %s files, %.1f files/s' % (
+                counts[True],
+                counts[False],
+                counts[False] / elapsed if elapsed else 0)
+
+        with aligned_progressbar(finished,
+                                 show_eta=False,  # total unknown
+                                 item_show_func=throughput,
+                                 label='Indexing files') as bar:
+            for (chunk_number, are_folders, chunk_size), future in bar:
+                failure, sizes = future.result()
+                if failure:
+                    formatted_tb, type, value, path = failure
+                    print 'A worker failed while indexing %s:' % path
+                    print formatted_tb
+                    # Abort everything if anything fails:
+                    raise type, value  # exits with non-zero
+                counts[are_folders] += chunk_size
+                settled_sizes[chunk_number] = sizes
+
+    # Report what the last chunk or so per worker settled on:
+    if settled_sizes and not _worker_state['export_folder']:
+        recent = [settled_sizes[number] for number in
+                  sorted(settled_sizes)[-max(tree.workers, 1):]]
+        print 'Bulk requests settled at about %s docs or %s bytes.' % (
+            sum(docs for docs, _ in recent) / len(recent),
+            sum(bytes for _, bytes in recent) / len(recent))
 
 
 def _fill_and_write_template(jinja_env, template_name, out_path, vars):
@@ -10,6 +10,7 @@ from dxr.cli.delete import delete
 from dxr.cli.deploy import deploy
 from dxr.cli.index import index
 from dxr.cli.list import list
+from dxr.cli.load import load
 from dxr.cli.serve import serve
 from dxr.cli.shell import shell
 
@@ -42,5 +43,6 @@ dxr.add_command(delete)
 dxr.add_command(deploy)
 dxr.add_command(index)
 dxr.add_command(list)
+dxr.add_command(load)
 dxr.add_command(serve)
 dxr.add_command(shell)
@@ -1,6 +1,6 @@
 from os import chdir
 
-from click import ClickException, command
+from click import ClickException, command, option
 
 from dxr.cli.utils import tree_objects, config_option, tree_names_argument
 from dxr.utils import run, CommandFailure, rmtree_if_exists
@@ -8,8 +8,11 @@ from dxr.utils import run, CommandFailure, rmtree_if_exists
 
 @command()
 @config_option
+@option('--cache',
+        is_flag=True,
+        help='Also delete the index cache, if one is configured.')
 @tree_names_argument
-def clean(config, tree_names):
+def clean(config, cache, tree_names):
     """Remove logs, temp files, and build artifacts.
 
     Remove the filesystem debris left after indexing one or more TREES, leaving
@@ -17,6 +20,8 @@ def clean(config, tree_names):
     `make clean` (or other clean_command from the config file) on trees.
 
     """
+    if cache and config.index_cache_folder:
+        rmtree_if_exists(config.index_cache_folder)
     for tree in tree_objects(tree_names, config):
         rmtree_if_exists(tree.log_folder)
         rmtree_if_exists(tree.temp_folder)
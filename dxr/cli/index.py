@@ -1,4 +1,4 @@
-from click import command, option
+from click import ClickException, command, option, Path
 
 from dxr.build import index_and_deploy_tree
 from dxr.cli.utils import tree_objects, config_option, tree_names_argument
@@ -10,17 +10,39 @@ from dxr.cli.utils import tree_objects, config_option, tree_names_argument
         is_flag=True,
         help='Display the build logs during the build instead of only '
              'on error.')
+@option('--incremental', '-i',
+        is_flag=True,
+        help='Copy the index entries of files that version control says are '
+             'unchanged since the last build, and reindex only the rest. '
+             'Falls back to a full build when that is not possible.')
+@option('--export', '-e',
+        'export_folder',
+        type=Path(file_okay=False, resolve_path=True),
+        help='Rather than sending the index to elasticsearch, write it to '
+             'gzipped shards in a folder per tree within this one, to be '
+             'sent later with "dxr load". Elasticsearch need not be running.')
 @tree_names_argument
-def index(config, verbose, tree_names):
+def index(config, verbose, incremental, export_folder, tree_names):
     """Build indices for one or more trees.
 
     When finished, update elasticsearch aliases and the catalog index to make
-    the new indices available to the DXR server process.
+    the new indices available to the DXR server process. With --export, leave
+    that to "dxr load".
 
     Each of TREES is an INI section title from the config file, specifying a
     source tree to build. If none are specified, we build all trees, in the
     order they occur in the file.
 
     """
+    if incremental and export_folder:
+        raise ClickException("--incremental needs the tree's live index, so "
+                             "it can't be used with --export.")
+    if incremental and config.local_index_folder:
+        raise ClickException("--incremental needs the tree's live index in "
+                             "elasticsearch, so it can't be used with "
+                             "local_index_folder.")
     for tree in tree_objects(tree_names, config):
-        index_and_deploy_tree(tree, verbose=verbose)
+        index_and_deploy_tree(tree,
+                              verbose=verbose,
+                              incremental=incremental,
+                              export_folder=export_folder)
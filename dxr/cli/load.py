@@ -0,0 +1,29 @@
+from click import ClickException, argument, command, Path
+
+from dxr.build import load_and_deploy_tree
+from dxr.cli.utils import tree_objects, config_option, tree_names_argument
+from dxr.exceptions import BuildError
+
+
+@command()
+@config_option
+@argument('export_folder',
+          type=Path(exists=True, file_okay=False, resolve_path=True))
+@tree_names_argument
+def load(config, export_folder, tree_names):
+    """Load indices written by "dxr index --export".
+
+    Send each tree's exported shards to a fresh elasticsearch index, in
+    parallel, and then update elasticsearch aliases and the catalog index to
+    make it available to the DXR server process, just as "dxr index" would.
+
+    EXPORT_FOLDER is the folder passed to --export. Each of TREES is an INI
+    section title from the config file. If none are specified, we load all
+    trees, in the order they occur in the file.
+
+    """
+    for tree in tree_objects(tree_names, config):
+        try:
+            load_and_deploy_tree(tree, export_folder)
+        except BuildError as exc:
+            raise ClickException(str(exc))
@@ -111,6 +111,12 @@ class Config(DotSection):
                         basestring,
                     Optional('log_folder', default=abspath('dxr-logs-{tree}')):
                         AbsPath,
+                    Optional('index_cache_folder', default=None): AbsPath,
+                    Optional('index_cache_size', default=4096):
+                        And(Use(int),
+                            lambda v: v >= 0,
+                            error='"index_cache_size" must be a non-negative '
+                                  'integer.'),
                     Optional('workers', default=if_raises(NotImplementedError,
                                                           cpu_count,
                                                           1)):
@@ -129,11 +135,45 @@ class Config(DotSection):
                         basestring,
                     Optional('es_catalog_replicas', default=1):
                         Use(int, error='"es_catalog_replicas" must be an integer.'),
+                    Optional('browse_window', default=0):
+                        And(Use(int),
+                            lambda v: v >= 0,
+                            error='"browse_window" must be a non-negative '
+                                  'integer.'),
+                    Optional('catalog_cache_ttl', default=5):
+                        And(Use(int),
+                            lambda v: v >= 0,
+                            error='"catalog_cache_ttl" must be a '
+                                  'non-negative integer.'),
                     Optional('max_thumbnail_size', default=20000):
                         And(Use(int),
                             lambda v: v >= 0,
                             error='"max_thumbnail_size" must be a non-negative '
                                   'integer.'),
+                    Optional('prerender_folder', default=None): AbsPath,
+                    Optional('search_cache_size', default=1000):
+                        And(Use(int),
+                            lambda v: v >= 0,
+                            error='"search_cache_size" must be a '
+                                  'non-negative integer.'),
+                    Optional('search_cache_servers', default=[]):
+                        WhitespaceList,
+                    Optional('regexp_candidate_budget', default=0):
+                        And(Use(int),
+                            lambda v: v >= 0,
+                            error='"regexp_candidate_budget" must be a '
+                                  'non-negative integer.'),
+                    Optional('regexp_scan_budget', default=0):
+                        And(Use(int),
+                            lambda v: v >= 0,
+                            error='"regexp_scan_budget" must be a '
+                                  'non-negative integer.'),
+                    Optional('regexp_scan_timeout', default=2.0):
+                        And(Use(float),
+                            lambda v: v > 0,
+                            error='"regexp_scan_timeout" must be a positive '
+                                  'number.'),
+                    Optional('local_index_folder', default=None): AbsPath,
                     Optional('es_indexing_timeout', default=60):
                         And(Use(int),
                             lambda v: v >= 0,
@@ -145,7 +185,22 @@ class Config(DotSection):
                             error='"es_indexing_retries" must be a non-negative '
                                   'integer.'),
                     Optional('es_refresh_interval', default=60):
-                        Use(int, error='"es_refresh_interval" must be an integer.')
+                        Use(int, error='"es_refresh_interval" must be an integer.'),
+                    Optional('es_bulk_latency', default=2.0):
+                        And(Use(float),
+                            lambda v: v > 0,
+                            error='"es_bulk_latency" must be a positive '
+                                  'number.'),
+                    Optional('es_bulk_max_docs', default=5000):
+                        And(Use(int),
+                            lambda v: v > 0,
+                            error='"es_bulk_max_docs" must be a positive '
+                                  'integer.'),
+                    Optional('es_bulk_max_bytes', default=5000000):
+                        And(Use(int),
+                            lambda v: v > 0,
+                            error='"es_bulk_max_bytes" must be a positive '
+                                  'integer.')
                 },
                 basestring: dict
             })
@@ -216,6 +271,7 @@ class TreeConfig(DotSectionWrapper):
         schema = Schema({
             Optional('build_command', default='make -j {workers}'): basestring,
             Optional('clean_command', default='make clean'): basestring,
+            Optional('compact_rendering', default=False): Boolean,
             Optional('description', default=''): basestring,
             Optional('disabled_plugins', default=plugin_list('')): Plugins,
             Optional('enabled_plugins', default=plugin_list('*')): Plugins,
@@ -339,6 +395,13 @@ WhitespaceList = And(basestring,
                      error='This should be a whitespace-separated list.')
 
 
+BOOLEANS = {'true': True, 'yes': True, 'on': True, '1': True,
+            'false': False, 'no': False, 'off': False, '0': False}
+Boolean = And(basestring,
+              Use(lambda value: BOOLEANS[value.strip().lower()]),
+              error='This should be true or false.')
+
+
 # Turn a filesystem path into an absolute one so changing the working
 # directory doesn't keep us from finding them.
 AbsPath = And(basestring, Use(abspath), error='This should be a path.')
@@ -1,7 +1,17 @@
 """Elasticsearch utilities not general enough to lift into pyelasticsearch"""
 
+import gzip
+from itertools import izip
+from os.path import join
+from Queue import Queue
+from sys import exc_info
+from threading import Lock, Thread
+from time import sleep, time
+from uuid import uuid4
+
 from flask import current_app
-from pyelasticsearch import ElasticHttpNotFoundError
+from pyelasticsearch import (BulkError, ElasticHttpError,
+                             ElasticHttpNotFoundError, Timeout)
 from werkzeug.exceptions import NotFound
 
 from dxr.config import FORMAT
@@ -34,23 +44,78 @@ UNINDEXED_LONG = {
 TREE = 'tree'  # 'tree' doctype
 
 
+class CatalogCache(object):
+    """A per-process copy of the catalog's tree docs of the current format
+
+    Frozen configs are consulted several times per request, so we keep them
+    for ``ttl`` seconds. After that, we ask ES for just the fields that change
+    when a tree is rebuilt or its alias moves, refetching the whole docs only
+    if those differ. A ``ttl`` of 0 turns off caching.
+
+    """
+    # What changes whenever a tree is redeployed. es_index changes on its own
+    # when an alias is swapped or an index is loaded under an old date.
+    STAMP_FIELDS = ['name', 'generated_date', 'es_alias', 'es_index']
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._trees = None  # A list of tree docs, sorted by name
+        self._stamps = None
+        self._checked = 0
+        self._lock = Lock()
+
+    def _fetch(self, include=None):
+        return filtered_query(current_app.dxr_config.es_catalog_index,
+                              TREE,
+                              filter={'format': FORMAT},
+                              sort=['name'],
+                              size=10000,
+                              include=include)
+
+    def _stamp(self, trees):
+        return [[tree.get(f) for f in self.STAMP_FIELDS] for tree in trees]
+
+    def trees(self):
+        """Return a list of dicts, each describing a tree, sorted by name."""
+        if not self.ttl:
+            return self._fetch()
+        with self._lock:
+            now = time()
+            if self._trees is not None and now - self._checked >= self.ttl:
+                if (self._stamp(self._fetch(include=self.STAMP_FIELDS)) !=
+                        self._stamps):
+                    self._trees = None
+                self._checked = now
+            if self._trees is None:
+                self._trees = self._fetch()
+                self._stamps = self._stamp(self._trees)
+                self._checked = now
+            return self._trees
+
+    def tree(self, name):
+        """Return the doc describing a tree, or None if there isn't one."""
+        for tree in self.trees():
+            if tree['name'] == name:
+                return tree
+
+
 def frozen_configs():
     """Return a list of dicts, each describing a tree of the current format
     version."""
-    return filtered_query(current_app.dxr_config.es_catalog_index,
-                          TREE,
-                          filter={'format': FORMAT},
-                          sort=['name'],
-                          size=10000)
+    return current_app.catalog.trees()
 
 
 def frozen_config(tree_name):
     """Return the bits of config that are "frozen" in place upon indexing.
 
     Return the ES "tree" doc for the given tree at the current format
-    version. Raise NotFound if the tree
+    version. Raise NotFound if the tree doesn't exist.
 
     """
+    frozen = current_app.catalog.tree(tree_name)
+    if frozen is not None:
+        return frozen
+    # Perhaps it's newer than our cache:
     try:
         frozen = current_app.es.get(current_app.dxr_config.es_catalog_index,
                                     TREE,
@@ -117,3 +182,297 @@ def create_index_and_wait(es, index, settings=None):
 def sources(search_results):
     """Return just the _source attributes of some ES search results."""
     return [r['_source'] for r in search_results]
+
+
+def scan_hits(es, index, query, size=500, scroll='5m'):
+    """Yield every hit matching a query, in no particular order.
+
+    This uses a scan-type scroll, so it won't bog down on deep result sets
+    like paging with ``from`` would.
+
+    :arg size: The number of hits to fetch per shard per round trip
+
+    """
+    response = es.search(query,
+                         index=index,
+                         size=size,
+                         es_search_type='scan',
+                         es_scroll=scroll)
+    while True:
+        response = es.send_request('GET',
+                                   ['_search', 'scroll'],
+                                   body=response['_scroll_id'],
+                                   query_params={'scroll': scroll})
+        hits = response['hits']['hits']
+        if not hits:
+            break
+        for hit in hits:
+            yield hit
+
+
+class BulkSizer(object):
+    """A controller that adapts the size of bulk requests to how ES copes
+
+    Requests answered within the target latency make the next ones a little
+    bigger; slower ones make them a little smaller. Rejections (HTTP 429,
+    meaning ES's bulk queue is full) and timeouts halve them. That's the
+    familiar additive-increase, multiplicative-decrease dance, with the
+    increase scaled to the current size so we get up to speed quickly on a
+    cluster with lots of headroom.
+
+    Safe to share among uploader threads.
+
+    """
+    # Starting sizes, per the benchmarks in
+    # https://bugzilla.mozilla.org/show_bug.cgi?id=1122685: 300 docs, with a
+    # ceiling of 10000 bytes so large docs like images don't make requests
+    # ridiculous.
+    INITIAL_DOCS = 300
+    INITIAL_BYTES = 10000
+
+    # Below these, per-request overhead dominates. Halving no further.
+    MIN_DOCS = 10
+    MIN_BYTES = 1000
+
+    def __init__(self, target_latency, max_docs, max_bytes):
+        """
+        :arg target_latency: The number of seconds we'd like each bulk
+            request to take
+        :arg max_docs: The most docs to put in a request
+        :arg max_bytes: The most bytes to put in a request, give or take a
+            doc
+
+        """
+        self.target_latency = target_latency
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.docs = min(self.INITIAL_DOCS, max_docs)
+        self.bytes = min(self.INITIAL_BYTES, max_bytes)
+        self._lock = Lock()
+
+    def _scale(self, factor):
+        with self._lock:
+            self.docs = int(max(self.MIN_DOCS,
+                                min(self.max_docs, self.docs * factor)))
+            self.bytes = int(max(self.MIN_BYTES,
+                                 min(self.max_bytes, self.bytes * factor)))
+
+    def answered(self, seconds):
+        """Note that a request was answered in the given number of seconds."""
+        self._scale(1.1 if seconds <= self.target_latency else 0.9)
+
+    def overloaded(self):
+        """Note that ES rejected a request or timed out."""
+        self._scale(0.5)
+
+    def chunks(self, actions):
+        """Divide an iterable of bulk actions into requests of the current
+        size, checking it afresh for each request."""
+        chunk = []
+        docs = bytes = 0
+        for action in actions:
+            next_len = len(action) + 1  # +1 for \n
+            if chunk and (docs >= self.docs or bytes + next_len > self.bytes):
+                yield chunk
+                chunk = []
+                docs = bytes = 0
+            chunk.append(action)
+            docs += 1
+            bytes += next_len
+        if chunk:
+            yield chunk
+
+
+def _status(item):
+    """Return the HTTP status of one item of a bulk response."""
+    return item.values()[0].get('status', 999)
+
+
+def bulk_with_backoff(es, actions, index, doc_type, sizer, tries=8):
+    """Send a list of bulk actions, retrying rejected ones.
+
+    Whole requests that time out or are rejected with a 429 are retried, as
+    are the individual actions ES rejects for want of bulk queue space, each
+    time after a doubled delay. A request that timed out may have been
+    applied anyway, so every action must carry an ID, making the retry
+    overwrite rather than duplicate its docs. Report every outcome to
+    ``sizer``, a :class:`BulkSizer`.
+
+    Raise :class:`~pyelasticsearch.BulkError` if any actions fail for reasons
+    other than rejection, or the last exception if we run out of tries.
+
+    """
+    delay = 0.5
+    for attempt in xrange(1, tries + 1):
+        start = time()
+        try:
+            response = es.send_request('POST',
+                                       [index, doc_type, '_bulk'],
+                                       body='\n'.join(actions) + '\n')
+        except Timeout:
+            sizer.overloaded()
+            if attempt == tries:
+                raise
+        except ElasticHttpError as exc:
+            if exc.status_code != 429:
+                raise
+            sizer.overloaded()
+            if attempt == tries:
+                raise
+        else:
+            sizer.answered(time() - start)
+            if not response.get('errors', True):
+                return
+            rejected, errors, successes = [], [], []
+            for action, item in izip(actions, response['items']):
+                status = _status(item)
+                if status == 429:
+                    rejected.append(action)
+                    errors.append(item)
+                elif not 200 <= status < 300:
+                    errors.append(item)
+                else:
+                    successes.append(item)
+            if len(errors) > len(rejected) or attempt == tries:
+                raise BulkError(errors, successes)
+            if not rejected:
+                return
+            sizer.overloaded()
+            actions = rejected
+        sleep(delay)
+        delay *= 2
+
+
+class BulkUploader(object):
+    """A little pipeline stage that sends bulk requests from background threads
+
+    Hand :meth:`upload()` chunks of serialized actions, and a few uploader
+    threads send them to ES while the caller gets on with producing the next
+    ones. The queue between them is bounded, so, if ES falls behind,
+    :meth:`upload()` blocks, throttling the producer rather than letting
+    chunks pile up in RAM. The threads share the ElasticSearch object's
+    connection pool, so connections are kept alive across requests.
+
+    Requests are sent by :func:`bulk_with_backoff()`, so rejections are
+    retried. If a request fails anyway, the exception is re-raised from the
+    next call to :meth:`upload()` or :meth:`close()`, and remaining chunks are
+    dropped. Use it as a context manager to make sure everything gets flushed.
+
+    """
+    def __init__(self, es, index, doc_type, sizer, threads=2, backlog=4):
+        """
+        :arg sizer: A :class:`BulkSizer` to report request outcomes to. Divide
+            actions into chunks with its :meth:`~BulkSizer.chunks()`.
+        :arg threads: The number of concurrent bulk requests to have in flight
+        :arg backlog: The number of chunks that can wait for an uploader
+            before :meth:`upload()` blocks
+
+        """
+        self._es = es
+        self._index = index
+        self._doc_type = doc_type
+        self.sizer = sizer
+        self._queue = Queue(maxsize=backlog)
+        self._failure = None
+        self._threads = [Thread(target=self._drain) for _ in xrange(threads)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def _drain(self):
+        """Send chunks until told to stop by a None."""
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                return
+            if self._failure is None:
+                try:
+                    bulk_with_backoff(self._es,
+                                      chunk,
+                                      self._index,
+                                      self._doc_type,
+                                      self.sizer)
+                except Exception:
+                    self._failure = exc_info()
+
+    def _raise_failure(self):
+        if self._failure is not None:
+            type, value, traceback = self._failure
+            raise type, value, traceback
+
+    def upload(self, chunk):
+        """Queue a list of bulk actions to be sent, blocking if the uploaders
+        are behind."""
+        self._raise_failure()
+        self._queue.put(chunk)
+
+    def close(self):
+        """Wait for everything queued to be sent, and stop the threads."""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._raise_failure()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.close()
+        else:
+            # Don't mask the original exception with an upload failure.
+            try:
+                self.close()
+            except Exception:
+                pass
+
+
+class ShardWriter(object):
+    """A stand-in for :class:`BulkUploader` that writes bulk actions to a
+    gzipped NDJSON file rather than sending them to ES
+
+    Each instance writes its own file, so any number of them can write into
+    the same folder at once. The file is named after the doc type the
+    actions default to, which is all that's needed, besides the index, to
+    send them to ES later.
+
+    """
+    SUFFIX = '.ndjson.gz'
+
+    def __init__(self, folder, doc_type, sizer):
+        self.path = join(folder, '%s-%s%s' % (doc_type, uuid4(), self.SUFFIX))
+        self.sizer = sizer
+        self._file = None
+
+    def upload(self, chunk):
+        """Write a list of bulk actions."""
+        if self._file is None:  # Don't litter empty files.
+            self._file = gzip.open(self.path, 'wb', 6)
+        for action in chunk:
+            self._file.write(action + '\n')
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    @staticmethod
+    def actions(path):
+        """Yield the bulk actions from a file written by a ShardWriter.
+
+        Every action we write is an index op, which is a pair of lines: the
+        action and the doc.
+
+        """
+        with gzip.open(path, 'rb') as file:
+            while True:
+                action = file.readline()
+                if not action:
+                    break
+                yield action + file.readline().rstrip('\n')
@@ -49,6 +49,17 @@ class Filter(object):
     :ivar is_identifier: Whether to include this filter in the "id:" aggregate
         filter
 
+    A LINE-domain filter whose :meth:`filter()` is expensive for ES to run,
+    like one calling out to a script, may also offer a two-phase form by
+    implementing ``candidate_filter()``, which returns a cheaper ES filter
+    clause finding a superset of the same lines, and ``verify(result)``,
+    which returns whether a found line really matches. When the
+    ``regexp_candidate_budget`` option is set, queries use these instead. If
+    the filter sometimes can't narrow down the lines at all, it should also
+    have an ``is_accelerated`` attribute saying so; then :meth:`filter()` may
+    refuse the term, and ``regexp_scan_budget`` decides whether we scan for
+    it anyway.
+
     """
     domain = LINE
     description = u''
@@ -87,6 +98,18 @@ class Filter(object):
         """
         raise NotImplementedError
 
+    def source_fields(self):
+        """Return a list of the fields of found docs that my
+        ``highlight_*()`` and ``verify()`` methods look at, beyond the path,
+        line number, and content every search result fetches anyway.
+
+        Searches fetch only the fields declared by their filters, which keeps
+        bulky ones, like rendering data, from coming along for nothing. Return
+        None, the default, to fetch all fields.
+
+        """
+        return None
+
     def highlight_path(self, result):
         """Return an unsorted iterable of extents that should be highlighted in
         the ``path`` field of a search result.
@@ -128,6 +151,24 @@ def negatable(filter_method):
     return maybe_negate
 
 
+def filter_clause(filter, domain):
+    """Return a filter's ES filter clause, adapted to search docs of the given
+    domain.
+
+    File-wide needles are stored only on FILE docs, which are the parents of
+    their files' LINE docs. So, to use a FILE-domain filter in a LINE-domain
+    query, ask about the parent.
+
+    :arg filter: A :class:`Filter` instance
+    :arg domain: LINE or FILE
+
+    """
+    clause = filter.filter()
+    if clause and domain == LINE and filter.domain == FILE:
+        return {'has_parent': {'parent_type': FILE, 'filter': clause}}
+    return clause
+
+
 class NameFilterBase(Filter):
     """An exact-match filter for things exposing a single value to compare
     against
@@ -178,6 +219,9 @@ class NameFilterBase(Filter):
                 }
             }
 
+    def source_fields(self):
+        return [self._needle]
+
     @negatable
     def filter(self):
         """Find things by their "name" properties, case-sensitive or not.
@@ -0,0 +1,199 @@
+"""A persistent cache of what plugins had to say about files during indexing
+
+Most files are byte-for-byte identical from one indexing run to the next, so
+rather than running every FileToIndex over them again, we remember each
+plugin's output for a file under a key derived from the file's contents and
+path, the plugin's name, DXR's format version (which we bump whenever indexer
+output changes), the relevant configuration, and an optional tree-wide
+fingerprint supplied by the plugin's TreeToIndex.
+
+"""
+import cPickle
+from errno import ENOENT
+from hashlib import sha1
+from os import listdir, makedirs, remove, rename, stat, utime
+from os.path import isdir, join
+from uuid import uuid1
+import zlib
+
+from dxr.config import FORMAT
+from dxr.lines import Ref, Region
+from dxr.utils import stable_repr
+
+
+class IndexCache(object):
+    """A size-bounded, on-disk map of cache keys to plugin output
+
+    Entries are files named for their keys. Every hit bumps an entry's mtime,
+    so :meth:`prune()` can evict the least recently used ones.
+
+    Instances are small and pickleable, so they can travel to worker
+    processes if need be.
+
+    """
+    def __init__(self, folder, max_bytes, key_prefixes):
+        """
+        :arg folder: Where to keep the cache
+        :arg max_bytes: The size to prune the cache down to
+        :arg key_prefixes: A map of plugin names to the part of the key that
+            doesn't vary from file to file, or to None if the plugin's output
+            mustn't be cached
+
+        """
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.key_prefixes = key_prefixes
+
+    def key(self, plugin_name, rel_path, content_hash):
+        """Return the key under which to store a plugin's output for a file,
+        or None if that plugin's output isn't cacheable."""
+        prefix = self.key_prefixes.get(plugin_name)
+        if prefix is not None:
+            return sha1('\0'.join([prefix, rel_path, content_hash])).hexdigest()
+
+    def _path(self, key):
+        return join(self.folder, key[:2], key)
+
+    def get(self, key, tree):
+        """Return the cached output stored under a key, an empty dict if the
+        plugin wasn't interested in the file, or None if there's no entry.
+
+        An entry that can't be read back, like one truncated by a full disk,
+        is deleted and counts as a miss.
+
+        :arg tree: The TreeConfig to hang reconstituted Refs off of
+
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            utime(path, None)
+        except (IOError, OSError) as exc:
+            if exc.errno == ENOENT:
+                return None
+            raise
+        try:
+            output = cPickle.loads(zlib.decompress(data))
+        except (zlib.error, EOFError, ValueError, cPickle.UnpicklingError):
+            try:
+                remove(path)
+            except OSError:  # Another worker beat us to it.
+                pass
+            return None
+        return _thawed(output, tree)
+
+    def put(self, key, output):
+        """Store a plugin's output for a file.
+
+        The write is atomic, so concurrent workers indexing identical files
+        can't corrupt each other's entries.
+
+        """
+        path = self._path(key)
+        folder = join(self.folder, key[:2])
+        if not isdir(folder):
+            try:
+                makedirs(folder)
+            except OSError:  # Another worker beat us to it.
+                pass
+        temp_path = '%s.%s.tmp' % (path, uuid1())
+        with open(temp_path, 'wb') as file:
+            file.write(zlib.compress(cPickle.dumps(_frozen(output), 2)))
+        rename(temp_path, path)
+
+    def prune(self):
+        """Delete least recently used entries until the cache fits within
+        ``max_bytes``. Return the number of entries deleted."""
+        if not isdir(self.folder):
+            return 0
+        entries = []
+        total = 0
+        for subfolder in listdir(self.folder):
+            subfolder = join(self.folder, subfolder)
+            for name in listdir(subfolder):
+                path = join(subfolder, name)
+                info = stat(path)
+                entries.append((info.st_mtime, info.st_size, path))
+                total += info.st_size
+        entries.sort()
+        deleted = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            remove(path)
+            total -= size
+            deleted += 1
+        return deleted
+
+
+def index_cache(tree, tree_indexers):
+    """Return an :class:`IndexCache` for a tree, or None if caching is turned
+    off.
+
+    Call this after ``post_build()`` so tree-wide fingerprints reflect the
+    analysis that has been done.
+
+    """
+    config = tree.config
+    if not config.index_cache_folder:
+        return None
+    # Things every plugin's output can depend on. Tree name and www_root make
+    # it into URLs.
+    common = [FORMAT, tree.name, tree.source_encoding, config.www_root]
+    prefixes = {}
+    for tree_indexer in tree_indexers:
+        fingerprint = tree_indexer.cache_fingerprint()
+        if fingerprint is None:
+            prefixes[tree_indexer.plugin_name] = None
+        else:
+            plugin_config = tree._section.get(tree_indexer.plugin_name, {})
+            prefixes[tree_indexer.plugin_name] = sha1('\0'.join(
+                common + [tree_indexer.plugin_name,
+                          stable_repr(plugin_config),
+                          fingerprint])).hexdigest()
+    return IndexCache(config.index_cache_folder,
+                      config.index_cache_size * 1024 * 1024,
+                      prefixes)
+
+
+def file_hash(path):
+    """Return the hex SHA-1 of a file's contents."""
+    hasher = sha1()
+    with open(path, 'rb') as file:
+        while True:
+            block = file.read(65536)
+            if not block:
+                break
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def _frozen(output):
+    """Make a plugin's output pickleable without dragging its tree along.
+
+    Refs hold a reference to the whole TreeConfig, so store them the way ES
+    does instead.
+
+    """
+    if not output:
+        return {}  # not interested in the file
+    ret = output.copy()
+    ret['refs'] = [(start, end, ref.es()) for start, end, ref in output['refs']]
+    ret['regions'] = [(start, end, region.css_class)
+                      for start, end, region in output['regions']]
+    return ret
+
+
+def _thawed(output, tree):
+    """Undo :func:`_frozen()`."""
+    if not output:
+        return output
+    output['refs'] = [Ref.es_to_triple({'start': start,
+                                        'end': end,
+                                        'payload': payload},
+                                       tree)
+                      for start, end, payload in output['refs']]
+    output['regions'] = [(start, end, Region(css_class))
+                         for start, end, css_class in output['regions']]
+    return output
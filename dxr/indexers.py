@@ -84,11 +84,13 @@ class TreeToIndex(PluginConfig):
     as a repository for scratch data that should persist across an entire
     indexing run.
 
-    Instances must be pickleable so as to make the journey to worker processes.
-    You might also want to keep the size down. It takes on the order of 2s for
-    a 150MB pickle to make its way across process boundaries, including
-    pickling and unpickling time. For this reason, we send the TreeToIndex once
-    and then have it index several files before sending it again.
+    Instances must be pickleable so as to make the journey back from the
+    worker processes that run the pre- and post-build hooks. You might also
+    want to keep the size down. It takes on the order of 2s for a 150MB pickle
+    to make its way across process boundaries, including pickling and
+    unpickling time. Workers indexing files don't pay that cost, though: they
+    are forked after ``post_build()`` and inherit the TreeToIndex from the
+    master.
 
     """
     def __init__(self, plugin_name, tree, vcs_cache):
@@ -137,6 +139,25 @@ class TreeToIndex(PluginConfig):
 
         """
 
+    def cache_fingerprint(self):
+        """Return a string summarizing any tree-wide state my FileToIndexes'
+        output depends on, or None if it can't be cached.
+
+        When an index cache is configured, the output of my FileToIndex for
+        each file is stored under a key made from the file's path and
+        contents, the plugin name and config, the DXR format version, and
+        this. Return something that changes whenever whole-tree analysis
+        would change the output for an otherwise unchanged file. Return None
+        if the output depends on things which can't be summarized cheaply,
+        like VCS state or the presence of neighboring files. This is called
+        once, after :meth:`post_build()`.
+
+        The default is None, since we can't know what a plugin looks at.
+        Return '' if the output depends on nothing tree-wide at all.
+
+        """
+        return None
+
     def file_to_index(self, path, contents):
         """Return an object that provides data about a given file.
 
@@ -224,6 +245,12 @@ class FileToSkim(PluginConfig):
         :meth:`~dxr.indexers.FileToSkim.links()`,
         :meth:`~dxr.indexers.FileToSkim.refs()`, etc.
 
+        When browsing a long file, this is first asked with only the file's
+        opening lines as contents; if no skimmer is interested, the page is
+        streamed without ever holding the whole file. Where a page was
+        rendered at index time, it is first asked with no contents at all,
+        and the stored page is served if no skimmer is interested.
+
         The default implementation selects only text files that are not symlinks.
         Note: even if a plugin decides that symlinks are interesting, it should
         remember that links, refs, regions and by-line annotations will not be
@@ -5,6 +5,7 @@ The typical entrypoints are es_lines() and html_line().
 Within this file, "tag" means a tuple of (file-wide offset, is_start, payload).
 
 """
+from base64 import b64decode, b64encode
 import cgi
 from itertools import chain
 try:
@@ -14,7 +15,9 @@ except ImportError:
     def compress(data, selectors):
         return (d for d, s in izip(data, selectors) if s)
 import json
+from operator import itemgetter
 from warnings import warn
+import zlib
 
 from jinja2 import Markup
 
@@ -60,7 +63,7 @@ class Ref(object):
 
     """
     sort_order = 1
-    __slots__ = ['menu_data', 'hover', 'qualname_hash']
+    __slots__ = ['_menu_data', '_menu_json', 'hover', 'qualname_hash']
     __metaclass__ = RefClassIdTagger
 
     def __init__(self, tree, menu_data, hover=None, qualname=None, qualname_hash=None):
@@ -81,6 +84,37 @@ class Ref(object):
         self.hover = hover
         self.qualname_hash = hash(qualname) if qualname else qualname_hash
 
+    @classmethod
+    def _from_index(cls, tree, menu_json, hover=None, qualname_hash=None):
+        """Return an instance made from ES-dwelling properties, leaving the
+        menu data JSON-encoded until something asks for it.
+
+        Most refs on a page never have their menus built: their anchors point
+        to the :class:`MenuTable` entry of an earlier, alike ref.
+
+        We skip the constructor, since subclasses may expect real menu data
+        there, and everything it would compute is stored already.
+
+        """
+        ref = cls.__new__(cls)
+        ref.tree = tree
+        ref.hover = hover
+        ref.qualname_hash = qualname_hash
+        ref._menu_data = None
+        ref._menu_json = menu_json
+        return ref
+
+    @property
+    def menu_data(self):
+        if self._menu_data is None and self._menu_json is not None:
+            self._menu_data = json.loads(self._menu_json)
+        return self._menu_data
+
+    @menu_data.setter
+    def menu_data(self, value):
+        self._menu_data = value
+        self._menu_json = None
+
     def es(self):
         """Return a serialization of myself to store in elasticsearch."""
         ret = {'plugin': self.plugin,
@@ -110,25 +144,14 @@ class Ref(object):
             from which the ``es_data`` was pulled
 
         """
-        def ref_class(plugin, id):
-            """Return the subclass of Ref identified by a combination of
-            plugin and class ID."""
-            plugins = all_plugins()
-            try:
-                return plugins[plugin].refs[id]
-            except KeyError:
-                warn('Ref subclass from plugin %s with ID %s was referenced '
-                     'in the index but not found in the current '
-                     'implementation. Ignored.' % (plugin, id))
-
         payload = es_data['payload']
-        cls = ref_class(payload['plugin'], payload['id'])
+        cls = _ref_class(payload['plugin'], payload['id'])
         return (es_data['start'],
                 es_data['end'],
-                cls(tree,
-                    json.loads(payload['menu_data']),
-                    hover=payload.get('hover'),
-                    qualname_hash=payload.get('qualname_hash')))
+                cls._from_index(tree,
+                                payload['menu_data'],
+                                hover=payload.get('hover'),
+                                qualname_hash=payload.get('qualname_hash')))
 
     def menu_items(self):
         """Return an iterable of menu items to be attached to a ref.
@@ -148,12 +171,15 @@ class Ref(object):
         """
         raise NotImplementedError
 
-    def opener(self):
+    def opener(self, menus=None):
         """Emit the opening anchor tag for a cross reference.
 
         Menu item text, links, and metadata are JSON-encoded and dumped into a
         data attr on the tag. JS finds them there and creates a menu on click.
 
+        :arg menus: A :class:`MenuTable` to put the menu in instead, leaving
+            only its ID on the tag
+
         """
         if self.hover:
             title = ' title="' + cgi.escape(self.hover, True) + '"'
@@ -164,6 +190,10 @@ class Ref(object):
         else:
             cls = ''
 
+        if menus is not None:
+            return u'<a data-menu-id="%s"%s%s>' % (menus.id_for(self),
+                                                   title,
+                                                   cls)
         menu_items = list(self.menu_items())
         return u'<a data-menu="%s"%s%s>' % (
             cgi.escape(json.dumps(menu_items), True),
@@ -174,6 +204,66 @@ class Ref(object):
         return u'</a>'
 
 
+class MenuTable(object):
+    """The context menus of a page's refs, each built just once
+
+    A symbol used thousands of times in a file would otherwise carry the same
+    menu JSON on every one of its anchors. Instead, refs of the same class
+    and menu data share an entry here, and their anchors point to it by ID.
+    The page includes the table, via :meth:`json()`, after the last line that
+    uses it.
+
+    :arg prefix: A prefix for the IDs, to keep them distinct from those of
+        other tables that end up on the same page
+
+    """
+    def __init__(self, prefix=''):
+        self._prefix = prefix
+        self._ids = {}
+        self._menus = {}
+
+    def id_for(self, ref):
+        """Return the ID of a ref's menu, adding the menu if it's new."""
+        # Refs from the index come with their menu data still encoded, and
+        # identical data encodes identically, so we can key on that without
+        # decoding it.
+        key = type(ref), (ref._menu_json if ref._menu_json is not None else
+                          json.dumps(ref.menu_data, sort_keys=True))
+        id = self._ids.get(key)
+        if id is None:
+            id = self._ids[key] = '%s%i' % (self._prefix, len(self._ids))
+            self._menus[id] = list(ref.menu_items())
+        return id
+
+    def json(self):
+        """Return the menus, keyed by ID, as JSON."""
+        return json.dumps(self._menus)
+
+
+_ref_classes = {}
+def _ref_class(plugin, id):
+    """Return the subclass of Ref identified by a combination of plugin and
+    class ID.
+
+    The plugins don't change for the life of the process, so remember the
+    answers; this is asked for every ref on every page.
+
+    """
+    try:
+        return _ref_classes[plugin, id]
+    except KeyError:
+        pass
+    try:
+        cls = all_plugins()[plugin].refs[id]
+    except KeyError:
+        warn('Ref subclass from plugin %s with ID %s was referenced in the '
+             'index but not found in the current implementation. Ignored.' %
+             (plugin, id))
+        cls = None
+    _ref_classes[plugin, id] = cls
+    return cls
+
+
 class Region(object):
     """A <span> tag with a CSS class, wrapped around a run of text"""
 
@@ -505,23 +595,150 @@ def es_lines(tags):
 
     """
     for line in tags_per_line(tags):
-        payloads = {}
-        for pos, is_start, payload in line:
-            if is_start:
-                payloads[payload] = {'start': pos}
-            else:
-                payloads[payload]['end'] = pos
-        # Index objects are refs or regions. Regions' payloads are just
-        # strings; refs' payloads are objects. See mappings in plugins/core.py
-        yield [{'payload': payload.es(),
-                'start': pos['start'],
-                'end': pos['end']}
-               for payload, pos in payloads.iteritems()]
+        yield es_line(line)
     # tags always ends with a LINE closer, so we don't need any additional
     # yield here to catch remnants.
 
 
-def html_line(text, tags, bof_offset):
+def es_line(tags):
+    """Return a list of dicts for one line, as :func:`es_lines()` would.
+
+    :arg tags: One line's worth of :func:`tags_per_line()` output
+
+    """
+    payloads = {}
+    for pos, is_start, payload in tags:
+        if is_start:
+            payloads[payload] = {'start': pos}
+        else:
+            payloads[payload]['end'] = pos
+    # Index objects are refs or regions. Regions' payloads are just
+    # strings; refs' payloads are objects. See mappings in plugins/core.py
+    return [{'payload': payload.es(),
+             'start': pos['start'],
+             'end': pos['end']}
+            for payload, pos in payloads.iteritems()]
+
+
+class RenderingPacker(object):
+    """An accumulator of a whole file's refs, regions, and annotations, which
+    packs them into one compact blob to store on its FILE doc
+
+    This is the alternative to storing them on each LINE doc as nested
+    objects. Strings (CSS classes, plugin names, menu data, and hovers) are
+    interned into a table, and start offsets and line numbers are stored as
+    deltas from their predecessors, so the whole thing deflates well.
+
+    """
+    def __init__(self):
+        self._strings = []
+        self._string_ids = {}
+        # Flattened runs of (start delta, length, CSS class):
+        self._regions = []
+        # Flattened runs of (start delta, length, plugin, ref ID, menu data,
+        # hover or -1, qualname hash or None):
+        self._refs = []
+        # [line number delta, annotations] pairs for annotated lines:
+        self._annotations = []
+        self._region_start = self._ref_start = 0
+        self._line = self._annotated_line = 0
+
+    def _intern(self, string):
+        id = self._string_ids.get(string)
+        if id is None:
+            id = self._string_ids[string] = len(self._strings)
+            self._strings.append(string)
+        return id
+
+    def add_line(self, tags, annotations):
+        """Take in the decorations of the next line.
+
+        :arg tags: One line's worth of :func:`es_lines()` output
+        :arg annotations: The line's list of annotations
+
+        """
+        for tag in sorted(tags, key=itemgetter('start')):
+            start, end, payload = tag['start'], tag['end'], tag['payload']
+            if isinstance(payload, basestring):
+                self._regions.extend([start - self._region_start,
+                                      end - start,
+                                      self._intern(payload)])
+                self._region_start = start
+            else:
+                hover = payload.get('hover')
+                self._refs.extend([
+                    start - self._ref_start,
+                    end - start,
+                    self._intern(payload['plugin']),
+                    self._intern(payload['id']),
+                    self._intern(payload['menu_data']),
+                    -1 if hover is None else self._intern(hover),
+                    payload.get('qualname_hash')])
+                self._ref_start = start
+        if annotations:
+            self._annotations.append([self._line - self._annotated_line,
+                                      annotations])
+            self._annotated_line = self._line
+        self._line += 1
+
+    def blob(self):
+        """Return everything added so far as a base64-encoded string, ready
+        for an ES binary field."""
+        return b64encode(zlib.compress(json.dumps(
+            [self._line,
+             self._strings,
+             self._regions,
+             self._refs,
+             self._annotations],
+            separators=(',', ':'))))
+
+
+def unpack_rendering(blob, tree):
+    """Undo :meth:`RenderingPacker.blob()`.
+
+    Return a list of (start, end, :class:`Ref`) triples, a list of (start,
+    end, :class:`Region`) triples, and a list of annotations for each line.
+
+    :arg tree: The :class:`~dxr.config.TreeConfig` to hang Refs off of
+
+    """
+    num_lines, strings, flat_regions, flat_refs, annotated = json.loads(
+        zlib.decompress(b64decode(blob)))
+
+    # Every tag gets its own payload object, since the tag balancer tells
+    # them apart by identity.
+    regions = []
+    start = 0
+    for i in xrange(0, len(flat_regions), 3):
+        delta, length, css_class = flat_regions[i:i + 3]
+        start += delta
+        regions.append((start, start + length, Region(strings[css_class])))
+
+    refs = []
+    start = 0
+    for i in xrange(0, len(flat_refs), 7):
+        (delta, length, plugin, id, menu_data, hover,
+         qualname_hash) = flat_refs[i:i + 7]
+        start += delta
+        cls = _ref_class(strings[plugin], strings[id])
+        if cls is not None:
+            refs.append((start,
+                         start + length,
+                         cls._from_index(
+                             tree,
+                             strings[menu_data],
+                             hover=None if hover == -1 else strings[hover],
+                             qualname_hash=qualname_hash)))
+
+    annotations_by_line = [[] for _ in xrange(num_lines)]
+    line = 0
+    for delta, annotations in annotated:
+        line += delta
+        annotations_by_line[line] = annotations
+    return refs, regions, annotations_by_line
+
+
+def html_line(text, tags, bof_offset, menus=None):
     """Return a line of Markup, interleaved with the refs and regions that
     decorate it.
 
@@ -530,6 +747,8 @@ def html_line(text, tags, bof_offset):
     :arg text: The unicode text to decorate
     :arg bof_offset: The byte position of the start of the line from the
         beginning of the file.
+    :arg menus: A :class:`MenuTable` to collect the refs' menus in, rather
+        than repeating them on every ref
 
     """
     def segments(text, tags, bof_offset):
@@ -541,6 +760,8 @@ def html_line(text, tags, bof_offset):
             up_to = pos
             if not is_start:  # It's a closer. Most common.
                 yield payload.closer()
+            elif menus is not None and isinstance(payload, Ref):
+                yield payload.opener(menus)
             else:
                 yield payload.opener()
         yield cgi.escape(text[up_to:])
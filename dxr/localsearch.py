@@ -0,0 +1,607 @@
+"""A stand-in for elasticsearch that answers DXR's queries from local files
+
+For small deployments, CI, and benchmarks, it's handy to serve a tree with no
+ES cluster at all. :func:`build_local_index()` compiles the bulk actions
+written by ``dxr index --export`` into a folder holding, for each doc type,
+the docs themselves and a sorted posting list of doc numbers for each
+trigram of the fields we do substring searches on. :class:`LocalSearch`
+quacks enough like a pyelasticsearch client for the web app (and for
+:func:`~dxr.build.deploy_tree()`) to use it in place of one.
+
+Searches run like DXR's ES queries do, in two phases: trigram posting lists
+are memory-mapped and intersected or unioned, following the ``and`` and
+``or`` structure of the query, to narrow down the candidates; then each
+candidate is checked against the whole query, regexes and all, in Python.
+
+Only the corners of the query DSL that DXR uses are understood.
+
+"""
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from errno import ENOENT
+from itertools import chain
+import json
+from mmap import mmap, ACCESS_READ
+from os import listdir, makedirs, readlink, rename, symlink
+from os.path import basename, exists, isdir, islink, join, realpath
+import re
+from shutil import rmtree
+from urllib import quote, unquote
+from uuid import uuid1
+
+from pyelasticsearch import (ElasticSearch, ElasticHttpNotFoundError,
+                             IndexAlreadyExistsError)
+
+from dxr.es import ShardWriter
+from dxr.filters import FILE, LINE
+from dxr.trigrammer import NGRAM_LENGTH
+
+
+# Fields which get posting lists, by doc type. Other fields are searched by
+# brute force.
+TRIGRAM_FIELDS = {LINE: ['content'], FILE: ['path', 'file_name']}
+
+# The file that marks a folder as a compiled index, rather than a loose
+# folder of docs like the catalog
+MARKER = 'local-index.json'
+
+# Subfields ES derives with analyzers (see the mappings in plugins/core.py),
+# each mapped to whether it folds case
+ANALYZED_SUBFIELDS = {'trigrams': False, 'trigrams_lower': True, 'lower': True}
+
+# Pulls the field name out of the regex-matching script es_regex_filter()
+# makes
+SCRIPT_FIELD = re.compile(r'doc\["([^"]+)"\]')
+
+# A client used only for formatting bulk actions, which never connects
+_FORMATTER = ElasticSearch()
+
+
+def build_local_index(folder, shards):
+    """Compile exported bulk actions into a local index.
+
+    Docs are numbered in (path, line number) order, the order searches most
+    often want them in.
+
+    :arg folder: The folder to make. It mustn't exist yet.
+    :arg shards: Paths to files written by :class:`~dxr.es.ShardWriter`
+
+    """
+    hits_by_type = defaultdict(list)
+    for path in shards:
+        default_type = basename(path).split('-', 1)[0]
+        for action in ShardWriter.actions(path):
+            meta, source = action.split('\n', 1)
+            meta = json.loads(meta)['index']
+            hit = {'_source': json.loads(source)}
+            for key in ['_id', '_parent']:
+                if key in meta:
+                    hit[key] = meta[key]
+            hits_by_type[meta.get('_type', default_type)].append(hit)
+
+    makedirs(folder)
+    counts = {}
+    for doc_type, hits in hits_by_type.iteritems():
+        hits.sort(key=lambda hit: (_first(hit['_source'], 'path') or u'',
+                                   _first(hit['_source'], 'number') or 0))
+        _write_table(folder, doc_type, hits)
+        counts[doc_type] = len(hits)
+    with open(join(folder, MARKER), 'w') as file:
+        json.dump({'doc_counts': counts}, file)
+
+
+def _write_table(folder, doc_type, hits):
+    """Write the docs, doc offsets, IDs, and posting lists of one doc type."""
+    offsets = array('L', [0])
+    ids = {}
+    with open(join(folder, doc_type + '.docs'), 'wb') as file:
+        for number, hit in enumerate(hits):
+            line = json.dumps(hit, separators=(',', ':')) + '\n'
+            file.write(line)
+            offsets.append(offsets[-1] + len(line))
+            if '_id' in hit:
+                ids[hit['_id']] = number
+    with open(join(folder, doc_type + '.offsets'), 'wb') as file:
+        offsets.tofile(file)
+    with open(join(folder, doc_type + '.ids'), 'w') as file:
+        json.dump(ids, file)
+
+    for field in TRIGRAM_FIELDS.get(doc_type, []):
+        postings = defaultdict(lambda: array('I'))
+        for number, hit in enumerate(hits):
+            for trigram in set(chain.from_iterable(
+                    _trigrams(value) for value in
+                    _values(hit['_source'], field.split('.'), True))):
+                postings[trigram].append(number)
+        directory = {}
+        with open(join(folder, '%s.%s.postings' % (doc_type, field)),
+                  'wb') as file:
+            start = 0
+            for trigram in sorted(postings):
+                numbers = postings[trigram]
+                numbers.tofile(file)
+                directory[trigram] = [start, len(numbers)]
+                start += len(numbers)
+        with open(join(folder, '%s.%s.trigrams' % (doc_type, field)),
+                  'w') as file:
+            json.dump(directory, file)
+
+
+def _trigrams(text):
+    return (text[i:i + NGRAM_LENGTH] for i in
+            xrange(len(text) - NGRAM_LENGTH + 1))
+
+
+class LocalSearch(object):
+    """A folder of local indices, catalogs, and aliases, behind enough of the
+    interface of :class:`pyelasticsearch.ElasticSearch` to fool DXR
+
+    Aliases are symlinks to the folders of compiled indices. The catalog
+    index is a loose folder of JSON docs, since it's small and gets updated
+    one doc at a time.
+
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        self._indices = {}  # real path -> _CompiledIndex
+        self._targets = {}  # alias path -> real path it last resolved to
+
+    def _path(self, index):
+        return join(self.folder, index)
+
+    def _index(self, index):
+        """Return the _CompiledIndex or _LooseIndex named by an index or
+        alias.
+
+        When an alias has moved to a new index, we forget the compiled index
+        it used to point to, so its mmaps (and the disk space of its files,
+        if they've been deleted) are freed once any searches still using it
+        finish.
+
+        """
+        link = self._path(index)
+        path = realpath(link)
+        if islink(link):
+            old_path = self._targets.get(link)
+            if old_path != path:
+                self._indices.pop(old_path, None)
+                self._targets[link] = path
+        if exists(join(path, MARKER)):
+            compiled = self._indices.get(path)
+            if compiled is None:
+                compiled = self._indices[path] = _CompiledIndex(path)
+            return compiled
+        if isdir(path):
+            return _LooseIndex(path)
+        raise ElasticHttpNotFoundError(404, 'IndexMissingException[[%s] '
+                                            'missing]' % index)
+
+    def search(self, query, index, doc_type, size=None, es_from=None,
+               **kwargs):
+        """Return ES-style search results.
+
+        Understands the ``query``, ``filter``, ``sort``, ``from``, ``size``,
+        and ``_source`` parts of a request body.
+
+        """
+        index = self._index(index)
+        table = index.table(doc_type)
+        clause = {'filtered': {'query': query.get('query', {'match_all': {}}),
+                               'filter': query.get('filter',
+                                                   {'match_all': {}})}}
+        numbers = _candidates(clause, table)
+        if numbers is None:
+            numbers = xrange(len(table))
+        hits = [hit for hit in (table.hit(n) for n in numbers) if
+                _matches(clause, hit, index)]
+
+        sort = query.get('sort')
+        if sort:
+            _sort(hits, sort)
+
+        start = es_from if es_from is not None else query.get('from', 0)
+        if size is None:
+            size = query.get('size', 10)
+        page = hits[start:start + size]
+        if '_source' in query:
+            page = [_projected(hit, query['_source']) for hit in page]
+        return {'hits': {'total': len(hits), 'hits': page}}
+
+    def index_op(self, doc, **kwargs):
+        """Return a bulk indexing action, formatted just as pyelasticsearch
+        would, since that's what :func:`build_local_index()` eats."""
+        return _FORMATTER.index_op(doc, **kwargs)
+
+    def get(self, index, doc_type, id):
+        """Return a doc by ID, or raise ElasticHttpNotFoundError."""
+        hit = self._index(index).table(doc_type).by_id(id)
+        if hit is None:
+            raise ElasticHttpNotFoundError(404, {'found': False})
+        return hit
+
+    def index(self, index, doc_type, doc, id):
+        """Add or replace a doc in a loose index, like the catalog."""
+        self._index(index).put(doc_type, id, doc)
+
+    def create_index(self, index, settings=None):
+        """Make a loose index. Compiled ones come from
+        :func:`build_local_index()`."""
+        if exists(self._path(index)):
+            raise IndexAlreadyExistsError(400, 'IndexAlreadyExistsException'
+                                               '[[%s] already exists]' % index)
+        makedirs(self._path(index))
+
+    def health(self, *args, **kwargs):
+        """Everything is always ready."""
+
+    def delete_index(self, index):
+        rmtree(self._path(index))
+
+    def aliases(self, alias):
+        """Return a map with the name of the index an alias points to as its
+        only key, or an empty one if there is no such alias."""
+        path = self._path(alias)
+        if islink(path):
+            return {readlink(path): {'aliases': {alias: {}}}}
+        return {}
+
+    def update_aliases(self, actions):
+        """Do the "add" actions of an ES alias update, repointing symlinks
+        atomically. "remove"s are implied."""
+        for action in actions:
+            if 'add' in action:
+                alias, index = action['add']['alias'], action['add']['index']
+                temp = self._path('%s.%s.tmp' % (alias, uuid1()))
+                symlink(index, temp)
+                rename(temp, self._path(alias))
+
+
+class _CompiledIndex(object):
+    """An index written by :func:`build_local_index()`"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._tables = {}
+
+    def table(self, doc_type):
+        if doc_type not in self._tables:
+            self._tables[doc_type] = _Table(self.folder, doc_type)
+        return self._tables[doc_type]
+
+
+class _Table(object):
+    """The docs of one type in a compiled index"""
+
+    def __init__(self, folder, doc_type):
+        self.folder = folder
+        self.doc_type = doc_type
+        self._offsets = array('L')
+        try:
+            with open(join(folder, doc_type + '.offsets'), 'rb') as file:
+                self._offsets.fromstring(file.read())
+        except IOError as exc:
+            if exc.errno != ENOENT:
+                raise
+            self._docs = None  # No docs of this type
+        else:
+            self._docs = _mapped(join(folder, doc_type + '.docs'))
+        self._ids = None
+        self._directories = {}
+
+    def __len__(self):
+        return max(len(self._offsets) - 1, 0)
+
+    def hit(self, number):
+        return json.loads(self._docs[self._offsets[number]:
+                                     self._offsets[number + 1]])
+
+    def by_id(self, id):
+        if self._ids is None:
+            try:
+                with open(join(self.folder, self.doc_type + '.ids')) as file:
+                    self._ids = json.load(file)
+            except IOError as exc:
+                if exc.errno != ENOENT:
+                    raise
+                self._ids = {}
+        number = self._ids.get(id)
+        return None if number is None else self.hit(number)
+
+    def substring_candidates(self, field, text):
+        """Return a sorted sequence of the numbers of docs whose ``field``
+        might contain ``text``, or None if we have no idea."""
+        parts, _ = _field(field)
+        field = '.'.join(parts)
+        if field not in TRIGRAM_FIELDS.get(self.doc_type, []):
+            return None
+        trigrams = set(_trigrams(text.lower()))
+        if not trigrams:
+            return None
+        if field not in self._directories:
+            with open(join(self.folder, '%s.%s.trigrams' %
+                           (self.doc_type, field))) as file:
+                directory = json.load(file)
+            self._directories[field] = (
+                directory,
+                _mapped(join(self.folder,
+                             '%s.%s.postings' % (self.doc_type, field))))
+        directory, postings = self._directories[field]
+        lists = []
+        for trigram in trigrams:
+            if trigram not in directory:
+                return []
+            start, count = directory[trigram]
+            numbers = array('I')
+            numbers.fromstring(postings[start * numbers.itemsize:
+                                        (start + count) * numbers.itemsize])
+            lists.append(numbers)
+        return _intersection(lists)
+
+
+class _LooseIndex(object):
+    """A folder per doc type, each holding a JSON file per doc"""
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def table(self, doc_type):
+        return _LooseTable(join(self.folder, doc_type), doc_type)
+
+    def put(self, doc_type, id, doc):
+        folder = join(self.folder, doc_type)
+        if not isdir(folder):
+            makedirs(folder)
+        path = join(folder, quote(id, safe='') + '.json')
+        temp_path = '%s.%s.tmp' % (path, uuid1())
+        with open(temp_path, 'w') as file:
+            json.dump({'_id': id, '_source': doc}, file)
+        rename(temp_path, path)
+
+
+class _LooseTable(object):
+    def __init__(self, folder, doc_type):
+        self.folder = folder
+        self.doc_type = doc_type
+        self._hits = None
+
+    def _path(self, id):
+        return join(self.folder, quote(id, safe='') + '.json')
+
+    def _all(self):
+        if self._hits is None:
+            names = sorted(name for name in
+                           (listdir(self.folder) if isdir(self.folder) else [])
+                           if name.endswith('.json'))
+            self._hits = [self.by_id(unquote(name[:-len('.json')]))
+                          for name in names]
+            self._hits = [hit for hit in self._hits if hit is not None]
+        return self._hits
+
+    def __len__(self):
+        return len(self._all())
+
+    def hit(self, number):
+        return self._all()[number]
+
+    def by_id(self, id):
+        try:
+            with open(self._path(id)) as file:
+                return json.load(file)
+        except IOError as exc:
+            if exc.errno == ENOENT:  # It could have been replaced just now.
+                return None
+            raise
+
+    def substring_candidates(self, field, text):
+        return None
+
+
+def _mapped(path):
+    """Return a read-only mmap of a file, or an empty string if it's empty,
+    since those can't be mapped."""
+    with open(path, 'rb') as file:
+        try:
+            return mmap(file.fileno(), 0, access=ACCESS_READ)
+        except ValueError:
+            return ''
+
+
+def _intersection(lists):
+    """Return a list of the numbers common to some sorted sequences."""
+    lists = sorted(lists, key=len)
+    result = list(lists[0])
+    for other in lists[1:]:
+        # Both are sorted, so each search can start where the last left off.
+        kept = []
+        low = 0
+        for number in result:
+            low = bisect_left(other, number, low)
+            if low == len(other):
+                break
+            if other[low] == number:
+                kept.append(number)
+        result = kept
+    return result
+
+
+def _union(lists):
+    """Return a sorted list of the numbers in any of some sequences."""
+    return sorted(set(chain.from_iterable(lists)))
+
+
+def _clauses(arg):
+    """Return the list of subclauses of an "and" or "or"."""
+    return arg['filters'] if isinstance(arg, dict) else arg
+
+
+def _candidates(clause, table):
+    """Return a sorted sequence of the numbers of the docs in ``table`` which
+    might match an ES query or filter clause, or None if any might.
+
+    Only substring matches against trigram-indexed fields narrow things down.
+
+    """
+    (kind, arg), = clause.items()
+    if kind in ('and', 'or', 'filtered'):
+        subclauses = ([arg[part] for part in ['query', 'filter'] if part in arg]
+                      if kind == 'filtered' else _clauses(arg))
+        results = [_candidates(sub, table) for sub in subclauses]
+        if kind == 'or':
+            return None if None in results else _union(results)
+        results = [r for r in results if r is not None]
+        return _intersection(results) if results else None
+    if kind == 'query':
+        return _candidates(arg, table)
+    if kind == 'match_phrase':
+        (field, text), = arg.items()
+        return table.substring_candidates(field, _query_text(text))
+    return None
+
+
+def _query_text(text):
+    """Unwrap the long form of a match query's text."""
+    return text['query'] if isinstance(text, dict) else text
+
+
+def _field(name):
+    """Split a field name into the path to its value within a doc and whether
+    it folds case."""
+    parts = name.split('.')
+    fold = False
+    if len(parts) > 1 and parts[-1] in ANALYZED_SUBFIELDS:
+        fold = ANALYZED_SUBFIELDS[parts.pop()]
+    return parts, fold
+
+
+def _values(source, parts, fold=False):
+    """Return a flat list of the scalars at a dotted path in a doc, looking
+    through any arrays along the way."""
+    values = [source]
+    for part in parts:
+        found = []
+        for value in values:
+            if isinstance(value, dict) and part in value:
+                value = value[part]
+                if isinstance(value, list):
+                    found.extend(value)
+                else:
+                    found.append(value)
+        values = found
+    if fold:
+        values = [v.lower() if isinstance(v, basestring) else v
+                  for v in values]
+    return [v for v in values if v is not None]
+
+
+def _first(source, field):
+    values = _values(source, field.split('.'))
+    return values[0] if values else None
+
+
+def _in_range(value, bounds):
+    return all(test(value, bounds[op]) for op, test in
+               [('gte', lambda v, b: v >= b),
+                ('gt', lambda v, b: v > b),
+                ('lte', lambda v, b: v <= b),
+                ('lt', lambda v, b: v < b)]
+               if op in bounds)
+
+
+def _matches(clause, hit, index):
+    """Return whether a hit satisfies an ES query or filter clause.
+
+    :arg index: The index the hit came from, for looking up parents
+
+    """
+    (kind, arg), = clause.items()
+    source = hit['_source']
+    if kind == 'match_all':
+        return True
+    if kind == 'and':
+        return all(_matches(sub, hit, index) for sub in _clauses(arg))
+    if kind == 'or':
+        return any(_matches(sub, hit, index) for sub in _clauses(arg))
+    if kind == 'not':
+        return not _matches(arg['filter'] if 'filter' in arg else arg,
+                            hit, index)
+    if kind == 'filtered':
+        return all(_matches(arg[part], hit, index)
+                   for part in ['query', 'filter'] if part in arg)
+    if kind == 'query':
+        return _matches(arg, hit, index)
+    if kind == 'has_parent':
+        parent = index.table(arg.get('parent_type') or
+                             arg['type']).by_id(hit.get('_parent'))
+        return parent is not None and _matches(
+            arg['filter'] if 'filter' in arg else arg['query'], parent, index)
+    if kind == 'exists':
+        return bool(_values(source, arg['field'].split('.')))
+    if kind == 'missing':
+        return not _values(source, arg['field'].split('.'))
+
+    if kind == 'script':
+        field = SCRIPT_FIELD.search(arg['script']).group(1)
+        params = arg['params']
+        regex = re.compile(params['pattern'],
+                           re.I if 'i' in params['flags'] else 0)
+        return any(regex.search(value) for value in
+                   _values(source, field.split('.'))[:1])
+
+    (field, operand), = arg.items()
+    parts, fold = _field(field)
+    values = _values(source, parts, fold)
+    if kind == 'term':
+        return _query_text(operand) in values
+    if kind == 'terms':
+        return any(o in values for o in operand)
+    if kind == 'range':
+        return any(_in_range(value, operand) for value in values)
+    if kind in ('match', 'match_phrase'):
+        text = _query_text(operand)
+        if fold:
+            text = text.lower()
+        if kind == 'match':
+            return text in values
+        return any(text in value for value in values)
+    raise NotImplementedError("Local search doesn't understand %s clauses." %
+                              kind)
+
+
+def _sort(hits, sort):
+    """Sort hits in place by an ES sort spec, and record each hit's sort
+    values under its "sort" key, as ES does. Docs missing a field go last."""
+    fields, descendings = [], []
+    for spec in sort:
+        if isinstance(spec, dict):
+            (field, order), = spec.items()
+            if isinstance(order, dict):
+                order = order.get('order', 'asc')
+        else:
+            field, order = spec, 'asc'
+        fields.append(field)
+        descendings.append(order == 'desc')
+    for hit in hits:
+        hit['sort'] = [_first(hit['_source'], f) for f in fields]
+    # Sort by each key in turn, least significant first, leaning on
+    # stability:
+    for i, descending in reversed(list(enumerate(descendings))):
+        def key(hit):
+            value = hit['sort'][i]
+            # Reversing flips the first element too, so flip it back:
+            return (value is None) != descending, value
+        hits.sort(key=key, reverse=descending)
+
+
+def _projected(hit, spec):
+    """Trim a hit's source down according to a ``_source`` spec."""
+    source = hit['_source']
+    if 'include' in spec:
+        source = dict((k, v) for k, v in source.iteritems()
+                      if k in spec['include'])
+    elif 'exclude' in spec:
+        source = dict((k, v) for k, v in source.iteritems()
+                      if k not in spec['exclude'])
+    ret = hit.copy()
+    ret['_source'] = source
+    return ret
@@ -0,0 +1,194 @@
+"""A single, shared inventory of what's in a source tree
+
+Several stages of a build need to know which files and folders in a tree
+aren't ignored: folder indexing, file indexing, incremental-build bookkeeping,
+VCS discovery, and plugins doing whole-tree analysis. Rather than have each
+walk the tree and test every ignore pattern against every path, we walk it
+once, in parallel, with the patterns compiled into a regex apiece, and keep
+the result in a :class:`Manifest`.
+
+"""
+from fnmatch import translate
+import os
+from os import listdir, lstat
+from os.path import isdir, join
+import re
+from stat import S_ISDIR, S_ISLNK
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+# Directory listing and stat calls release the GIL, so a few threads keep
+# several of them in flight at once, which pays off on network filesystems
+# and cold caches.
+SCAN_THREADS = 8
+
+
+class IgnoreMatcher(object):
+    """A tree's ignore patterns, compiled
+
+    ``ignore_filenames`` are matched against bare file and folder names.
+    ``ignore_paths`` are matched against paths relative to the source folder,
+    with a leading slash and, for folders, a trailing one.
+
+    """
+    def __init__(self, ignore_filenames, ignore_paths):
+        self._filenames = _compiled(ignore_filenames)
+        self._paths = _compiled(ignore_paths)
+
+    def is_ignored(self, name, rel_path, is_folder=False):
+        """Return whether a file or folder is ignored.
+
+        :arg name: The bare name of the file or folder
+        :arg rel_path: Its path relative to the source folder
+
+        """
+        if self._filenames and self._filenames.match(name):
+            return True
+        if self._paths:
+            path = '/' + rel_path.replace(os.sep, '/')
+            if is_folder:
+                path += '/'
+            return bool(self._paths.match(path))
+        return False
+
+
+def _compiled(patterns):
+    """Compile a list of fnmatch-style patterns into one regex, or return None
+    if there aren't any."""
+    if not patterns:
+        return None
+    suffix = '\\Z(?ms)'  # what fnmatch.translate() appends
+    bodies = []
+    for pattern in patterns:
+        body = translate(pattern)
+        if body.endswith(suffix):
+            body = body[:-len(suffix)]
+        bodies.append(body)
+    return re.compile('(?:%s)\\Z' % '|'.join(bodies), re.S)
+
+
+class Manifest(object):
+    """The unignored files and folders of a tree, as of when it was scanned
+
+    :attr files: A sorted list of (bytestring absolute path, size, mtime)
+        tuples for unignored files, sizes and mtimes being those of symlinks
+        rather than their targets
+    :attr folders: A sorted list of bytestring absolute paths of unignored
+        folders, including symlinks to folders (which aren't descended into)
+    :attr vcs_markers: A list of (bytestring absolute path of a folder, list
+        of names of VCS marker entries in it), for every folder walked--even
+        ignored marker entries like ``.git`` count
+
+    """
+    def __init__(self, files, folders, vcs_markers):
+        self.files = files
+        self.folders = folders
+        self.vcs_markers = vcs_markers
+
+    @property
+    def paths(self):
+        """Return a list of the absolute paths of unignored files."""
+        return [path for path, _, _ in self.files]
+
+
+def _markers():
+    """Return the names of entries whose presence can mean a folder is the
+    root of a VCS checkout."""
+    names = set(['.git', '.hg'])
+    if 'P4CONFIG' in os.environ:
+        names.add(os.environ['P4CONFIG'])
+    return names
+
+
+def _listing(folder, markers):
+    """List a folder, sorting its entries into files, descendable folders,
+    symlinks to folders, and VCS markers.
+
+    Return a tuple of those 4 lists. Files come with their lstat results.
+
+    """
+    files, folders, linked_folders, found_markers = [], [], [], []
+    for name in listdir(folder):
+        if name in markers:
+            found_markers.append(name)
+        path = join(folder, name)
+        try:
+            info = lstat(path)
+        except OSError:  # It vanished out from under us.
+            continue
+        if S_ISDIR(info.st_mode):
+            folders.append(name)
+        elif S_ISLNK(info.st_mode) and isdir(path):
+            linked_folders.append(name)
+        else:
+            files.append((name, info))
+    return files, folders, linked_folders, found_markers
+
+
+def scan(source_folder, ignore_filenames, ignore_paths):
+    """Walk a source folder, and return a :class:`Manifest` of what's in it.
+
+    Ignored folders aren't descended into. Errors listing folders propagate.
+
+    """
+    # On Linux (which is what we guarantee support for), paths are bags of
+    # bytes; they may not even be representable as Unicode code points.
+    if isinstance(source_folder, unicode):
+        source_folder = source_folder.encode('utf8')
+    matcher = IgnoreMatcher(ignore_filenames, ignore_paths)
+    markers = _markers()
+    files, folders, vcs_markers = [], [], []
+    with ThreadPoolExecutor(max_workers=SCAN_THREADS) as pool:
+        # future -> (absolute path, path relative to source folder)
+        pending = {pool.submit(_listing, source_folder, markers):
+                   (source_folder, '')}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                folder, rel_folder = pending.pop(future)
+                (child_files, child_folders, linked_folders,
+                 found_markers) = future.result()
+                if found_markers:
+                    vcs_markers.append((folder, found_markers))
+                for name, info in child_files:
+                    if not matcher.is_ignored(name, join(rel_folder, name)):
+                        files.append((join(folder, name),
+                                      info.st_size,
+                                      info.st_mtime))
+                for names, descend in [(child_folders, True),
+                                       (linked_folders, False)]:
+                    for name in names:
+                        rel_path = join(rel_folder, name)
+                        if matcher.is_ignored(name, rel_path, is_folder=True):
+                            continue
+                        path = join(folder, name)
+                        folders.append(path)
+                        if descend:
+                            pending[pool.submit(_listing, path, markers)] = (
+                                path, rel_path)
+    files.sort()
+    folders.sort()
+    return Manifest(files, folders, vcs_markers)
+
+
+# Tree name -> Manifest, kept per process so worker processes forked after a
+# scan inherit it rather than walking the tree again
+_manifests = {}
+
+
+def tree_manifest(tree):
+    """Return the :class:`Manifest` of a tree, scanning it if this process
+    hasn't yet."""
+    if tree.name not in _manifests:
+        rescan(tree)
+    return _manifests[tree.name]
+
+
+def rescan(tree):
+    """Scan a tree afresh, as after a build that may have added files to it,
+    and return its new :class:`Manifest`."""
+    _manifests[tree.name] = scan(tree.source_folder,
+                                 tree.ignore_filenames,
+                                 tree.ignore_paths)
+    return _manifests[tree.name]
@@ -0,0 +1,107 @@
+"""An on-disk store of file pages rendered at index time
+
+A file's decorated source never changes once its index is built, so, when
+``prerender_folder`` is configured, the indexer renders the body of each text
+file's page once and stores it here, gzipped. The web frontend then serves
+that instead of fetching every line from elasticsearch and rerunning the
+tag-balancing machinery, making browse time independent of file size.
+
+Pages live in a folder per index, so they come and go with their indices.
+Within one, each is stored under the hash of its path.
+
+"""
+from errno import ENOENT, EEXIST
+import gzip
+from hashlib import sha1
+from os import link, makedirs, rename
+from os.path import dirname, isdir, join
+from shutil import copyfile, rmtree
+from uuid import uuid1
+
+
+class PageStore(object):
+    """A folder of pre-rendered page bodies, keyed by index name and path
+
+    Instances are small and pickleable, so they can travel to worker
+    processes if need be.
+
+    """
+    def __init__(self, folder):
+        self.folder = folder
+
+    def _path(self, index, path):
+        """Return where the page for a path within an index goes.
+
+        :arg path: The unicode path of a file, relative to the source folder,
+            as stored in ES
+
+        """
+        key = sha1(path.encode('utf-8')).hexdigest()
+        return join(self.folder, index, key[:2], key + '.html.gz')
+
+    def put(self, index, path, html):
+        """Store the rendered body of a file's page.
+
+        The write is atomic, so a web server never sees half a page.
+
+        """
+        final_path = self._path(index, path)
+        _ensure_folder_of(final_path)
+        temp_path = '%s.%s.tmp' % (final_path, uuid1())
+        file = gzip.open(temp_path, 'wb')
+        try:
+            file.write(html.encode('utf-8'))
+        finally:
+            file.close()
+        rename(temp_path, final_path)
+
+    def get(self, index, path):
+        """Return the rendered body of a file's page as unicode, or None if
+        there isn't one."""
+        try:
+            file = gzip.open(self._path(index, path), 'rb')
+        except IOError as exc:
+            if exc.errno == ENOENT:
+                return None
+            raise
+        try:
+            return file.read().decode('utf-8')
+        finally:
+            file.close()
+
+    def copy(self, old_index, new_index, paths):
+        """Carry the pages of some files over from one index to another, as
+        for files an incremental build didn't reindex."""
+        for path in paths:
+            old_path = self._path(old_index, path)
+            new_path = self._path(new_index, path)
+            _ensure_folder_of(new_path)
+            try:
+                link(old_path, new_path)
+            except OSError as exc:
+                if exc.errno == ENOENT:  # There was no page for it.
+                    continue
+                # Perhaps a different filesystem:
+                copyfile(old_path, new_path)
+
+    def delete(self, index):
+        """Throw away all the pages of an index."""
+        rmtree(join(self.folder, index), ignore_errors=True)
+
+
+def _ensure_folder_of(path):
+    """Make the folder a file is to go in, if it doesn't exist."""
+    folder = dirname(path)
+    if not isdir(folder):
+        try:
+            makedirs(folder)
+        except OSError as exc:  # Another worker beat us to it.
+            if exc.errno != EEXIST:
+                raise
+
+
+def page_store(config):
+    """Return the :class:`PageStore` for a :class:`~dxr.config.Config`, or
+    None if pre-rendering is turned off."""
+    if config.prerender_folder:
+        return PageStore(config.prerender_folder)
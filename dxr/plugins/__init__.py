@@ -11,12 +11,22 @@ from dxr.indexers import TreeToIndex
 
 
 class AdHocTreeToIndex(TreeToIndex):
-    """A default TreeToIndex created because some plugin provided none"""
+    """A default TreeToIndex created because some plugin provided none
+
+    Pass ``cache_fingerprint=''`` to let the output of its FileToIndexes be
+    cached, if it depends on nothing but each file's path and contents and
+    the plugin's config.
+
+    """
 
     def __init__(self, *args, **kwargs):
         self._file_to_index_class = kwargs.pop('file_to_index_class', None)
+        self._cache_fingerprint = kwargs.pop('cache_fingerprint', None)
         super(AdHocTreeToIndex, self).__init__(*args, **kwargs)
 
+    def cache_fingerprint(self):
+        return self._cache_fingerprint
+
     def file_to_index(self, path, contents):
         if self._file_to_index_class:
             return self._file_to_index_class(
@@ -125,7 +135,8 @@ class Plugin(object):
         The **tree indexer** is assumed to be called "TreeToIndex". If there isn't
         one, one will be constructed which does nothing but delegate to the
         class called ``FileToIndex`` (if there is one) when ``file_to_index()``
-        is called on it.
+        is called on it. Its ``cache_fingerprint()`` returns the namespace's
+        ``cache_fingerprint``, if any, or else None.
 
         The **file skimmer** is assumed to be called "FileToSkim".
 
@@ -141,7 +152,8 @@ class Plugin(object):
         if not tree_to_index:
             tree_to_index = partial(
                     AdHocTreeToIndex,
-                    file_to_index_class=namespace.get('FileToIndex'))
+                    file_to_index_class=namespace.get('FileToIndex'),
+                    cache_fingerprint=namespace.get('cache_fingerprint'))
 
         return cls(filters=filters_from_namespace(namespace),
                    folder_to_index=namespace.get('FolderToIndex'),
@@ -36,7 +36,8 @@ class BugRef(Ref):
 
 plugin = Plugin(
         tree_to_index=partial(AdHocTreeToIndex,
-                              file_to_index_class=FileToIndex),
+                              file_to_index_class=FileToIndex,
+                              cache_fingerprint=''),
         refs=[BugRef],
         config_schema={
             'url': str,
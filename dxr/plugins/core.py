@@ -15,13 +15,13 @@ from parsimonious import ParseError
 from dxr.es import (UNINDEXED_STRING, UNANALYZED_STRING, UNINDEXED_INT,
                     UNINDEXED_LONG)
 from dxr.exceptions import BadTerm
-from dxr.filters import Filter, negatable, FILE, LINE
+from dxr.filters import Filter, negatable, filter_clause, FILE, LINE
 import dxr.indexers
 from dxr.mime import is_binary_image, is_textual_image
 from dxr.query import some_filters
 from dxr.plugins import direct_search
 from dxr.trigrammer import (regex_grammar, NGRAM_LENGTH, es_regex_filter,
-                            NoTrigrams, PythonRegexVisitor)
+                            es_trigram_filter, NoTrigrams, PythonRegexVisitor)
 from dxr.utils import glob_to_regex, split_content_lines, unicode_for_display
 
 __all__ = ['mappings', 'analyzers', 'TextFilter', 'PathFilter', 'FilenameFilter',
@@ -88,6 +88,14 @@ mappings = {
             },
             'description': UNINDEXED_STRING,
 
+            # With the compact_rendering option, the refs, regions, and
+            # annotations of all the file's lines, packed by
+            # dxr.lines.RenderingPacker:
+            'rendering': {
+                'type': 'binary',
+                'index': 'no'
+            },
+
             # Sidebar nav links:
             'links': {
                 'type': 'object',
@@ -113,19 +121,27 @@ mappings = {
         '_all': {
             'enabled': False
         },
+        # File-wide needles (path trigrams, ext, modified, and so on) are
+        # stored once, on the FILE doc, rather than copied into every line.
+        # Line queries reach them through has_parent. The FILE doc's ID is its
+        # path.
+        '_parent': {
+            'type': FILE
+        },
         'properties': {
-            'path': PATH_SEGMENT_MAPPING,
-            'file_name': PATH_SEGMENT_MAPPING,
-            'ext': UNANALYZED_STRING,
-            # TODO: After the query language refresh, use match_phrase_prefix
-            # queries on non-globbed paths, analyzing them with the path
-            # analyzer, for max perf. Perfect! Otherwise, fall back to trigram-
-            # accelerated substring or wildcard matching.
+            # Just for fetching a file's lines and for sorting and grouping
+            # results. Searches by path go through the parent.
+            'path': UNANALYZED_STRING,
 
             'number': {
                 'type': 'integer'
             },
 
+            # Where the line starts within the file, which is what the
+            # offsets of refs and regions count from. This lets a range of
+            # lines be decorated without fetching the ones before it.
+            'offset': UNINDEXED_INT,
+
             # We index content 2 ways to keep RAM use down. Naively, we should
             # be able to pull the content.trigrams_lower source out using our
             # JS regex script, but in actuality, that uses much more RAM than
@@ -268,6 +284,9 @@ class TextFilter(Filter):
             }
         }
 
+    def source_fields(self):
+        return []
+
     def highlight_content(self, result):
         text_len = len(self._term['arg'])
         maybe_lower = (identity if self._term['case_sensitive'] else
@@ -283,6 +302,9 @@ class _PathSegmentFilterBase(Filter):
     """A base class for a filter that matches a glob against a path segment."""
     domain = FILE
 
+    def source_fields(self):
+        return []
+
     def _regex_filter(self, path_seg_property_name, no_trigrams_error_text):
         """Return an ES regex filter that matches this filter's glob against the
         path segment at path_seg_property_name.
@@ -341,6 +363,9 @@ class ExtFilter(Filter):
     # The intersection of two different Ext filters would always be nothing.
     union_only = True
 
+    def source_fields(self):
+        return []
+
     @negatable
     def filter(self):
         extension = self._term['arg']
@@ -374,17 +399,48 @@ class RegexpFilter(Filter):
         self._compiled_regex = (
                 re.compile(PythonRegexVisitor().visit(self._parsed_regex),
                            flags=0 if self._term['case_sensitive'] else re.I))
-
-    @negatable
-    def filter(self):
         try:
-            return es_regex_filter(
+            self._trigram_filter = es_trigram_filter(
                 self._parsed_regex,
                 'content',
                 is_case_sensitive=self._term['case_sensitive'])
         except NoTrigrams:
+            self._trigram_filter = None
+
+    @property
+    def is_accelerated(self):
+        """Return whether the trigram index can narrow down the lines to
+        check."""
+        return self._trigram_filter is not None
+
+    def source_fields(self):
+        return []
+
+    @negatable
+    def filter(self):
+        if not self.is_accelerated:
             raise BadTerm('Regexes need at least 3 literal characters in a  '
                           'row for speed.')
+        return es_regex_filter(
+            self._parsed_regex,
+            'content',
+            is_case_sensitive=self._term['case_sensitive'])
+
+    def candidate_filter(self):
+        """Return an ES filter finding a superset of the lines I match,
+        using only the trigram index, and leave the regex to :meth:`verify()`.
+
+        """
+        if self._term['not'] or not self.is_accelerated:
+            # A line can lack a match even if it has all the trigrams, and,
+            # without any trigrams, we can't rule out any lines at all.
+            return {}
+        return self._trigram_filter
+
+    def verify(self, result):
+        """Return whether a candidate line really satisfies this term."""
+        found = self._compiled_regex.search(result['content'][0]) is not None
+        return found != self._term['not']
 
     def highlight_content(self, result):
         return (m.span() for m in
@@ -403,7 +459,12 @@ class FilterAggregator(Filter):
 
     def filter(self):
         # OR together all the underlying filters.
-        return {'or': filter(None, (f.filter() for f in self.filters))}
+        return {'or': filter(None, (filter_clause(f, self.domain)
+                                    for f in self.filters))}
+
+    def source_fields(self):
+        fields = [f.source_fields() for f in self.filters]
+        return None if None in fields else list(chain.from_iterable(fields))
 
     def highlight_content(self, result):
         # Union all of our underlying filters.
@@ -509,10 +570,13 @@ class FileToIndex(dxr.indexers.FileToIndex):
         yield 'modified', modified
 
     def needles_by_line(self):
-        """Fill out line number and content for every line."""
+        """Fill out line number, offset, and content for every line."""
+        offset = 0
         for number, text in enumerate(split_content_lines(self.contents), 1):
             yield [('number', number),
+                   ('offset', offset),
                    ('content', text)]
+            offset += len(text)
 
     def links(self):
         if self.vcs:
@@ -608,7 +672,8 @@ def direct_path_and_line(term):
 
     return {
         'and': [
-            trigram_clause,
+            # Paths are searchable only on the FILE doc, the line's parent:
+            {'has_parent': {'parent_type': FILE, 'filter': trigram_clause}},
             {'term': {'number': line}}
         ]
     }
@@ -53,6 +53,10 @@ class FolderToIndex(dxr.indexers.FolderToIndex):
         return []
 
 
+# Descriptions come from each file's own path and text, so they can be cached.
+cache_fingerprint = ''
+
+
 class FileToIndex(dxr.indexers.FileToIndex):
     """Do lots of work to yield a description needle."""
 
@@ -3,9 +3,10 @@ import token
 import tokenize
 from os.path import islink
 from StringIO import StringIO
+from hashlib import sha1
 from itertools import izip
 
-from dxr.build import unignored
+from dxr.manifest import tree_manifest
 from dxr.filters import FILE, LINE
 from dxr.indexers import (Extent, FileToIndex as FileToIndexBase,
                           iterable_per_line, Position, split_into_lines,
@@ -52,8 +53,7 @@ FILE_TO_IGNORE = _FileToIgnore()
 class TreeToIndex(TreeToIndexBase):
     @property
     def unignored_files(self):
-        return unignored(self.tree.source_folder, self.tree.ignore_paths,
-                         self.tree.ignore_filenames)
+        return tree_manifest(self.tree).paths
 
     def post_build(self):
         paths = ((path, self.tree.source_encoding)
@@ -63,6 +63,17 @@ class TreeToIndex(TreeToIndexBase):
             source_folder=self.tree.source_folder,
             paths=paths)
 
+    def cache_fingerprint(self):
+        analysis = self.tree_analysis
+        return sha1(repr([sorted(table.iteritems()) for table in
+                          [analysis.base_classes,
+                           analysis.derived_classes,
+                           analysis.class_functions,
+                           analysis.overridden_functions,
+                           analysis.overriding_functions,
+                           analysis.names]] +
+                         [sorted(analysis.ignore_paths)])).hexdigest()
+
     def file_to_index(self, path, contents):
         if path in self.tree_analysis.ignore_paths:
             return FILE_TO_IGNORE
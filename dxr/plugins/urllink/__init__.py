@@ -8,6 +8,10 @@ from dxr.lines import Ref
 url_re = re.compile(r"https?://[A-Za-z0-9\-\._~:\/\?#[\]@!\$&'()*\+,;=%]+\.[A-Za-z0-9\-\._~:\/\?#[\]@!\$&'()*\+,;=%]+")
 
 
+# Links come from the URLs in each file's text alone, so they can be cached.
+cache_fingerprint = ''
+
+
 class FileToIndex(dxr.indexers.FileToIndex):
     def refs(self):
         for m in url_re.finditer(self.contents):
@@ -1,15 +1,90 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 import cgi
 from itertools import chain, groupby
+import json
 from operator import itemgetter
 import re
+from time import time
 
 from parsimonious import Grammar, NodeVisitor
 
-from dxr.filters import LINE, FILE
+from dxr.filters import LINE, FILE, filter_clause
 from dxr.mime import icon
+from dxr.searchcache import cache_key
 from dxr.utils import append_update, cached
 
 
+# How many candidate lines to fetch from ES at a time when verifying them
+# ourselves
+CANDIDATE_BATCH_SIZE = 1000
+
+# The fields of found docs that result rendering and paging need, to which
+# are added whatever the query's filters declare
+RESULT_FIELDS = {LINE: ['path', 'number', 'content'],
+                 FILE: ['path', 'is_binary']}
+
+
+def encode_cursor(position):
+    """Return an opaque, URL-safe cursor for a position in the results, or
+    None if there is no position."""
+    if position is not None:
+        return urlsafe_b64encode(json.dumps(position))
+
+
+def decode_cursor(cursor):
+    """Return the position a cursor from :func:`encode_cursor()` stands
+    for. If it's missing or malformed, return None."""
+    try:
+        path, number = json.loads(urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError, UnicodeEncodeError):
+        return None
+    if (isinstance(path, basestring) and
+            (number is None or isinstance(number, int))):
+        return path, number
+
+
+def _position(doc):
+    """Return the sort values of a LINE or FILE doc, (path, line number or
+    None), for picking up after it."""
+    return doc['path'][0], doc['number'][0] if 'number' in doc else None
+
+
+def _source_fields(filters, domain):
+    """Return the list of fields to fetch for results of a query, or None
+    to fetch them all.
+
+    :arg filters: An iterable of the query's :class:`~dxr.filters.Filter`
+        instances
+    :arg domain: LINE or FILE
+
+    """
+    fields = list(RESULT_FIELDS[domain])
+    for filter in filters:
+        declared = filter.source_fields()
+        if declared is None:
+            return None
+        fields.extend(f for f in declared if f not in fields)
+    return fields
+
+
+def _after(query, position):
+    """Narrow an ES query to the docs that sort after a position.
+
+    This stands in for ``search_after``, which our ES lacks. Unlike skipping
+    with ``from``, it costs no more the deeper we go.
+
+    """
+    if position is None:
+        return query
+    path, number = position
+    after = {'range': {'path': {'gt': path}}}
+    if number is not None:
+        after = {'or': [after,
+                        {'and': [{'term': {'path': path}},
+                                 {'range': {'number': {'gt': number}}}]}]}
+    return {'filtered': {'query': query, 'filter': after}}
+
+
 @cached
 def direct_searchers(plugins):
     """Return a list of all direct searchers, ordered by priority, then plugin
@@ -30,11 +105,31 @@ def direct_searchers(plugins):
 
 
 class Query(object):
-    """Query object, constructor will parse any search query"""
+    """Query object, constructor will parse any search query
+
+    :arg candidate_budget: If nonzero, have ES find only candidates for terms
+        whose filters can verify lines themselves, like regexes, and check at
+        most this many candidates per query in Python
+    :arg scan_budget: If nonzero, rather than refusing terms whose filters
+        can't narrow down candidates at all, like regexes without trigrams,
+        check at most this many lines per query against them
+    :arg scan_timeout: The most seconds to spend on such a scan
+    :arg cache: A search cache from :mod:`dxr.searchcache` to keep results in,
+        or None
+    :arg index: The name of the index ``es_search`` really searches, which
+        scopes the cached results. Without one, nothing is cached.
 
-    def __init__(self, es_search, querystr, enabled_plugins):
+    """
+    def __init__(self, es_search, querystr, enabled_plugins,
+                 candidate_budget=0, scan_budget=0, scan_timeout=None,
+                 cache=None, index=None):
         self.es_search = es_search
         self.enabled_plugins = list(enabled_plugins)
+        self.candidate_budget = candidate_budget
+        self.scan_budget = scan_budget
+        self.scan_timeout = scan_timeout
+        self.cache = cache if index else None
+        self.index = index
 
         # A list of dicts describing query terms:
         grammar = query_grammar(self.enabled_plugins)
@@ -82,17 +177,112 @@ class Query(object):
                                  h(file) for h in path_highlighters)),
                    [])
 
-    def results(self, offset=0, limit=100):
+    def _verified_lines(self, query, offset, limit, terms, source, budget,
+                        deadline=None, after=None):
+        """Run a LINE-domain query whose ES filter finds a superset of the
+        wanted lines, keeping only those which satisfy every one of ``terms``.
+
+        Scan the candidates in order, a batch at a time, until the window
+        described by ``offset`` and ``limit`` is full, the candidates run out,
+        or the budget or time is spent. Return (lines, result count, whether
+        the count is exact, whether the window was left unfilled for lack of
+        budget or time, the position of the last candidate checked or None if
+        there are no more). Unless every candidate got checked, the count is
+        extrapolated from those that were.
+
+        :arg terms: A list of lists of filters. Each line must satisfy at least
+            one filter of each list.
+        :arg source: A list of the fields to fetch, or None for all
+        :arg budget: The most candidates to check
+        :arg deadline: The time() at which to give up, or None for never
+        :arg after: The position to start after, or None for the beginning
+
+        """
+        lines, matches, scanned, total = [], 0, 0, None
+        is_truncated = False
+        position = after
+        while (len(lines) < limit and (total is None or scanned < total)):
+            if scanned >= budget or (deadline and time() >= deadline):
+                is_truncated = True
+                break
+            request = {'query': _after(query, position),
+                       'sort': ['path', 'number'],
+                       'size': min(CANDIDATE_BATCH_SIZE, budget - scanned)}
+            if source:
+                request['_source'] = source
+            hits = self.es_search(request, doc_type=LINE)['hits']
+            if total is None:
+                total = hits['total']
+            if not hits['hits']:
+                break
+            for hit in hits['hits']:
+                scanned += 1
+                line = hit['_source']
+                position = _position(line)
+                if all(any(f.verify(line) for f in term) for term in terms):
+                    matches += 1
+                    if matches > offset:
+                        lines.append(line)
+                        if len(lines) == limit:
+                            break
+        if total is None or scanned >= total:
+            return lines, matches, True, False, None
+        return (lines, max(matches, matches * total // scanned), False,
+                is_truncated, position)
+
+    def _cached(self, kind, compute, args, is_cacheable=lambda value: True):
+        """Return ``compute(*args)``, going through the search cache if there
+        is one."""
+        if self.cache is None:
+            return compute(*args)
+        key = cache_key(kind,
+                        self.index,
+                        self.terms,
+                        [p.name for p in self.enabled_plugins],
+                        self.candidate_budget,
+                        self.scan_budget,
+                        args)
+        entry = self.cache.get(key)
+        if entry is None:
+            entry = (compute(*args),)  # so a None result can be cached too
+            if is_cacheable(entry[0]):
+                self.cache.set(key, entry)
+        return entry[0]
+
+    def results(self, offset=0, limit=100, after=None):
         """Return a count of search results and, as an iterable, the results
         themselves::
 
             {'result_count': 12,
+             'result_count_is_exact': True,
+             'is_truncated': False,
+             'position': ('some/file.c', 40),
              'results': [(icon,
                           path within tree,
                           [(line_number, highlighted_line_of_code), ...]),
                          ...]}
 
+        The count is an estimate if candidate verification stopped short of
+        the last candidate. The results are truncated if it stopped, for lack
+        of budget or time, before finding as many as asked for.
+
+        ``position`` is where to pick up for the next page, to be passed back
+        as ``after``, or None if there are no more results. Paging that way
+        costs the same however deep it goes, unlike paging by ``offset``. With
+        ``after``, the offset and the count start from that position.
+
         """
+        # Truncation may be for lack of time, which is no reason to be stuck
+        # with it.
+        count_and_results = self._cached(
+            'results', self._results, [offset, limit, after],
+            lambda value: not value['is_truncated'])
+        return dict(count_and_results,
+                    results=iter(count_and_results['results']))
+
+    def _results(self, offset, limit, after):
+        """Do the work of :meth:`results()`, returning the results as a
+        list."""
         enabled_filters_by_name = filters_by_name(self.enabled_plugins)
 
         def group_filters_by_term(predicate):
@@ -126,9 +316,27 @@ class Query(object):
         is_line_query = any(f.domain == LINE for f in
                             chain.from_iterable(filters))
 
+        def is_scanned(term):
+            """Return whether a term is one we can verify but ES can't
+            narrow down at all."""
+            return any(not getattr(f, 'is_accelerated', True) for f in term)
+
+        def is_verified(term):
+            """Return whether to leave ES to find just candidates for a
+            term, checking them ourselves."""
+            if not (is_line_query and term and
+                    all(hasattr(f, 'verify') for f in term)):
+                return False
+            return bool(self.scan_budget if is_scanned(term) else
+                        self.candidate_budget)
+
         # An ORed-together ball for each term's filters, omitting filters that
         # punt by returning {} and ors that contain nothing but punts:
-        ors = filter(None, [filter(None, (f.filter() for f in term))
+        domain = LINE if is_line_query else FILE
+        ors = filter(None, [filter(None, (f.candidate_filter()
+                                          if is_verified(term) else
+                                          filter_clause(f, domain)
+                                          for f in term))
                             for term in filters])
         ors = [{'or': x} for x in ors]
 
@@ -155,21 +363,45 @@ class Query(object):
                 'match_all': {}
             }
 
-        results = self.es_search(
-            {'query': query,
-             'sort': ['path', 'number'] if is_line_query else ['path'],
-             'from': offset,
-             'size': limit},
-            doc_type=LINE if is_line_query else FILE)['hits']
-        result_count = results['total']
-        results = [r['_source'] for r in results['hits']]
+        source = _source_fields(chain.from_iterable(filters), domain)
+        verified_terms = filter(is_verified, filters)
+        if verified_terms:
+            # Unaccelerated terms, as they may leave ES little to narrow
+            # down, get a budget of their own, and a time limit:
+            is_scan = any(is_scanned(term) for term in verified_terms)
+            deadline = (time() + self.scan_timeout
+                        if is_scan and self.scan_timeout else None)
+            (results, result_count, is_exact, is_truncated,
+             position) = self._verified_lines(
+                query, offset, limit, verified_terms, source,
+                self.scan_budget if is_scan else self.candidate_budget,
+                deadline,
+                after)
+        else:
+            request = {'query': _after(query, after),
+                       'sort': ['path', 'number'] if is_line_query else ['path'],
+                       'from': offset,
+                       'size': limit}
+            if source:
+                request['_source'] = source
+            results = self.es_search(request, doc_type=domain)['hits']
+            result_count = results['total']
+            results = [r['_source'] for r in results['hits']]
+            is_exact, is_truncated = True, False
+            position = (_position(results[-1])
+                        if results and offset + len(results) < result_count
+                        else None)
 
         path_highlighters = [f.highlight_path for f in chain.from_iterable(filters)
                              if hasattr(f, 'highlight_path')]
         return {'result_count': result_count,
-                'results': self._line_query_results(filters, results, path_highlighters)
-                           if is_line_query
-                           else self._file_query_results(results, path_highlighters)}
+                'result_count_is_exact': is_exact,
+                'is_truncated': is_truncated,
+                'position': position,
+                'results': list(
+                    self._line_query_results(filters, results, path_highlighters)
+                    if is_line_query
+                    else self._file_query_results(results, path_highlighters))}
 
         # Test: If var-ref (or any structural query) returns 2 refs on one line, they should both get highlit.
 
@@ -181,6 +413,10 @@ class Query(object):
         rather than any specific line. If no result is found, return just None.
 
         """
+        return self._cached('direct', self._direct_result, [])
+
+    def _direct_result(self):
+        """Do the work of :meth:`direct_result()`."""
         term = self.single_term()
         if not term:
             return None
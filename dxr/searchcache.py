@@ -0,0 +1,84 @@
+"""A cache of search results for the web app
+
+An index never changes once it's deployed; a rebuild makes a new one and
+swaps the tree's alias over to it. So results can be cached indefinitely as
+long as the key includes the name of the index they came from: a swap starts
+a fresh set of keys, and the old ones age out.
+
+By default, each web process keeps its own LRU cache. Set
+``search_cache_servers`` to share one memcached (over a local socket, say)
+among all the processes instead.
+
+"""
+from hashlib import sha1
+import json
+from threading import Lock
+
+from ordereddict import OrderedDict
+
+from dxr.exceptions import ConfigError
+
+
+class MemoryCache(object):
+    """An in-process, thread-safe LRU cache
+
+    :arg size: The most entries to keep
+
+    """
+    def __init__(self, size):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        """Return the value stored under a key, or None if there isn't one."""
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self._entries[key] = value  # Move it to the recent end.
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+class MemcachedCache(object):
+    """A cache shared among processes by way of memcached
+
+    :arg servers: A list of memcached addresses, like ``127.0.0.1:11211`` or
+        ``unix:/var/run/memcached.sock``
+
+    """
+    def __init__(self, servers):
+        try:
+            from memcache import Client
+        except ImportError:
+            raise ConfigError('"search_cache_servers" needs the '
+                              'python-memcached package.', ['DXR'])
+        self._client = Client(servers)
+
+    def get(self, key):
+        return self._client.get(key)
+
+    def set(self, key, value):
+        # Failures, like a value too big for memcached, just mean a miss
+        # next time.
+        self._client.set(key, value)
+
+
+def search_cache(config):
+    """Return the search cache described by a :class:`~dxr.config.Config`, or
+    None if caching is turned off."""
+    if config.search_cache_servers:
+        return MemcachedCache(config.search_cache_servers)
+    if config.search_cache_size:
+        return MemoryCache(config.search_cache_size)
+
+
+def cache_key(*parts):
+    """Return a short, memcached-safe key for some JSON-serializable parts."""
+    return sha1(json.dumps(parts, sort_keys=True)).hexdigest()
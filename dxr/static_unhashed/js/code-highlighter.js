@@ -350,6 +350,12 @@ $(function () {
                 }
             }
 
+            //the line may not be loaded yet in the windowed view of a long file;
+            //file-window.js fetches it and triggers linesloaded
+            if (jumpPosition === undefined) {
+                return;
+            }
+
             //for directly linked line(s), scroll to the offset minus 150px for fixed search bar height
             //but only scrollTo if the offset is more than 150px in distance from the top of the page
             jumpPosition = parseInt(jumpPosition.top, 10) - 150;
@@ -374,4 +380,8 @@ $(function () {
         removeAllHighlighting();
         processHash();
     });
+    $('#file').on('linesloaded', function() {
+        removeAllHighlighting();
+        processHash();
+    });
 });
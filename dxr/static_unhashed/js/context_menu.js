@@ -17,6 +17,27 @@ $(function() {
         nonWordCharRE = /[^A-Z0-9_~]/i;
     }
 
+    /**
+     * Return the menu items of a symbol node. Most nodes point to an entry in
+     * one of the page's tables of menus; pages rendered by older DXRs carry
+     * the items on each node.
+     *
+     * @param Object node The symbol node.
+     */
+    function menuOf(node) {
+        var id = node.attr('data-menu-id'),
+            items;
+
+        if (id === undefined) {
+            return node.data('menu');
+        }
+        $('.ref-menus').each(function() {
+            items = $(this).data('menus')[id];
+            return items === undefined;  // Stop at the table having it.
+        });
+        return items || [];
+    }
+
     /**
      * Highlight, or remove highlighting from, all symbols with the same class
      * as the current node.
@@ -157,13 +178,12 @@ $(function() {
             }
 
             var currentNode = $(node).closest('a');
-            // Only check for the data-menu attribute if the current node has an
-            // ancestor that is an anchor.
+            // Only check for a menu if the current node has an ancestor that
+            // is an anchor.
             if (currentNode.length) {
                 toggleSymbolHighlights(currentNode);
 
-                var currentNodeData = currentNode.data('menu');
-                menuItems = menuItems.concat(currentNodeData);
+                menuItems = menuItems.concat(menuOf(currentNode));
             }
 
             if (menuItems.length === 0) {
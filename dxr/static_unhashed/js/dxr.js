@@ -133,6 +133,7 @@ $(function() {
         didScroll = false,
         resultsLineCount = 0,
         dataOffset = 0,
+        nextCursor = null,
         previousDataLimit = 0,
         defaultDataLimit = 100,
         lastURLWasSearch = false;  // Remember if the previous history URL was for a search (for popState).
@@ -148,14 +149,18 @@ $(function() {
      * @param {int} limit - The number of results to return.
      * @param {int} offset - The cursor position
      * @param {bool} redirect - Whether to redirect.
+     * @param {string} [cursor] - Where the previous page left off, from the
+     * server. If given, offset counts from there.
      */
-    function buildAjaxURL(query, limit, offset, redirect) {
+    function buildAjaxURL(query, limit, offset, redirect, cursor) {
         var search = dxr.searchUrl;
         var params = {};
         params.q = query;
         params.redirect = redirect;
         params.limit = limit;
         params.offset = offset;
+        if (cursor)
+            params.cursor = cursor;
 
         return search + '?' + $.param(params);
     }
@@ -194,7 +199,11 @@ $(function() {
                 previousDataLimit = defaultDataLimit;
 
                 // Resubmit query for the next set of results, making sure redirect is turned off.
-                var requestUrl = buildAjaxURL(query, defaultDataLimit, dataOffset, false);
+                // Pick up after the last page rather than skipping over
+                // everything before it, which gets slower the deeper we go.
+                var requestUrl = nextCursor ?
+                    buildAjaxURL(query, defaultDataLimit, 0, false, nextCursor) :
+                    buildAjaxURL(query, defaultDataLimit, dataOffset, false);
                 doQuery(false, requestUrl, true);
             }
         }
@@ -521,10 +530,11 @@ $(function() {
                 if (myRequestNumber > displayedRequestNumber) {
                     displayedRequestNumber = myRequestNumber;
                     populateResults(data, appendResults);
+                    nextCursor = data.cursor || null;
                     if (addToHistory) {
                         var pushHistory = function () {
                             // Strip off offset= and limit= when updating.
-                            var displayURL = removeParams(queryString, ['offset', 'limit']);
+                            var displayURL = removeParams(queryString, ['offset', 'limit', 'cursor']);
                             history.pushState({}, '', displayURL);
                             lastURLWasSearch = true;
                         };
@@ -0,0 +1,105 @@
+/**
+ * The windowed view of a long file
+ *
+ * Only a window of the file's lines comes with the page. More, already
+ * decorated by the server, are fetched as you scroll toward either end of
+ * what's loaded or follow a link to a line that isn't loaded yet.
+ */
+$(function() {
+    'use strict';
+
+    var table = $('#file'),
+        windowSize = table.data('window-size'),
+        totalLines = table.data('total-lines'),
+        path = table.data('path'),
+        linesUrl = $('#data').data('lines'),
+        loading = false,
+        edgeDistance = 1000;  // how close, in px, to an end before we fetch
+
+    if (!windowSize) {
+        return;
+    }
+
+    function lineNumbers() {
+        return $('#line-numbers .line-number');
+    }
+
+    function firstLoaded() {
+        return parseInt(lineNumbers().first().attr('id'), 10);
+    }
+
+    function lastLoaded() {
+        return parseInt(lineNumbers().last().attr('id'), 10);
+    }
+
+    /**
+     * Fetch lines start through end, and add them to the page.
+     *
+     * @param Number start The first line number to fetch
+     * @param Number end The last line number to fetch
+     * @param String where 'append', 'prepend', or 'replace' the loaded lines
+     */
+    function load(start, end, where) {
+        if (loading) {
+            return;
+        }
+        loading = true;
+        $.getJSON(linesUrl, {path: path, start: start, end: end, decorated: 'true'})
+            .done(function(data) {
+                var fetched = $('<div>').html(data.html),
+                    parts = [[$('#annotations'), fetched.find('.annotation-set')],
+                             [$('#line-numbers'), fetched.find('.line-number')],
+                             [$('#file .code pre'), fetched.find('pre code')]],
+                    oldHeight = $(document).height();
+
+                $.each(parts, function(i, part) {
+                    if (where === 'replace') {
+                        part[0].empty();
+                    }
+                    part[0][where === 'prepend' ? 'prepend' : 'append'](part[1]);
+                });
+                // The fetched lines' refs point into their own table of menus.
+                if (where === 'replace') {
+                    $('.ref-menus').remove();
+                }
+                table.after(fetched.find('.ref-menus'));
+                if (where === 'prepend') {
+                    // Keep what you were looking at where it was.
+                    window.scrollBy(0, $(document).height() - oldHeight);
+                } else if (where === 'replace') {
+                    table.trigger('linesloaded');
+                }
+            })
+            .always(function() {
+                loading = false;
+            });
+    }
+
+    /**
+     * If the hash names a line that isn't loaded, load a window around it.
+     */
+    function loadHashLine() {
+        var line = parseInt(window.location.hash.substring(1), 10),
+            start;
+
+        if (line > 0 && line <= totalLines && !document.getElementById(line)) {
+            start = Math.max(1, line - Math.floor(windowSize / 2));
+            load(start, start + windowSize - 1, 'replace');
+        }
+    }
+
+    $(window).on('scroll', function() {
+        var scrollTop = $(window).scrollTop(),
+            first = firstLoaded(),
+            last = lastLoaded();
+
+        if (last < totalLines &&
+                $(document).height() - scrollTop - $(window).height() < edgeDistance) {
+            load(last + 1, last + windowSize, 'append');
+        } else if (first > 1 && scrollTop < edgeDistance) {
+            load(Math.max(1, first - windowSize), first - 1, 'prepend');
+        }
+    });
+    $(window).on('hashchange', loadHashLine);
+    loadHashLine();
+});
@@ -39,11 +39,14 @@ class TestCase(unittest.TestCase):
         """Create a temporary DXR instance on the FS, and build it."""
         cls.generate()
         cls.index()
-        cls._es().refresh()
+        if not cls.config().local_index_folder:
+            cls._es().refresh()
 
     @classmethod
     def teardown_class(cls):
-        cls._delete_es_indices()  # TODO: Replace with a call to 'dxr delete --force'.
+        # Local indices go away with the rest of the temp folder.
+        if not cls.config().local_index_folder:
+            cls._delete_es_indices()  # TODO: Replace with a call to 'dxr delete --force'.
         cls.degenerate()
 
     @classmethod
@@ -428,6 +431,19 @@ class SingleFileTestCase(GenerativeTestCase):
             'single')
 
 
+class LocalSingleFileTestCase(SingleFileTestCase):
+    """A :class:`SingleFileTestCase` whose tree is built into a local index,
+    so it needs no elasticsearch"""
+
+    @classmethod
+    def config_input(cls, config_dir_path):
+        config = super(LocalSingleFileTestCase, cls).config_input(
+            config_dir_path)
+        config['DXR']['local_index_folder'] = join(config_dir_path, 'local')
+        config['DXR']['workers'] = 0
+        return config
+
+
 def make_file(path, filename, contents):
     """Make file ``filename`` within ``path``, full of unicode ``contents``."""
     with open(join(path, filename), 'w') as file:
@@ -444,7 +460,7 @@ def _decoded_menu_on(haystack, text, text_instance=1):
     # We just use cheap-and-cheesy regexes for now, to avoid pulling in and
     # compiling the entirety of lxml to run pyquery.
     matches = re.finditer(
-              '<a data-menu="([^"]+)"[^>]*>' + re.escape(cgi.escape(text)) + '</a>',
+              '<a data-menu-id="([^"]+)"[^>]*>' + re.escape(cgi.escape(text)) + '</a>',
               haystack)
     for _ in xrange(text_instance):
         try:
@@ -454,10 +470,16 @@ def _decoded_menu_on(haystack, text, text_instance=1):
             break
 
     if match:
-        return json.loads(match.group(1).replace('&quot;', '"')
-                                        .replace('&lt;', '<')
-                                        .replace('&gt;', '>')
-                                        .replace('&amp;', '&'))
+        # The menus themselves are in the page's table of them.
+        menus = {}
+        for table in re.findall('data-menus="([^"]+)"', haystack):
+            menus.update(json.loads(table.replace('&#34;', '"')
+                                         .replace('&quot;', '"')
+                                         .replace('&#39;', "'")
+                                         .replace('&lt;', '<')
+                                         .replace('&gt;', '>')
+                                         .replace('&amp;', '&')))
+        return menus[match.group(1)]
     else:
         ok_(False, "No menu around occurrence %d of '%s' was found." %
                    (text_instance, text))
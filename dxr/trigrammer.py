@@ -11,13 +11,15 @@ closely as possible.
 
 Junghoo Ch and Sridhar Rajagopalan, in "A fast regular expression indexing
 engine", descibe an intuitive method for accelerating regex searching with a
-trigram index. This is roughly an implementation of that.
+trigram index.
 
 Russ Cox, in http://swtch.com/~rsc/regexp/regexp4.html, refines
 that to {(1) extract use from runs of less than 3 static chars and (2) extract
 trigrams that cross the boundaries between subexpressions} by keeping track of
 prefix and suffix information while chewing through a pattern and effectively
-merging adjacent subpatterns. This is a direction we may go in the future.
+merging adjacent subpatterns. That's what we do: see :class:`RegexInfo`. Where
+Cox emits trigrams, we emit whole strings, since ES's ``match_phrase`` on a
+trigram field turns them into trigrams for us.
 
 """
 from itertools import chain
@@ -27,6 +29,11 @@ from parsimonious import Grammar, NodeVisitor
 
 NGRAM_LENGTH = 3
 
+# The most strings we'll keep in any exact, prefix, or suffix set or enumerate
+# from a character class. Cross products that would be bigger are given up on
+# in favor of vaguer information, trading selectivity for smaller ES queries.
+MAX_SET_SIZE = 16
+
 
 class NoTrigrams(Exception):
     """We couldn't extract any trigrams (or longer) from a regex."""
@@ -35,14 +42,6 @@ class NoTrigrams(Exception):
 # We should parse a regex. Then go over the tree and turn things like c+ into cc*, perhaps, as it makes it easier to see trigrams to extract.
 # TODO: Parse normal regex syntax, but spit out Lucene-compatible syntax, with " escaped. And all special chars escaped even in character classes, in accordance with https://lucene.apache.org/core/4_6_0/core/org/apache/lucene/util/automaton/RegExp.html?is-external=true.
 
-# TODO: Expand positive char classes so we can get trigrams out of [sp][rne]
-# (trilite expands char classes of up to 10 chars but does nothing for larger
-# ones), and be able to get trigrams out of sp(rint) as well. Production
-# currently does that much. It is not, however, smart enough to expand
-# spr{1,3}, nor spr+. An easy way would be to keep track of prefixes and
-# suffixes (and trigram-or-better infixes) for each node, then work our way up
-# the tree.
-
 
 class SubstringTree(list):
     """A node specifying a boolean operator, with strings or more such nodes as
@@ -64,9 +63,12 @@ class SubstringTree(list):
     def simplified(self, min_length=NGRAM_LENGTH):
         """Return a smaller but equivalent tree structure or a string.
 
-        Simplify by turning nodes with only 1 child into mere strings and
-        removing nodes with 0. If the top-level node ends up having 0
-        children, the final result is ``u''``.
+        Simplify by turning nodes with only 1 child into mere strings, hoisting
+        the children of nested nodes of the same kind, and removing duplicate
+        and redundant children. Strings shorter than ``min_length`` can't be
+        searched for, so they are removed from Ands and make Ors match
+        anything. If the top-level node ends up having 0 children, the final
+        result is ``u''``.
 
         """
         def simplified(tree_or_string):
@@ -77,23 +79,24 @@ class SubstringTree(list):
                         else '')
             return tree_or_string.simplified(min_length=min_length)
 
-        # TODO: Think about implementing the Cox method. I now see that I'm
-        # going to have to write some kind of theorems into even the FREE
-        # method if I want to be able to extract trigrams from ab[cd]
-        # (prefixes, cross products), so I might as well use Cox's. We can
-        # code his theorems right into the visitor. I don't think it will get
-        # too messy. Low-level nodes' visitation will just cast strings to
-        # ints, etc., and high-level ones will just apply Cox theorems. Btw,
         # http://code.ohloh.net/file?fid=rfNSbmGXJxqJhWDMLp3VaEMUlgQ&cid=
         # eDOmLT58hyw&s=&fp=305491&mp=&projSelected=true#L0 is PG's
         # explanation of their simplification stuff.
-
-        # Filter out empty strings and empty subtrees, both of which are
-        # equally useless. (Remember, adjacent strings in an And don't mean
-        # adjacent strings in the found text, so a '' in an Or doesn't help us
-        # narrow down the result set at all.)
-        simple_children = filter(None,
-                                 (simplified(n) for n in self))
+        simple_children = []
+        for child in (simplified(n) for n in self):
+            if child == '' and self._absorbs_empty:
+                # Remember, adjacent strings in an And don't mean adjacent
+                # strings in the found text, so a '' in an And doesn't help us
+                # narrow down the result set at all, and one in an Or means
+                # the Or can be satisfied by anything.
+                continue
+            if child == '':
+                return u''
+            for grandchild in (child if child.__class__ is self.__class__
+                               else [child]):
+                if grandchild not in simple_children:
+                    simple_children.append(grandchild)
+        simple_children = self._unredundant(simple_children)
         if len(simple_children) > 1:
             return self.__class__(simple_children)
         elif len(simple_children) == 1:
@@ -103,8 +106,8 @@ class SubstringTree(list):
 
 
 class Useless(SubstringTree):
-    """This doubles as the singleton USELESS and a "ruined" Or, to which adding
-    anything yields USELESS back.
+    """This doubles as the singleton USELESS, which stands for a char in a
+    character class that doesn't boil down to a single literal char.
 
     Don't construct any more of these.
 
@@ -112,18 +115,10 @@ class Useless(SubstringTree):
     def __repr__(self):
         return 'USELESS'
 
-    def appended(self, branch):
-        return self
-
-    def extended(self, branches):
-        return self
 
-
-# Stand-in for a subpattern that's useless for producing trigrams. It is opaque
-# for our purposes, either intrinsically or just because we're not yet smart
-# enough to shatter it into a rain of ORed literals. USELESS breaks the
-# continuity between two things we *can* extract trigrams from, meaning we
-# shouldn't try making any trigrams that span the two.
+# Stand-in for a (class) char that's useless for producing trigrams, like \s.
+# It is opaque for our purposes, either intrinsically or just because we're
+# not yet smart enough to shatter it into a rain of ORed literals.
 USELESS = Useless()
 
 
@@ -131,72 +126,99 @@ class And(SubstringTree):
     """A list of strings (or other Ands and Ors) which will all be found in
     texts matching a given node
 
-    The strings herein are not necessarily contiguous with each other, but two
-    strings appended in succession are taken to be contiguous and are merged
-    internally.
+    The strings herein are not necessarily contiguous with each other.
 
     """
-    # If we just hit a non-string, we should break the previous string of chars
-    # and start a new one:
-    string_was_interrupted = True
+    _absorbs_empty = True
 
     def __repr__(self):
         return 'And(%s)' % super(And, self).__repr__()
 
-    def appended(self, thing):
-        """Add a string or And or Or as one of my children.
-
-        Merge it with the previous node if both are string literals. Return
-        myself. If the new thing is something useless for the purpose of
-        extracting trigrams, don't add it.
-
-        """
-        if thing is USELESS:  # TODO: Doesn't handle Ors. Why not?
-            # ANDs eat USELESSes. We can ignore it.
-            self.string_was_interrupted = True
-        elif isinstance(thing, basestring):
-            if self.string_was_interrupted:
-                self.string_was_interrupted = False
-                self.append(thing)
-            else:
-                self[-1] += thing
-        else:  # an And or Or node
-            self.string_was_interrupted = True
-            self.append(thing)
-        return self
-
-    def extended(self, things):
-        a = self
-        for t in things:
-            a = a.appended(t)
-        return a
+    @staticmethod
+    def _unredundant(children):
+        """Drop strings which are substrings of other children, since finding
+        the longer one finds them too."""
+        return [c for c in children if not
+                (isinstance(c, basestring) and
+                 any(o != c and isinstance(o, basestring) and c in o
+                     for o in children))]
 
 
 class Or(SubstringTree):
     """A list of strings (or other Ands and Ors) of which one will be found in
     all texts matching a given node"""
 
+    _absorbs_empty = False
+
     def __repr__(self):
         return 'Or(%s)' % super(Or, self).__repr__()
 
-    def appended(self, branch):
-        """Add a string or And or Or as one of my children.
+    @staticmethod
+    def _unredundant(children):
+        """Drop strings of which other children are substrings, since any
+        text containing the longer one satisfies the shorter anyway."""
+        return [c for c in children if not
+                (isinstance(c, basestring) and
+                 any(o != c and isinstance(o, basestring) and o in c
+                     for o in children))]
+
+
+class RegexInfo(object):
+    """What we know about the texts matched by a regex or a subpattern of one
+
+    This is the bookkeeping of the Cox method. Working up the parse tree, we
+    combine the info of subpatterns to get that of their parents, which lets
+    us extract strings that cross the boundaries between subpatterns, like
+    ``abc`` and ``abd`` from ``ab[cd]``. Instances are never changed once
+    made, so they can be shared.
+
+    :attr emptyable: Whether the empty string is matched
+    :attr exact: A list of all the strings matched, or None if there are too
+        many or infinitely many
+    :attr prefix: A list of strings one of which every match starts with
+    :attr suffix: A list of strings one of which every match ends with
+    :attr match: A SubstringTree every match satisfies, beyond what the other
+        attributes say
 
-        Return myself. If the new branch is something that makes me become
-        useless for the purpose of extracting trigrams, return USELESS.
-
-        """
-        if branch is USELESS:
-            return USELESS
-        self.append(branch)
-        return self
-
-    def extended(self, branches):
-        """Like ``appended`` but for multiple children"""
-        if USELESS in branches:
-            return USELESS
-        self.extend(branches)
-        return self
+    """
+    def __init__(self, emptyable, exact=None, prefix=None, suffix=None,
+                 match=None):
+        self.emptyable = emptyable
+        self.exact = exact
+        self.prefix = exact if prefix is None else prefix
+        self.suffix = exact if suffix is None else suffix
+        self.match = And() if match is None else match
+
+    def substrings(self):
+        """Return an unsimplified SubstringTree which every text containing a
+        match satisfies."""
+        if self.exact is not None:
+            return And([self.match, Or(self.exact)])
+        return And([self.match, Or(self.prefix), Or(self.suffix)])
+
+
+# The info of the empty string, ^, and $:
+EMPTY = RegexInfo(True, exact=[u''])
+# The info of something matching one char that we can't enumerate, like .:
+ANY_CHAR = RegexInfo(False, prefix=[u''], suffix=[u''])
+# The info of something matching any string, like x*:
+ANYTHING = RegexInfo(True, prefix=[u''], suffix=[u''])
+
+
+def _unique(strings):
+    """Return a list of strings with duplicates removed, keeping order."""
+    seen = set()
+    return [s for s in strings if not (s in seen or seen.add(s))]
+
+
+def _pruned(strings, is_prefix):
+    """Return a set of prefixes (or suffixes) without any that start (or end)
+    with another, since those add nothing."""
+    strings = _unique(strings)
+    has = (lambda s, t: s.startswith(t)) if is_prefix else \
+          (lambda s, t: s.endswith(t))
+    return [s for s in strings if not
+            any(t != s and has(s, t) for t in strings)]
 
 
 class BadRegex(Exception):
@@ -268,26 +290,27 @@ regex_grammar = Grammar(r"""
 
 
 class SubstringTreeVisitor(NodeVisitor):
-    """Visitor that converts a parsed ``regex_grammar`` tree into one suitable
-    for extracting boolean substring queries from.
+    """Visitor that converts a parsed ``regex_grammar`` tree into a
+    :class:`RegexInfo`, whose :meth:`~RegexInfo.substrings()` are suitable for
+    extracting boolean substring queries from.
 
     In the returned tree, strings represent literal strings, ruling out any
     fancy meanings like "*" would have.
 
-    I throw away any information that can't contribute to trigrams. In the
-    future, we might throw away less, expanding things like ``[ab]`` to
-    ``Or(['a', 'b'])``.
+    :arg max_set_size: The most strings to track in any set, which bounds the
+        cross products of concatenation and the expansion of classes
 
     """
     unwrapped_exceptions = (BadRegex,)
 
-    visit_piece = visit_atom = visit_char = visit_class_char = \
-        visit_class_item = visit_backslash_operand = NodeVisitor.lift_child
+    visit_piece = visit_atom = visit_class_char = visit_class_item = \
+        visit_backslash_operand = NodeVisitor.lift_child
 
-    # Not only does a ^ or a $ break up two otherwise contiguous literal
-    # strings, but there is no text which matches a^b or a$b.
-    visit_hat = visit_dollars = visit_dot = visit_inverted_class = \
-        lambda self, node, children: USELESS
+    # There is no text which matches a^b, but treating ^ and $ as the empty
+    # string is safe, since we need only find a superset of the matches.
+    visit_hat = visit_dollars = lambda self, node, children: EMPTY
+    visit_dot = visit_inverted_class = \
+        lambda self, node, children: ANY_CHAR
 
     backslash_specials = {'a': '\a',
                           'e': '\x1B',  # for PCRE compatibility
@@ -300,6 +323,8 @@ class SubstringTreeVisitor(NodeVisitor):
                              '+': (1, ''),
                              '?': (0, 1)}
 
+    def __init__(self, max_set_size=MAX_SET_SIZE):
+        self.max_set_size = max_set_size
 
     def generic_visit(self, node, children):
         """Return the node verbatim if we have nothing better to do.
@@ -310,22 +335,11 @@ class SubstringTreeVisitor(NodeVisitor):
         return node
 
     def visit_regexp(self, regexp, (branch, other_branches)):
-        o = Or().appended(branch)
-        o = o.extended(other_branches)
-        return o
+        return reduce(self._alternated, other_branches, branch)
 
     def visit_branch(self, branch, pieces):
-        """Merge adjacent literals (anything we could turn into a string).
-
-        Return an And.
-
-        """
-        # All this thing's possible children return strings, Ors, or USELESS.
-        a = And().extended(pieces)
-        if not a:
-            # Represent a 0-length And with an empty string, for consistency.
-            a.append('')
-        return a
+        """Concatenate the pieces of a branch."""
+        return reduce(self._concatenated, pieces) if pieces else EMPTY
 
     def visit_more_branches(self, more_branches, branches):
         return branches
@@ -333,17 +347,24 @@ class SubstringTreeVisitor(NodeVisitor):
     def visit_another_branch(self, another_branch, (pipe, branch)):
         return branch
 
-    def visit_quantified(self, quantified, (atom, (min, max))):
-        # TODO: This is one place to make smarter. Return USELESS less often.
-        # At the moment, we just return one copy of ourselves iff we have a min
-        # of at least 1.
-        return atom if min else USELESS
+    def visit_quantified(self, quantified, (atom, (least, most))):
+        if not least:
+            if most == 1:
+                return self._alternated(atom, EMPTY)
+            return EMPTY if most == 0 else ANYTHING
+        # A few copies are enough to get every trigram spanning them. If more
+        # copies can follow, we no longer know exactly what matches, but the
+        # prefixes, suffixes, and substrings of the first few still hold.
+        info = reduce(self._concatenated, [atom] * min(least, NGRAM_LENGTH))
+        return info if least == most <= NGRAM_LENGTH else self._inexact(info)
 
     def visit_quantifier(self, or_, (quantifier,)):
         """Return a tuple of (min, max), where '' means infinity."""
         # It'll either be in the hash, or it will have already been broken
         # down into a tuple by visit_repeat_range.
-        return self.quantifier_expansions.get(quantifier.text, quantifier)
+        if isinstance(quantifier, tuple):
+            return quantifier
+        return self.quantifier_expansions[quantifier.text]
 
     def visit_repeat(self, repeat, (brace, repeat_range, end_brace)):
         return repeat_range
@@ -355,34 +376,35 @@ class SubstringTreeVisitor(NodeVisitor):
 
         """
         min, comma, max = repeat_range.text.partition(',')
+        if not comma:
+            max = min
         return int(min), (max if max == '' else int(max))
 
     def visit_number(self, number, children):
-        return int(number)
+        return int(number.text)
 
     def visit_group(self, group, (paren, regexp, end_paren)):
         return regexp
 
     def visit_class(self, class_, (bracket, no_hat, contents, end_bracket)):
-        """Return an Or of unicode chars and 2-tuples of unicode chars.
+        """Return the info of one of the class's chars.
 
         If the class has too many members, to the point where we guess the
         expense of checking so many Or branches in ES would be greater than
-        the selectivity benefit, return USELESS.
+        the selectivity benefit, treat it like a dot.
 
         """
-        MAX_ORS = 5  # Wild guess. Tune.
         if USELESS in contents:  # Or-ing with USELESS = USELESS.
-            return USELESS
-        if len(contents) > MAX_ORS:
-            return USELESS
+            return ANY_CHAR
+        if len(contents) > self.max_set_size:
+            return ANY_CHAR
         if sum((1 if isinstance(x, basestring) else ord(x[1]) - ord(x[0]) + 1)
-               for x in contents) > MAX_ORS:
-            return USELESS
-        return Or(chain.from_iterable(x if isinstance(x, basestring) else
-                                      (unichr(y) for y in xrange(ord(x[0]),
-                                                              ord(x[1]) + 1))
-                                      for x in contents))
+               for x in contents) > self.max_set_size:
+            return ANY_CHAR
+        return RegexInfo(False, exact=_unique(chain.from_iterable(
+            x if isinstance(x, basestring) else
+            (unichr(y) for y in xrange(ord(x[0]), ord(x[1]) + 1))
+            for x in contents)))
 
     def visit_class_contents(self, class_contents, (maybe_bracket,
                                                     class_items)):
@@ -406,12 +428,17 @@ class SubstringTreeVisitor(NodeVisitor):
                            (start.text, end.text))
         return start.text, end.text
 
+    def visit_char(self, char, (literal,)):
+        """Return the info of a char outside a class."""
+        return ANY_CHAR if literal is USELESS else RegexInfo(False,
+                                                             exact=[literal])
+
     def visit_literal_char(self, literal_char, children):
         return literal_char.text
 
     def visit_backslash_special(self, backslash_special, children):
-        """Return a char if there is a char equivalent. Otherwise, return a
-        BackslashSpecial."""
+        """Return a char if there is a char equivalent. Otherwise, return
+        USELESS."""
         # TODO: Don't return USELESS so much.
         return self.backslash_specials.get(backslash_special.text, USELESS)
 
@@ -421,11 +448,88 @@ class SubstringTreeVisitor(NodeVisitor):
 
     def visit_backslash_hex(self, backslash_hex, children):
         """Return the character specified by the hex code."""
-        return unichr(backslash_hex.text[1:])
+        return unichr(int(backslash_hex.text[1:], 16))
 
     def visit_backslash_normal(self, backslash_normal, children):
         return backslash_normal.text
 
+    # The theorems of the Cox method:
+
+    def _product(self, heads, tails):
+        """Return every concatenation of a string from ``heads`` and one from
+        ``tails``, or None if there would be too many."""
+        if len(heads) * len(tails) > self.max_set_size:
+            return None
+        return _unique(h + t for h in heads for t in tails)
+
+    def _bounded(self, strings, is_prefix):
+        """Return a prefix (or suffix) set cut down to our maximum size.
+
+        Shortening the strings keeps them prefixes (or suffixes) and, by
+        merging some, shrinks the set.
+
+        """
+        strings = _pruned(strings, is_prefix)
+        while len(strings) > self.max_set_size:
+            length = max(len(s) for s in strings) - 1
+            strings = _pruned([s[:length] if is_prefix else
+                               s[len(s) - length:] for s in strings],
+                              is_prefix)
+        return strings
+
+    def _inexact(self, info):
+        """Return info like ``info`` but forgetting its exact set, as when
+        it's too big, saving what it tells us about substrings first."""
+        if info.exact is None:
+            return info
+        return RegexInfo(info.emptyable,
+                         prefix=info.exact,
+                         suffix=info.exact,
+                         match=And([info.match, Or(info.exact)]))
+
+    def _alternated(self, x, y):
+        """Return the info of ``x|y``."""
+        if x.exact is not None and y.exact is not None:
+            exact = _unique(x.exact + y.exact)
+            if len(exact) <= self.max_set_size:
+                return RegexInfo(x.emptyable or y.emptyable,
+                                 exact=exact,
+                                 match=Or([x.match, y.match]))
+        x, y = self._inexact(x), self._inexact(y)
+        return RegexInfo(x.emptyable or y.emptyable,
+                         prefix=self._bounded(x.prefix + y.prefix, True),
+                         suffix=self._bounded(x.suffix + y.suffix, False),
+                         match=Or([x.match, y.match]))
+
+    def _concatenated(self, x, y):
+        """Return the info of ``xy``."""
+        if x.exact is not None and y.exact is not None:
+            exact = self._product(x.exact, y.exact)
+            if exact is not None:
+                return RegexInfo(x.emptyable and y.emptyable,
+                                 exact=exact,
+                                 match=And([x.match, y.match]))
+            x, y = self._inexact(x), self._inexact(y)
+
+        match = And([x.match, y.match])
+        # Strings spanning the boundary are where Cox shines over the rest:
+        boundary = self._product(x.suffix, y.prefix)
+        match.extend([Or(boundary)] if boundary is not None else
+                     [Or(x.suffix), Or(y.prefix)])
+
+        prefix = (None if x.exact is None else
+                  self._product(x.exact, y.prefix))
+        if prefix is None:
+            prefix = x.prefix + y.prefix if x.emptyable else x.prefix
+        suffix = (None if y.exact is None else
+                  self._product(x.suffix, y.exact))
+        if suffix is None:
+            suffix = y.suffix + x.suffix if y.emptyable else y.suffix
+        return RegexInfo(x.emptyable and y.emptyable,
+                         prefix=self._bounded(prefix, True),
+                         suffix=self._bounded(suffix, False),
+                         match=match)
+
 
 class JsRegexVisitor(NodeVisitor):
     """Visitor for converting a parsed DXR-flavored regex to a JS equivalent"""
@@ -546,6 +650,26 @@ def boolean_filter_tree(substrings, trigram_field):
     }
 
 
+def es_trigram_filter(parsed_regex, raw_field, is_case_sensitive):
+    """Return an ES filter which finds a superset of the docs whose field
+    contains a match for a regex, using only its trigram index.
+
+    Raise :class:`NoTrigrams` if the regex offers nothing to search for.
+    Arguments are as for :func:`es_regex_filter()`.
+
+    """
+    trigram_field = ('%s.trigrams' if is_case_sensitive else
+                     '%s.trigrams_lower') % raw_field
+    info = SubstringTreeVisitor().visit(parsed_regex)
+    substrings = info.substrings().simplified()
+    if isinstance(substrings, basestring) and len(substrings) < NGRAM_LENGTH:
+        raise NoTrigrams
+        # We could alternatively consider doing an unaccelerated Lucene regex
+        # query at this point. It would be slower but tolerable on a
+        # moz-central-sized codebase: perhaps 500ms rather than 80.
+    return boolean_filter_tree(substrings, trigram_field)
+
+
 def es_regex_filter(parsed_regex, raw_field, is_case_sensitive):
     """Return an efficient ES filter to find matches to a regex.
 
@@ -561,33 +685,22 @@ def es_regex_filter(parsed_regex, raw_field, is_case_sensitive):
         case-sensitive
 
     """
-    trigram_field = ('%s.trigrams' if is_case_sensitive else
-                     '%s.trigrams_lower') % raw_field
-    substrings = SubstringTreeVisitor().visit(parsed_regex).simplified()
-
-    # If tree is a string, just do a match_phrase. Otherwise, add .* to the
-    # front and back, and build some boolean algebra.
-    if isinstance(substrings, basestring) and len(substrings) < NGRAM_LENGTH:
-        raise NoTrigrams
-        # We could alternatively consider doing an unaccelerated Lucene regex
-        # query at this point. It would be slower but tolerable on a
-        # moz-central-sized codebase: perhaps 500ms rather than 80.
-    else:
-        # Should be fine even if the regex already starts or ends with .*:
-        js_regex = JsRegexVisitor().visit(parsed_regex)
-        return {
-            'and': [
-                boolean_filter_tree(substrings, trigram_field),
-                {
-                    'script': {
-                        'lang': 'js',
-                        # test() tests for containment, not matching:
-                        'script': '(new RegExp(pattern, flags)).test(doc["%s"][0])' % raw_field,
-                        'params': {
-                            'pattern': js_regex,
-                            'flags': '' if is_case_sensitive else 'i'
-                        }
+    trigrams = es_trigram_filter(parsed_regex, raw_field, is_case_sensitive)
+    # Should be fine even if the regex already starts or ends with .*:
+    js_regex = JsRegexVisitor().visit(parsed_regex)
+    return {
+        'and': [
+            trigrams,
+            {
+                'script': {
+                    'lang': 'js',
+                    # test() tests for containment, not matching:
+                    'script': '(new RegExp(pattern, flags)).test(doc["%s"][0])' % raw_field,
+                    'params': {
+                        'pattern': js_regex,
+                        'flags': '' if is_case_sensitive else 'i'
                     }
                 }
-            ]
-        }
+            }
+        ]
+    }
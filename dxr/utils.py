@@ -327,3 +327,21 @@ def unicode_for_display(str):
 
     """
     return str.decode('utf8', 'replace')
+
+
+def stable_repr(value):
+    """Return a repr of a config value which is the same from run to run.
+
+    Config schemas can turn values into objects, like compiled regexes,
+    whose default reprs hold memory addresses.
+
+    """
+    def normalized(value):
+        if isinstance(value, dict):
+            return sorted((k, normalized(v)) for k, v in value.iteritems())
+        if isinstance(value, (list, tuple)):
+            return [normalized(v) for v in value]
+        if hasattr(value, 'pattern') and hasattr(value, 'flags'):  # a regex
+            return value.pattern, value.flags
+        return value
+    return repr(normalized(value))
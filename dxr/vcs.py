@@ -29,6 +29,7 @@ from warnings import warn
 import hglib
 from ordereddict import OrderedDict
 
+from dxr.manifest import tree_manifest
 from dxr.utils import without_ending
 
 
@@ -109,6 +110,16 @@ class Vcs(object):
         """Return a human-readable revision identifier for the repository."""
         raise NotImplementedError
 
+    def changed_paths(self, revision):
+        """Return a set of paths, relative to my root, which differ between
+        ``revision`` and the working copy. Deleted paths are included.
+
+        Raise NotImplementedError if this VCS can't tell, or
+        subprocess.CalledProcessError if it doesn't know ``revision``.
+
+        """
+        raise NotImplementedError
+
 
 class Mercurial(Vcs):
     command = 'hg'
@@ -195,6 +206,10 @@ class Mercurial(Vcs):
     def generate_log(self, path):
         return "{}filelog/{}/{}".format(self.upstream, self.revision, path)
 
+    def changed_paths(self, revision):
+        return _nul_separated(self.invoke_vcs(
+            ['status', '--rev', revision, '-mard', '-n', '-0'], self.root))
+
     @classmethod
     def get_contents(cls, working_dir, rel_path, revision, stderr=None):
         return cls.invoke_vcs(['cat', '-r', revision, rel_path], working_dir, stderr=stderr)
@@ -293,6 +308,13 @@ class Git(Vcs):
     def generate_log(self, path):
         return "{}/commits/{}/{}".format(self.upstream, self.revision, path)
 
+    def changed_paths(self, revision):
+        # Compare against the working tree, not HEAD, since that's what we
+        # index. Without --no-renames, only the new name of a moved file would
+        # show up.
+        return _nul_separated(self.invoke_vcs(
+            ['diff', '--name-only', '--no-renames', '-z', revision], self.root))
+
     @classmethod
     def get_contents(cls, working_dir, rel_path, revision, stderr=None):
         return cls.invoke_vcs(['show', revision + ':./' + rel_path], working_dir, stderr=stderr)
@@ -375,6 +397,11 @@ class Perforce(Vcs):
 every_vcs = [Mercurial, Git, Perforce]
 
 
+def _nul_separated(output):
+    """Return the set of non-empty NUL-delimited strings in some VCS output."""
+    return set(p for p in output.split('\0') if p)
+
+
 def tree_to_repos(tree):
     """Given a TreeConfig, return a mapping {root: Vcs object} where root is a
     directory under tree.source_folder where root is a directory under
@@ -386,10 +413,12 @@ def tree_to_repos(tree):
     """
     sources = {}
     # Find all of the VCSs in the source directory:
-    # We may see multiple VCS if we use git submodules, for example.
-    for cwd, dirs, files in os.walk(tree.source_folder):
+    # We may see multiple VCS if we use git submodules, for example. The
+    # manifest notes which folders contain things like .git dirs, so we needn't
+    # walk the tree again.
+    for cwd, markers in tree_manifest(tree).vcs_markers:
         for vcs in every_vcs:
-            attempt = vcs.claim_vcs_source(cwd, dirs, tree)
+            attempt = vcs.claim_vcs_source(cwd, list(markers), tree)
             if attempt is not None:
                 sources[attempt.root] = attempt
 
@@ -479,6 +508,12 @@ class VcsCache(object):
         self.repos = tree_to_repos(tree)
         self._path_cache = {}
 
+    def revisions(self):
+        """Return a map of each repo root, relative to the source folder, to
+        the revision checked out there."""
+        return dict((relpath(root, self.tree.source_folder), vcs.revision)
+                    for root, vcs in self.repos.iteritems())
+
     def vcs_for_path(self, path):
         """Given a tree and a path in the tree, find a source repository we
         know about that claims to track that file.
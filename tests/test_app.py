@@ -4,11 +4,22 @@ Much of the module is covered in the course of the integration tests that test
 everything else. Here are a few unit tests.
 
 """
+import json
+from os import mkdir
+from os.path import join
+import re
 from unittest import TestCase
 
-from nose.tools import eq_
+from nose.tools import eq_, ok_
 
-from dxr.app import _linked_pathname
+import dxr.app
+from dxr.app import (LINE_BATCH_SIZE, _linked_pathname, frozen_config,
+                     make_app)
+from dxr.config import FORMAT, Config
+from dxr.filters import FILE, LINE
+from dxr.localsearch import LocalSearch
+from dxr.pages import PageStore
+from dxr.testing import LocalSingleFileTestCase
 
 
 class LinkedPathnameTests(TestCase):
@@ -22,3 +33,198 @@ class LinkedPathnameTests(TestCase):
     def test_root_folder(self):
         """Make sure the root folder is treated correctly."""
         eq_(_linked_pathname('', 'stuff'), [('/stuff/source', 'stuff')])
+
+
+class PrerenderedPageTests(LocalSingleFileTestCase):
+    """Tests for serving pages rendered at index time"""
+
+    source_filename = 'main.c'
+    source = 'int main() {\n    return 0;\n}\n'
+
+    @classmethod
+    def config_input(cls, config_dir_path):
+        config = super(PrerenderedPageTests, cls).config_input(config_dir_path)
+        config['DXR']['prerender_folder'] = join(config_dir_path, 'pages')
+        # Pygmentize, which is on by default, skims only files whose FILE
+        # docs are bare, and compact rendering puts the decorations there.
+        config['DXR']['enabled_plugins'] = 'pygmentize'
+        config['code']['compact_rendering'] = 'true'
+        return config
+
+    def test_stored_page(self):
+        """A page stored for the index should be the one served."""
+        # Builds into local indices go by way of an export, which renders no
+        # pages, so we store one ourselves.
+        ok_('<p id="stored"></p>' not in self.source_page('main.c'))
+        with self.app().test_request_context():
+            index = frozen_config('code')['es_index']
+        PageStore(self.config().prerender_folder).put(
+            index, u'main.c', u'<p id="stored"></p>')
+        ok_('<p id="stored"></p>' in self.source_page('main.c'))
+
+
+class DocIdTests(LocalSingleFileTestCase):
+    """Tests for the IDs of indexed docs"""
+
+    source_filename = 'main.c'
+    source = 'int main() {\n    return 0;\n}\n'
+
+    @classmethod
+    def generate_source(cls):
+        super(DocIdTests, cls).generate_source()
+        mkdir(join(cls.code_dir(), 'sub'))
+
+    def test_ids(self):
+        """LINE and folder docs should be IDed, so resending a bulk request
+        that timed out can't duplicate them."""
+        config = self.config()
+        es = LocalSearch(config.local_index_folder)
+        alias = config.es_alias.format(format=FORMAT,
+                                       tree='code',
+                                       config_path_hash=config.path_hash())
+        eq_(es.get(alias, LINE, u'main.c:2')['_source']['number'], [2])
+        ok_(es.get(alias, FILE, u'sub')['_source']['is_folder'])
+
+
+class StreamedPageTests(LocalSingleFileTestCase):
+    """Tests for streaming the pages of files longer than a batch of lines"""
+
+    source_filename = 'main.c'
+    source = ''.join('int x%i;  // See bug %i.\n' % (i, i) for i in range(1, 9))
+
+    @classmethod
+    def config_input(cls, config_dir_path):
+        config = super(StreamedPageTests, cls).config_input(config_dir_path)
+        config['DXR']['enabled_plugins'] = 'buglink'
+        config['code']['buglink'] = {'url': 'http://bugs.example.com/%s'}
+        return config
+
+    def test_streamed(self):
+        """A page streamed a few lines at a time should match the page of
+        the same file fetched in one batch."""
+        whole = self.source_page('main.c')
+        streamed_paths = []
+        stream_file = dxr.app._stream_file
+
+        def recording_stream_file(tree, path, *args, **kwargs):
+            streamed_paths.append(path)
+            return stream_file(tree, path, *args, **kwargs)
+
+        dxr.app.LINE_BATCH_SIZE = 3
+        dxr.app._stream_file = recording_stream_file
+        try:
+            streamed = self.source_page('main.c')
+        finally:
+            dxr.app.LINE_BATCH_SIZE = LINE_BATCH_SIZE
+            dxr.app._stream_file = stream_file
+        eq_(streamed_paths, ['main.c'])
+        ok_('http://bugs.example.com/8' in streamed)
+        eq_(streamed, whole)
+
+
+class CompactStreamedPageTests(StreamedPageTests):
+    """Tests for streaming pages whose decorations are stored compactly"""
+
+    @classmethod
+    def config_input(cls, config_dir_path):
+        config = super(CompactStreamedPageTests, cls).config_input(
+            config_dir_path)
+        config['code']['compact_rendering'] = 'true'
+        return config
+
+
+def code_lines(html):
+    """Return the code lines of a page or range of lines, keyed by line
+    number, with the IDs of their ref menus blanked out.
+
+    Menu IDs are numbered afresh for each page or range, so they aren't
+    comparable between them.
+
+    """
+    return dict((int(number), re.sub('data-menu-id="[^"]*"',
+                                     'data-menu-id=""',
+                                     line))
+                for number, line in
+                re.findall('<code id="line-(\d+)"[^>]*>(.*?)</code>', html,
+                           re.S))
+
+
+class WindowedPageTests(LocalSingleFileTestCase):
+    """Tests for showing long files a window of lines at a time"""
+
+    source_filename = 'main.c'
+    source = ''.join('int x%i;  // See bug %i.\n' % (i, i) for i in range(1, 9))
+
+    @classmethod
+    def config_input(cls, config_dir_path):
+        config = super(WindowedPageTests, cls).config_input(config_dir_path)
+        config['DXR']['enabled_plugins'] = 'buglink'
+        config['DXR']['browse_window'] = 3
+        config['code']['buglink'] = {'url': 'http://bugs.example.com/%s'}
+        return config
+
+    def whole_page_lines(self):
+        """Return the code lines of main.c's page, shown without a window."""
+        config = self.config_input(self._config_dir_path)
+        config['DXR']['browse_window'] = 0
+        app = make_app(Config(config, relative_to=self._config_dir_path))
+        return code_lines(
+            app.test_client().get('/code/source/main.c').data)
+
+    def test_window(self):
+        """Only the first window of lines should come with the page."""
+        page = self.source_page('main.c')
+        ok_('data-window-size="3"' in page)
+        ok_('data-total-lines="8"' in page)
+        lines = code_lines(page)
+        eq_(sorted(lines), [1, 2, 3])
+        whole = self.whole_page_lines()
+        for number, line in lines.iteritems():
+            eq_(line, whole[number])
+
+    def test_window_over_batch(self):
+        """A window bigger than a batch of lines should still come whole,
+        both with the page and from the lines endpoint."""
+        dxr.app.LINE_BATCH_SIZE = 2
+        try:
+            page = self.source_page('main.c')
+            data = json.loads(self.client().get(
+                '/code/lines/?path=main.c&start=5&end=7&decorated=true').data)
+        finally:
+            dxr.app.LINE_BATCH_SIZE = LINE_BATCH_SIZE
+        eq_(sorted(code_lines(page)), [1, 2, 3])
+        eq_(sorted(code_lines(data['html'])), [5, 6, 7])
+
+    def test_decorated_lines(self):
+        """A decorated range partway into the file should be numbered from
+        where it starts, and its refs should land where they do on the
+        whole page."""
+        response = self.client().get(
+            '/code/lines/?path=main.c&start=5&end=7&decorated=true')
+        eq_(response.status_code, 200)
+        data = json.loads(response.data)
+        eq_((data['start'], data['end']), (5, 7))
+        html = data['html']
+        for number in [5, 6, 7]:
+            ok_('id="aset-%i"' % number in html)
+            ok_('<span id="%i"' % number in html)
+        ok_('id="4"' not in html)
+        ok_('data-menu-id="l5-0"' in html)
+        ok_('http://bugs.example.com/5' in html)
+        lines = code_lines(html)
+        eq_(sorted(lines), [5, 6, 7])
+        whole = self.whole_page_lines()
+        for number, line in lines.iteritems():
+            ok_('data-menu-id' in line)
+            eq_(line, whole[number])
+
+
+class CompactWindowedPageTests(WindowedPageTests):
+    """Tests for windows of files whose decorations are stored compactly"""
+
+    @classmethod
+    def config_input(cls, config_dir_path):
+        config = super(CompactWindowedPageTests, cls).config_input(
+            config_dir_path)
+        config['code']['compact_rendering'] = 'true'
+        return config
@@ -0,0 +1,163 @@
+"""Tests for indexing machinery that doesn't need elasticsearch"""
+
+import json
+from time import sleep
+
+from concurrent.futures import ThreadPoolExecutor
+from nose.tools import eq_, ok_
+from pyelasticsearch import ElasticHttpError, ElasticSearch
+
+from dxr.build import (copy_docs, index_config, previous_build,
+                       submit_lazily, weighted_chunks)
+from dxr.config import Config, FORMAT
+from dxr.es import BulkSizer
+from dxr.filters import FILE, LINE
+
+
+def test_submit_lazily():
+    """Make sure every call runs, no more than the allowed number are ever
+    outstanding, and tags come back with their futures."""
+    futures = []
+    state = {'most': 0, 'consumed': 0}
+
+    def square(n):
+        # Take long enough that calls overlap, so a pool flooded with them
+        # would show.
+        sleep(0.005)
+        return n * n
+
+    def calls():
+        for n in xrange(50):
+            # A call is in flight from when it is submitted until it finishes,
+            # so, when the next is pulled, there should be room for it.
+            state['most'] = max(state['most'],
+                                sum(1 for f in futures if not f.done()))
+            state['consumed'] += 1
+            yield n, square, (n,), {}
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        submit = pool.submit
+
+        def recording_submit(*args, **kwargs):
+            future = submit(*args, **kwargs)
+            futures.append(future)
+            return future
+        pool.submit = recording_submit
+
+        finished = submit_lazily(pool, calls(), 3)
+        first_tag, first_future = next(finished)
+        # Only the first window and its refill should have been pulled.
+        ok_(state['consumed'] <= 6)
+        results = dict([(first_tag, first_future.result())] +
+                       [(tag, future.result()) for tag, future in finished])
+    eq_(results, dict((n, n * n) for n in xrange(50)))
+    eq_(len(futures), 50)
+    ok_(state['most'] <= 2)
+
+
+def test_weighted_chunks():
+    """Chunks should respect their byte and file budgets, and big files should
+    go out alone."""
+    files = [('a', 10), ('b', 10), ('huge', 100), ('c', 10), ('d', 25),
+             ('e', 1), ('f', 1), ('g', 1), ('h', 1)]
+    eq_(list(weighted_chunks(files, 30, 3)),
+        [['huge'], ['a', 'b', 'c'], ['d', 'e', 'f'], ['g', 'h']])
+
+
+def tree_config(compact_rendering='false', bug_url='http://bugs/%s'):
+    """Return the config of a tree that uses buglink."""
+    return Config("""
+        [DXR]
+        enabled_plugins = buglink
+
+        [code]
+        source_folder = code
+        compact_rendering = %s
+            [[buglink]]
+            url = %s
+        """ % (compact_rendering, bug_url), relative_to='/tmp').trees['code']
+
+
+def test_index_config():
+    """The hash of a tree's index config should change when the config of
+    its plugins or of compact rendering does, and not otherwise."""
+    eq_(index_config(tree_config()), index_config(tree_config()))
+    ok_(index_config(tree_config()) !=
+        index_config(tree_config(compact_rendering='true')))
+    ok_(index_config(tree_config()) !=
+        index_config(tree_config(bug_url='http://other/%s')))
+
+
+class FakeCatalogES(object):
+    """Just enough of an ElasticSearch to say what a tree's live index is"""
+
+    def __init__(self, frozen):
+        self.frozen = frozen
+
+    def get(self, index, doc_type, id):
+        return {'_source': self.frozen}
+
+    def aliases(self, alias):
+        return {'dxr_code_1': {}}
+
+
+class FakeVcsCache(object):
+    repos = {}
+
+
+def test_previous_build_config():
+    """Incremental builds should give up if the index config has changed."""
+    tree = tree_config()
+    frozen = {'es_alias': 'dxr_code',
+              'enabled_plugins': [p.name for p in tree.enabled_plugins],
+              'index_config': index_config(tree)}
+    eq_(previous_build(tree, FakeCatalogES(frozen), FakeVcsCache())[0],
+        'dxr_code_1')
+    eq_(previous_build(tree_config(compact_rendering='true'),
+                       FakeCatalogES(frozen),
+                       FakeVcsCache()),
+        (None, None))
+    del frozen['index_config']  # as recorded before we kept track
+    eq_(previous_build(tree, FakeCatalogES(frozen), FakeVcsCache()),
+        (None, None))
+
+
+class FakeCopyingES(ElasticSearch):
+    """An ElasticSearch with a few docs to scan, which turns down the first
+    bulk request it gets"""
+
+    def __init__(self, hits):
+        super(FakeCopyingES, self).__init__('http://localhost:9200/')
+        self.hits = hits
+        self.bulk_requests = []
+
+    def search(self, query, **kwargs):
+        return {'_scroll_id': 'scroll'}
+
+    def send_request(self, method, path_components, body='',
+                     query_params=None):
+        if path_components == ['_search', 'scroll']:
+            hits, self.hits = self.hits, []
+            return {'_scroll_id': 'scroll', 'hits': {'hits': hits}}
+        actions = body.splitlines()
+        self.bulk_requests.append((path_components, actions))
+        if len(self.bulk_requests) == 1:
+            raise ElasticHttpError(429, 'busy')
+        return {'errors': False,
+                'items': [{'index': {'status': 201}}] * (len(actions) / 2)}
+
+
+def test_copy_docs():
+    """Docs of unchanged files should be copied, by way of the backoff
+    machinery, so a busy ES doesn't sink an incremental build."""
+    es = FakeCopyingES([
+        {'_type': FILE, '_source': {'path': ['a.c']}},
+        {'_type': LINE, '_source': {'path': ['a.c'], 'number': [1]}},
+        {'_type': FILE, '_source': {'path': ['b.c']}}])
+    copy_docs(es, 'old', 'new', set([u'a.c']), BulkSizer(1, 1000, 100000))
+    eq_(len(es.bulk_requests), 2)  # one turned down, one retried
+    path, actions = es.bulk_requests[-1]
+    eq_(path, ['new', None, '_bulk'])
+    eq_([json.loads(action) for action in actions[::2]],
+        [{'index': {'_type': FILE, '_id': 'a.c'}},
+         {'index': {'_type': LINE, '_id': 'a.c:1', '_parent': 'a.c'}}])
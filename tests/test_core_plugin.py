@@ -70,9 +70,7 @@ class PathFilterTests(TestCase):
         """Make sure glob char classes aren't totally bungled and
         case-sensitivity is observed.
 
-        They should be stripped out for now, but, when we implement the Cox
-        method, they should be harnessed as prefixes and suffixes if next to
-        something else.
+        Small classes should be multiplied out with their neighbors.
 
         """
         eq_(PathFilter({'name': 'path',
@@ -83,11 +81,22 @@ class PathFilterTests(TestCase):
             {
                 'and': [
                     {
-                        'query': {
-                            'match_phrase': {
-                                'path.trigrams': 'fooba'
+                        'or': [
+                            {
+                                'query': {
+                                    'match_phrase': {
+                                        'path.trigrams': 'foobar'
+                                    }
+                                }
+                            },
+                            {
+                                'query': {
+                                    'match_phrase': {
+                                        'path.trigrams': 'foobaz'
+                                    }
+                                }
                             }
-                        }
+                        ]
                     },
                     {
                         'script': {
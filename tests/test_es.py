@@ -0,0 +1,194 @@
+"""Tests for the ES helpers that don't need a running elasticsearch"""
+
+from os import listdir
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Lock
+from unittest import TestCase
+
+from flask import Flask
+from nose.tools import eq_, ok_, assert_raises
+from pyelasticsearch import BulkError, ElasticHttpError
+
+import dxr.es
+from dxr.es import (BulkSizer, BulkUploader, CatalogCache, ShardWriter,
+                    bulk_with_backoff, frozen_config)
+
+
+class FakeES(object):
+    """Just enough of an ElasticSearch to take bulk requests
+
+    :arg responses: A list of things to do for successive requests: an item
+        status per action, or an exception to raise. Once they run out, every
+        action succeeds.
+
+    """
+    def __init__(self, responses=()):
+        self.requests = []
+        self.responses = list(responses)
+        self._lock = Lock()
+
+    def send_request(self, method, path_components, body):
+        actions = body.splitlines()
+        with self._lock:
+            self.requests.append((path_components, actions))
+            response = self.responses.pop(0) if self.responses else None
+        if isinstance(response, Exception):
+            raise response
+        statuses = response or [201] * len(actions)
+        return {'errors': any(status != 201 for status in statuses),
+                'items': [{'index': {'status': status}}
+                          for status in statuses]}
+
+
+def sizer():
+    return BulkSizer(1, 1000, 100000)
+
+
+def test_uploader_flushes():
+    """Everything handed to the uploader should be sent by the time it's
+    closed."""
+    es = FakeES()
+    with BulkUploader(es, 'idx', 'line', sizer(), threads=3,
+                      backlog=2) as uploader:
+        for n in xrange(20):
+            uploader.upload([str(n)])
+    eq_(sorted(actions for path, actions in es.requests),
+        sorted([str(n)] for n in xrange(20)))
+    eq_(es.requests[0][0], ['idx', 'line', '_bulk'])
+
+
+def test_uploader_failure():
+    """A failed request should surface in the producer."""
+    es = FakeES([[400]])
+    uploader = BulkUploader(es, 'idx', 'line', sizer(), threads=1)
+    uploader.upload(['bad'])
+    assert_raises(BulkError, uploader.close)
+
+
+class BackoffTests(TestCase):
+    def setUp(self):
+        self._sleep = dxr.es.sleep
+        dxr.es.sleep = lambda seconds: None
+
+    def tearDown(self):
+        dxr.es.sleep = self._sleep
+
+    def test_rejected_items(self):
+        """Only the actions ES rejected should be retried, and the sizer
+        should back off."""
+        es = FakeES([[201, 429, 201, 429]])
+        bulk_sizer = sizer()
+        bulk_with_backoff(es, ['a', 'b', 'c', 'd'], 'idx', 'line', bulk_sizer)
+        eq_([actions for path, actions in es.requests],
+            [['a', 'b', 'c', 'd'], ['b', 'd']])
+        ok_(bulk_sizer.docs < BulkSizer.INITIAL_DOCS)
+
+    def test_rejected_request(self):
+        """A wholesale 429 should be retried, up to a point."""
+        es = FakeES([ElasticHttpError(429, 'busy')])
+        bulk_with_backoff(es, ['a'], 'idx', 'line', sizer())
+        eq_(len(es.requests), 2)
+
+        es = FakeES([ElasticHttpError(429, 'busy')] * 3)
+        assert_raises(ElasticHttpError,
+                      bulk_with_backoff, es, ['a'], 'idx', 'line', sizer(),
+                      tries=3)
+
+    def test_real_errors(self):
+        """Failures other than rejections shouldn't be retried."""
+        es = FakeES([[201, 400]])
+        assert_raises(BulkError,
+                      bulk_with_backoff, es, ['a', 'b'], 'idx', 'line',
+                      sizer())
+        eq_(len(es.requests), 1)
+
+
+def test_sizer_bounds():
+    """The sizer should grow when things are fast, shrink when they aren't,
+    and respect its limits."""
+    bulk_sizer = BulkSizer(1, 400, 20000)
+    for _ in xrange(20):
+        bulk_sizer.answered(0.1)
+    eq_((bulk_sizer.docs, bulk_sizer.bytes), (400, 20000))
+    bulk_sizer.answered(5)
+    ok_(bulk_sizer.docs < 400)
+    for _ in xrange(20):
+        bulk_sizer.overloaded()
+    eq_((bulk_sizer.docs, bulk_sizer.bytes),
+        (BulkSizer.MIN_DOCS, BulkSizer.MIN_BYTES))
+
+
+def test_sizer_chunks():
+    """Chunks should follow the sizer's current limits."""
+    bulk_sizer = sizer()
+    bulk_sizer.docs = 2
+    eq_(list(bulk_sizer.chunks(['a', 'b', 'c'])), [['a', 'b'], ['c']])
+    bulk_sizer.docs = 10
+    bulk_sizer.bytes = 4
+    eq_(list(bulk_sizer.chunks(['a', 'b', 'c'])), [['a', 'b'], ['c']])
+
+
+def test_shard_round_trip():
+    """Actions written by a ShardWriter should read back intact, and the file
+    should be named for its doc type."""
+    folder = mkdtemp()
+    try:
+        actions = ['{"index": {}}\n{"a": 1}',
+                   '{"index": {"_type": "file"}}\n{"b": "two\\nlines"}']
+        with ShardWriter(folder, 'line', sizer()) as writer:
+            writer.upload(actions[:1])
+            writer.upload(actions[1:])
+        name, = listdir(folder)
+        ok_(name.startswith('line-'))
+        eq_(list(ShardWriter.actions(join(folder, name))), actions)
+    finally:
+        rmtree(folder)
+
+
+class FakeCatalog(object):
+    """Just enough of an ElasticSearch to serve catalog searches"""
+
+    def __init__(self):
+        self.trees = [{'name': 'code', 'generated_date': 'Mon',
+                       'es_alias': 'dxr_code', 'es_index': 'dxr_code_1',
+                       'description': 'Code'}]
+        self.searches = []
+
+    def search(self, query, index, doc_type, size):
+        self.searches.append(query.get('_source'))
+        include = query.get('_source', {}).get('include')
+        return {'hits': {'hits': [
+            {'_source': dict((k, v) for k, v in tree.iteritems()
+                             if include is None or k in include)}
+            for tree in self.trees]}}
+
+
+def test_catalog_cache():
+    """Frozen configs should come from the cache until its TTL passes, then
+    be refetched only if a tree was redeployed."""
+    app = Flask('dxr')
+    app.dxr_config = type('Config', (), {'es_catalog_index': 'catalog'})
+    app.es = es = FakeCatalog()
+    app.catalog = cache = CatalogCache(60)
+    with app.app_context():
+        eq_(frozen_config('code')['description'], 'Code')
+        frozen_config('code')
+        eq_(es.searches, [None])
+
+        cache._checked -= 61  # Expire it.
+        es.trees[0]['description'] = 'Ignored'
+        eq_(frozen_config('code')['description'], 'Code')
+        eq_(es.searches[1:], [{'include': CatalogCache.STAMP_FIELDS}])
+
+        cache._checked -= 61
+        es.trees[0]['generated_date'] = 'Tue'
+        eq_(frozen_config('code')['description'], 'Ignored')
+        eq_(len(es.searches), 4)
+
+        # A swapped index behind an unchanged alias and date counts, too.
+        cache._checked -= 61
+        es.trees[0]['es_index'] = 'dxr_code_2'
+        eq_(frozen_config('code')['es_index'], 'dxr_code_2')
+        eq_(len(es.searches), 6)
@@ -0,0 +1,156 @@
+"""Tests for the on-disk cache of per-file indexing output"""
+
+import cPickle
+from datetime import datetime
+from os import utime
+from os.path import exists, join
+from re import purge
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+import zlib
+
+from nose.tools import eq_, ok_
+
+from dxr.config import Config
+from dxr.indexcache import IndexCache, index_cache
+from dxr.indexers import TreeToIndex
+from dxr.lines import Region
+from dxr.plugins import Plugin
+from dxr.plugins.buglink import plugin as buglink
+import dxr.plugins.urllink
+
+
+class IndexCacheTests(TestCase):
+    def setUp(self):
+        self.folder = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.folder)
+
+    def _cache(self, max_bytes=10 ** 9):
+        return IndexCache(self.folder,
+                          max_bytes,
+                          {'smoo': 'some prefix', 'volatile': None})
+
+    def test_keys(self):
+        """Keys should depend on path and contents and be withheld for plugins
+        that opt out."""
+        cache = self._cache()
+        key = cache.key('smoo', 'a/b.c', 'hash')
+        ok_(key)
+        ok_(key != cache.key('smoo', 'a/b.c', 'other hash'))
+        ok_(key != cache.key('smoo', 'a/other.c', 'hash'))
+        eq_(cache.key('volatile', 'a/b.c', 'hash'), None)
+
+    def test_round_trip(self):
+        """Output, including regions, should survive a trip to disk."""
+        cache = self._cache()
+        output = {'needles': [('modified', datetime(2015, 1, 2))],
+                  'links': [(4, 'Heading', [('icon', 'Title', '/href')])],
+                  'refs': [],
+                  'regions': [(0, 3, Region('k'))],
+                  'needles_by_line': [[('number', 1)]],
+                  'annotations_by_line': [[]]}
+        cache.put('abcdef', output)
+        got = cache.get('abcdef', None)
+        eq_(got['needles'], output['needles'])
+        eq_(got['links'], output['links'])
+        eq_([(start, end, region.css_class) for start, end, region in
+             got['regions']],
+            [(0, 3, 'k')])
+
+    def test_corrupt(self):
+        """A damaged entry should be deleted and count as a miss."""
+        cache = self._cache()
+        cache.put('abcdef', {'needles': [], 'links': [], 'refs': [],
+                             'regions': []})
+        path = cache._path('abcdef')
+        with open(path, 'rb') as file:
+            data = file.read()
+        for damaged in [data[:len(data) // 2],
+                        zlib.compress('garbage'),
+                        zlib.compress(cPickle.dumps({}, 2)[:-1])]:
+            with open(path, 'wb') as file:
+                file.write(damaged)
+            eq_(cache.get('abcdef', None), None)
+            ok_(not exists(path))
+
+    def test_uninteresting(self):
+        """Distinguish "plugin wasn't interested" from a miss."""
+        cache = self._cache()
+        cache.put('abcdef', None)
+        eq_(cache.get('abcdef', None), {})
+        eq_(cache.get('123456', None), None)
+
+    def test_prune(self):
+        """Pruning should evict the least recently used entries first."""
+        cache = self._cache()
+        for number, key in enumerate(['aaaa', 'bbbb', 'cccc']):
+            cache.put(key, None)
+            utime(join(self.folder, key[:2], key), (number, number))
+        cache.max_bytes = 1
+        eq_(cache.prune(), 3)
+        cache.put('aaaa', None)
+        cache.put('bbbb', None)
+        utime(join(self.folder, 'aa', 'aaaa'), (0, 0))
+        cache.max_bytes = 20
+        eq_(cache.prune(), 1)
+        eq_(cache.get('aaaa', None), None)
+        eq_(cache.get('bbbb', None), {})
+
+
+class FakeTreeToIndex(object):
+    plugin_name = 'buglink'
+
+    def cache_fingerprint(self):
+        return ''
+
+
+def test_stable_prefix():
+    """Key prefixes should survive a reload of the config, even one that
+    compiles regexes."""
+    def config():
+        # Make re compile the regex afresh, as a new process would.
+        purge()
+        return Config("""
+            [DXR]
+            enabled_plugins = buglink
+            index_cache_folder = cache
+
+            [code]
+            source_folder = code
+                [[buglink]]
+                url = http://bugs/%s
+                regex = bug (\\d+)
+            """, relative_to='/tmp')
+    # Keep both alive, so the second regex can't reuse the first's address.
+    configs = [config(), config()]
+    eq_(*[index_cache(c.trees['code'],
+                      [FakeTreeToIndex()]).key_prefixes['buglink']
+          for c in configs])
+
+
+def test_opt_in():
+    """Plugins should be cached only if they vouch for their output."""
+    config = Config("""
+        [DXR]
+        enabled_plugins = buglink
+        index_cache_folder = cache
+
+        [code]
+        source_folder = code
+            [[buglink]]
+            url = http://bugs/%s
+        """, relative_to='/tmp')
+    tree = config.trees['code']
+    # Plugins made of a module's namespace opt in with a module attribute.
+    urllink = Plugin.from_namespace(dxr.plugins.urllink.__dict__)
+    prefixes = index_cache(tree,
+                           [TreeToIndex('third_party', tree, None),
+                            buglink.tree_to_index('buglink', tree, None),
+                            urllink.tree_to_index('urllink', tree, None)]
+                           ).key_prefixes
+    eq_(prefixes['third_party'], None)
+    ok_(prefixes['buglink'])
+    ok_(prefixes['urllink'])
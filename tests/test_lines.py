@@ -1,6 +1,7 @@
 """Tests for the machinery that takes offsets and markup bits from plugins and
 decorates source code with them to create HTML"""
 
+import json
 from unittest import TestCase
 import warnings
 from warnings import catch_warnings
@@ -10,7 +11,10 @@ from nose.tools import eq_
 
 from dxr.lines import (line_boundaries, remove_overlapping_refs, Region, LINE,
                        Ref, balanced_tags, finished_tags, tag_boundaries,
-                       html_line, nesting_order, tags_per_line)
+                       html_line, nesting_order, tags_per_line, es_lines,
+                       MenuTable, RenderingPacker, unpack_rendering)
+from dxr.plugins.buglink import BugRef
+from dxr.plugins.rust.refs import VariableRef
 from dxr.utils import build_offset_map, split_content_lines
 
 
@@ -279,6 +283,23 @@ class IntegrationTests(TestCase):
         eq_(text_to_html_lines('this that', [(0, 9, RefWithoutData([]))], [(0, 4, Region('k'))]),
             [u'<a data-menu="[]"><span class="k">this</span> that</a>'])
 
+    def test_menu_table(self):
+        """Refs with the same menu should share an entry in the page's table
+        of menus."""
+        menus = MenuTable()
+        text = 'a b a'
+        refs = [(0, 1, RefWithoutData([{'html': 'a'}])),
+                (2, 3, RefWithoutData([{'html': 'b'}])),
+                (4, 5, RefWithoutData([{'html': 'a'}]))]
+        eq_(html_line(text,
+                      first(tags_per_line(finished_tags([text], refs, []))),
+                      0,
+                      menus),
+            u'<a data-menu-id="0">a</a> <a data-menu-id="1">b</a> '
+            u'<a data-menu-id="0">a</a>')
+        eq_(json.loads(menus.json()),
+            {'0': [{'html': 'a'}], '1': [{'html': 'b'}]})
+
     def test_split_anchor_across_lines(self):
         """Support unavoidable splits of an anchor across lines."""
         # We must preserve the \n in the output so that text within refs/regions keeps line breaks.
@@ -316,3 +337,69 @@ def test_unusual_whitespace():
              u"This is the last line\n"]
     eq_(split_content_lines(u''.join(lines)), lines)
 
+
+
+def test_rendering_round_trip():
+    """Refs, regions, and annotations should survive a trip through a
+    compact rendering blob."""
+    lines = split_content_lines('bug 42 here\nnothing\nbug 43\n')
+    ref = BugRef(None, ['Bugzilla', 'http://bug/%s', '42'], hover='Bug 42',
+                 qualname='bug:42')
+    other_ref = BugRef(None, ['Bugzilla', 'http://bug/%s', '43'])
+    annotations = [[], [{'title': 'Nothing to see'}], []]
+    packer = RenderingPacker()
+    for tags, annotations_for_line in zip(
+            es_lines(finished_tags(lines,
+                                   [(0, 6, ref), (20, 26, other_ref)],
+                                   [(7, 11, Region('k')),
+                                    (20, 23, Region('k'))])),
+            annotations):
+        packer.add_line(tags, annotations_for_line)
+
+    refs, regions, got_annotations = unpack_rendering(packer.blob(), 'tree')
+    eq_([(start, end, ref.menu_data, ref.hover, ref.qualname_hash, ref.tree)
+         for start, end, ref in refs],
+        [(0, 6, ['Bugzilla', 'http://bug/%s', '42'], 'Bug 42', hash('bug:42'),
+          'tree'),
+         (20, 26, ['Bugzilla', 'http://bug/%s', '43'], None, None, 'tree')])
+    eq_([(start, end, region.css_class) for start, end, region in regions],
+        [(7, 11, 'k'), (20, 23, 'k')])
+    eq_(got_annotations, annotations)
+
+
+def test_lazy_menu_data():
+    """Refs from the index should share menu table entries by their encoded
+    menu data, decoding it only to build the menu."""
+    refs = [Ref.es_to_triple({'start': 0,
+                              'end': 6,
+                              'payload': BugRef(None,
+                                                ['Bugzilla', 'http://bug/%s',
+                                                 '42']).es()},
+                             None)[2]
+            for _ in range(2)]
+    menus = MenuTable()
+    eq_(menus.id_for(refs[0]), menus.id_for(refs[1]))
+    eq_(refs[0]._menu_data, ['Bugzilla', 'http://bug/%s', '42'])
+    eq_(refs[1]._menu_data, None)
+
+
+def test_index_round_trip():
+    """Refs of any class, including ones whose constructors look at their
+    menu data, should come back intact from both kinds of stored
+    rendering."""
+    for ref in [BugRef(None, ['Bugzilla', 'http://bug/%s', '42'],
+                       hover='Bug 42'),
+                VariableRef(None, {'type': 'i32', 'qualname': 'x'})]:
+        from_line = Ref.es_to_triple({'start': 0,
+                                      'end': 1,
+                                      'payload': ref.es()},
+                                     'tree')[2]
+        packer = RenderingPacker()
+        packer.add_line(es_lines(finished_tags(['x'], [(0, 1, ref)], [])).next(),
+                        [])
+        from_blob = unpack_rendering(packer.blob(), 'tree')[0][0][2]
+        for got in from_line, from_blob:
+            eq_((type(got), got.menu_data, got.hover, got.qualname_hash,
+                 got.tree),
+                (type(ref), ref.menu_data, ref.hover, ref.qualname_hash,
+                 'tree'))
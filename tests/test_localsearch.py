@@ -0,0 +1,110 @@
+"""Tests for the local, ES-free search backend"""
+
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+from weakref import ref
+
+from nose.tools import eq_, assert_raises
+from pyelasticsearch import ElasticHttpNotFoundError
+
+from dxr.es import BulkSizer, ShardWriter
+from dxr.localsearch import LocalSearch, build_local_index, _intersection
+
+
+def test_intersection():
+    eq_(_intersection([[1, 3, 5, 7, 9], [3, 4, 9], [0, 3, 9, 12]]), [3, 9])
+    eq_(_intersection([[1, 2], []]), [])
+
+
+class LocalSearchTests(TestCase):
+    def setUp(self):
+        self.folder = mkdtemp()
+        self.es = LocalSearch(join(self.folder, 'local'))
+        files = [{'path': ['a/main.c'], 'ext': ['c'], 'is_folder': False},
+                 {'path': ['b/lib.h'], 'ext': ['h'], 'is_folder': False}]
+        lines = [('b/lib.h', 1, 'int frob(void);'),
+                 ('a/main.c', 2, 'return frob();'),
+                 ('a/main.c', 1, 'int main() {'),
+                 ('a/main.c', 3, '}')]
+        sizer = BulkSizer(1, 100, 100000)
+        with ShardWriter(self.folder, 'file', sizer) as file_writer:
+            file_writer.upload([self.es.index_op(doc, id=doc['path'][0])
+                                for doc in files])
+        with ShardWriter(self.folder, 'line', sizer) as line_writer:
+            line_writer.upload([self.es.index_op({'path': [path],
+                                                  'number': [number],
+                                                  'content': [content]},
+                                                 parent=path)
+                                for path, number, content in lines])
+        self.es.create_index('catalog')  # Make sure the root exists.
+        self.shards = [file_writer.path, line_writer.path]
+        build_local_index(join(self.folder, 'local', 'index_1'), self.shards)
+        self.es.update_aliases([{'add': {'index': 'index_1',
+                                         'alias': 'alias'}}])
+
+    def tearDown(self):
+        rmtree(self.folder)
+
+    def _lines(self, filter, **kwargs):
+        results = self.es.search(
+            {'query': {'filtered': {'query': {'match_all': {}},
+                                    'filter': filter}},
+             'sort': ['path', 'number']},
+            index='alias',
+            doc_type='line',
+            **kwargs)['hits']
+        return results['total'], [(hit['_source']['path'][0],
+                                   hit['_source']['number'][0])
+                                  for hit in results['hits']]
+
+    def test_phrase_and_regex(self):
+        """Trigram phrases and regex scripts should both be honored, case
+        folding where the field says to."""
+        eq_(self._lines({'query': {'match_phrase':
+                                   {'content.trigrams_lower': 'FROB'}}}),
+            (2, [('a/main.c', 2), ('b/lib.h', 1)]))
+        eq_(self._lines({'query': {'match_phrase':
+                                   {'content.trigrams': 'FROB'}}}),
+            (0, []))
+        eq_(self._lines({'and': [
+                {'query': {'match_phrase': {'content.trigrams': 'int'}}},
+                {'script': {'lang': 'js',
+                            'script': '(new RegExp(pattern, flags))'
+                                      '.test(doc["content"][0])',
+                            'params': {'pattern': 'int [a-z]+\\(\\)',
+                                       'flags': ''}}}]}),
+            (1, [('a/main.c', 1)]))
+
+    def test_parents_and_paging(self):
+        """FILE-domain filters should reach lines through has_parent, and
+        paging should leave the total alone."""
+        eq_(self._lines({'not': {'has_parent': {
+                'parent_type': 'file',
+                'filter': {'term': {'ext': 'h'}}}}},
+                        size=2, es_from=1),
+            (3, [('a/main.c', 2), ('a/main.c', 3)]))
+
+    def test_alias_swap(self):
+        """An index an alias has moved off of shouldn't be kept open."""
+        eq_(self._lines({'term': {'path': 'b/lib.h'}})[0], 1)
+        old_index = ref(self.es._index('alias'))
+        build_local_index(join(self.folder, 'local', 'index_2'), self.shards)
+        self.es.update_aliases([{'remove': {'index': 'index_1',
+                                            'alias': 'alias'}},
+                                {'add': {'index': 'index_2',
+                                         'alias': 'alias'}}])
+        self.es.delete_index('index_1')
+        eq_(self._lines({'term': {'path': 'b/lib.h'}})[0], 1)
+        eq_(old_index(), None)
+
+    def test_catalog(self):
+        """Loose indices should take docs by ID and give them back."""
+        self.es.index('catalog', 'tree', {'name': 'code'}, id='21/code')
+        eq_(self.es.get('catalog', 'tree', '21/code')['_source'],
+            {'name': 'code'})
+        assert_raises(ElasticHttpNotFoundError,
+                      self.es.get, 'catalog', 'tree', '21/other')
+        eq_(self.es.aliases('alias'),
+            {'index_1': {'aliases': {'alias': {}}}})
@@ -0,0 +1,53 @@
+"""Tests for the shared scan of source trees"""
+
+from os import makedirs, symlink
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from nose.tools import eq_, ok_
+
+from dxr.manifest import IgnoreMatcher, scan
+
+
+def test_matcher():
+    """Filename patterns should match bare names; path patterns, slash-led
+    relative paths, with a trailing slash for folders."""
+    matcher = IgnoreMatcher(['*.o', '.git'], ['/build/', '/docs/*.txt'])
+    ok_(matcher.is_ignored('foo.o', 'src/foo.o'))
+    ok_(not matcher.is_ignored('foo.c', 'src/foo.c'))
+    ok_(matcher.is_ignored('.git', '.git', is_folder=True))
+    ok_(matcher.is_ignored('build', 'build', is_folder=True))
+    ok_(not matcher.is_ignored('build', 'build'))  # a file named build
+    ok_(not matcher.is_ignored('build', 'src/build', is_folder=True))
+    ok_(matcher.is_ignored('a.txt', 'docs/a.txt'))
+    ok_(not IgnoreMatcher([], []).is_ignored('anything', 'anything'))
+
+
+class ScanTests(TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        for folder in ['.git', 'src/deep', 'build', 'docs']:
+            makedirs(join(self.root, folder))
+        for path in ['.git/HEAD', 'src/a.c', 'src/a.o', 'src/deep/b.c',
+                     'build/out', 'docs/readme.txt', 'top']:
+            with open(join(self.root, path), 'w') as file:
+                file.write('hi')
+        symlink(join(self.root, 'src'), join(self.root, 'linked'))
+
+    def tearDown(self):
+        rmtree(self.root)
+
+    def _rel(self, paths):
+        return [path[len(self.root) + 1:] for path in paths]
+
+    def test_scan(self):
+        """Ignored things should be left out, symlinked folders listed but
+        not followed, and VCS markers noted even though ignored."""
+        manifest = scan(self.root, ['*.o', '.git'], ['/build/'])
+        eq_(self._rel(manifest.paths),
+            ['docs/readme.txt', 'src/a.c', 'src/deep/b.c', 'top'])
+        eq_(self._rel(manifest.folders), ['docs', 'linked', 'src', 'src/deep'])
+        eq_(manifest.files[-1][1], 2)  # size of top
+        eq_(manifest.vcs_markers, [(self.root, ['.git'])])
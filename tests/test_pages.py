@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""Tests for the on-disk store of pre-rendered file pages"""
+
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from nose.tools import eq_
+
+from dxr.pages import PageStore
+
+
+class PageStoreTests(TestCase):
+    def setUp(self):
+        self.folder = mkdtemp()
+        self.pages = PageStore(join(self.folder, 'pages'))
+
+    def tearDown(self):
+        rmtree(self.folder)
+
+    def test_round_trip(self):
+        """Pages should come back as the unicode that went in, keyed by index
+        and path."""
+        self.pages.put('dxr_1', u'src/☃.c', u'<code>☃</code>')
+        eq_(self.pages.get('dxr_1', u'src/☃.c'), u'<code>☃</code>')
+        eq_(self.pages.get('dxr_1', u'src/other.c'), None)
+        eq_(self.pages.get('dxr_2', u'src/☃.c'), None)
+
+    def test_copy_and_delete(self):
+        """Copying should carry over the pages that exist, and deleting an
+        index should leave others alone."""
+        self.pages.put('dxr_1', u'a.c', u'a')
+        self.pages.put('dxr_1', u'b.c', u'b')
+        self.pages.copy('dxr_1', 'dxr_2', [u'a.c', u'missing.c'])
+        self.pages.delete('dxr_1')
+        eq_(self.pages.get('dxr_1', u'a.c'), None)
+        eq_(self.pages.get('dxr_2', u'a.c'), u'a')
+        eq_(self.pages.get('dxr_2', u'b.c'), None)
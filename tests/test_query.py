@@ -6,9 +6,15 @@ everything else. Here are a few unit tests.
 """
 from unittest import TestCase
 
-from nose.tools import eq_
+from nose.tools import eq_, ok_, assert_raises
 
-from dxr.query import fix_extents_overlap
+from dxr.exceptions import BadTerm
+from dxr.filters import FILE, LINE, Filter
+from dxr.localsearch import _matches
+from dxr.plugins import core_plugin
+from dxr.query import (Query, decode_cursor, encode_cursor,
+                       fix_extents_overlap, _source_fields)
+from dxr.searchcache import MemoryCache
 
 
 class FixExtentsOverlapTests(TestCase):
@@ -49,3 +55,118 @@ class FixExtentsOverlapTests(TestCase):
         """Work even if the highlighting starts at offset 0."""
         eq_(list(fix_extents_overlap([(0, 3), (2, 5), (11, 14)])),
             [(0, 5), (11, 14)])
+
+
+def test_source_fields():
+    """Searches should fetch just the fields their filters declare, unless
+    one doesn't say."""
+    class NeedleFilter(Filter):
+        def source_fields(self):
+            return ['c_function', 'path']
+
+    needle, unsure = NeedleFilter({}, []), Filter({}, [])
+    eq_(_source_fields([needle], LINE),
+        ['path', 'number', 'content', 'c_function'])
+    eq_(_source_fields([needle], FILE), ['path', 'is_binary', 'c_function'])
+    eq_(_source_fields([needle, unsure], LINE), None)
+
+
+class VerifiedRegexTests(TestCase):
+    """Tests for checking regex candidates in Python rather than in ES"""
+
+    def setUp(self):
+        # Every other line matches regexp:foo+d, and all are candidates.
+        self.lines = [{'path': ['a.c'],
+                       'number': [n],
+                       'content': [u'food' if n % 2 else u'fob']}
+                      for n in xrange(1, 21)]
+        self.requests = []
+
+    def _search(self, request, doc_type):
+        """Stand in for ES, ignoring all but paging and cursors."""
+        self.requests.append(request)
+        lines = self.lines
+        after = request['query'].get('filtered', {}).get('filter', {})
+        if 'range' in repr(after):
+            lines = [l for l in lines if _matches(after, {'_source': l}, None)]
+        start = request.get('from', 0)
+        return {'hits': {'total': len(lines),
+                         'hits': [{'_source': line} for line in
+                                  lines[start:start + request['size']]]}}
+
+    def _query(self, text, offset=0, limit=100, after=None, **kwargs):
+        query = Query(self._search, text, [core_plugin()], **kwargs)
+        return query.results(offset=offset, limit=limit, after=after)
+
+    def _results(self, budget, offset, limit):
+        results = self._query('regexp:foo+d', offset, limit,
+                              candidate_budget=budget)
+        numbers = [number for _, _, lines in results['results']
+                   for number, _ in lines]
+        return (results['result_count'], results['result_count_is_exact'],
+                numbers)
+
+    def test_exhaustive(self):
+        """Checking every candidate should give an exact count."""
+        eq_(self._results(100, 7, 100), (10, True, [15, 17, 19]))
+        # The ES filter should have lost its script but kept its trigrams:
+        ok_('script' not in repr(self.requests[0]['query']))
+        ok_('match_phrase' in repr(self.requests[0]['query']))
+        eq_(self.requests[0]['_source'], ['path', 'number', 'content'])
+
+    def test_estimate(self):
+        """Stopping early should extrapolate the count, and the budget should
+        cap how many candidates get checked."""
+        eq_(self._results(100, 0, 2), (13, False, [1, 3]))
+        eq_(self._results(6, 2, 5), (10, False, [5]))
+        eq_(self.requests[-1]['size'], 6)
+
+    def test_cursor(self):
+        """Paging by position should pick up where the last page left off,
+        both when verifying and when leaving it all to ES."""
+        results = self._query('regexp:foo+d', limit=3, candidate_budget=100)
+        eq_(results['position'], ('a.c', 5))
+        results = self._query('regexp:foo+d', limit=3, candidate_budget=100,
+                              after=results['position'])
+        eq_([n for _, _, lines in results['results'] for n, _ in lines],
+            [7, 9, 11])
+        ok_('from' not in self.requests[-1])
+
+        results = self._query('foo', limit=18, after=('a.c', 1))
+        eq_(results['position'], ('a.c', 19))
+        eq_(self._query('foo', limit=18, after=('a.c', 19))['position'], None)
+        eq_(decode_cursor(encode_cursor(('a.c', 19))), ('a.c', 19))
+        eq_(decode_cursor('garbage'), None)
+
+    def test_unaccelerated(self):
+        """Regexes without trigrams should be refused unless scanning is
+        allowed, and then the scan should stop at its budget."""
+        assert_raises(BadTerm, self._query, 'regexp:o+d')
+        results = self._query('regexp:o+d', scan_budget=5)
+        eq_(self.requests[-1]['query'], {'match_all': {}})
+        eq_(len(list(results['results'])[0][2]), 3)
+        ok_(results['is_truncated'])
+        results = self._query('regexp:o+d', scan_budget=50)
+        eq_((results['result_count'], results['result_count_is_exact'],
+             results['is_truncated']),
+            (10, True, False))
+
+    def test_cache(self):
+        """Repeating a search against the same index should come from the
+        cache, but truncated results shouldn't be kept."""
+        cache = MemoryCache(10)
+        first = self._query('regexp:foo+d', candidate_budget=100,
+                            cache=cache, index='dxr_code_1')
+        eq_(len(self.requests), 1)
+        again = self._query('regexp:foo+d', candidate_budget=100,
+                            cache=cache, index='dxr_code_1')
+        eq_(len(self.requests), 1)
+        eq_(list(again['results']), list(first['results']))
+        self._query('regexp:foo+d', candidate_budget=100,
+                    cache=cache, index='dxr_code_2')
+        eq_(len(self.requests), 2)
+
+        for _ in xrange(2):
+            self._query('regexp:o+d', scan_budget=5,
+                        cache=cache, index='dxr_code_1')
+        eq_(len(self.requests), 4)
@@ -0,0 +1,21 @@
+"""Tests for the search result cache"""
+
+from nose.tools import eq_
+
+from dxr.searchcache import MemoryCache, cache_key
+
+
+def test_lru():
+    """The least recently used entry should be the one dropped."""
+    cache = MemoryCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    eq_([cache.get(k) for k in 'abc'], [1, None, 3])
+
+
+def test_key():
+    """Keys should be stable across dict ordering and differ by content."""
+    eq_(cache_key({'x': 1, 'y': 2}), cache_key({'y': 2, 'x': 1}))
+    eq_(cache_key('results', 'i1') == cache_key('results', 'i2'), False)
@@ -3,7 +3,6 @@
 
 from unittest import TestCase
 
-from nose import SkipTest
 from nose.tools import eq_, ok_, assert_raises
 from parsimonious import ParseError
 from parsimonious.expressions import OneOf
@@ -49,7 +48,6 @@ class SimplificationTests(TestCase):
 
     def test_string_coalescing(self):
         """We should be smart enough to merge these into a single string."""
-        raise SkipTest("We will need more metadata on the tree nodes (the 'exact' datum from the Cox method) to tell when it's safe to coalesce a, b, and c in the parent node after they were simplified out of lower-level children.")
         eq_(visit_regex('(a)(b)(c)').simplified(), 'abc')
 
     def test_not_coalescing_over_uselesses(self):
@@ -76,15 +74,25 @@ class SimplificationTests(TestCase):
     def test_short_ngram_removal(self):
         """Substrings shorter than 3 chars should be removed."""
         eq_(And(['oof', 'by', 'smurf']).simplified(), And(['oof', 'smurf']))
-        eq_(Or(['', 'by', 'smurf']).simplified(), 'smurf')
+        # An Or with a too-short branch can be satisfied by anything:
+        eq_(Or(['', 'by', 'smurf']).simplified(), '')
         eq_(Or([And(['', 'e', 'do']), 'hi']).simplified(), '')
 
 
-def visit_regex(regex):
-    return SubstringTreeVisitor().visit(regex_grammar.parse(regex))
+    def test_redundancy(self):
+        """Children implied by others should be dropped."""
+        eq_(Or(['cork', 'arkcork', And(['abc', 'cde'])]).simplified(),
+            Or(['cork', And(['abc', 'cde'])]))
+        eq_(And(['cork', 'arkcork', And(['cork', 'cde'])]).simplified(),
+            And(['arkcork', 'cde']))
 
 
-def eq_simplified(regex, expected):
+def visit_regex(regex, **kwargs):
+    return SubstringTreeVisitor(**kwargs).visit(
+        regex_grammar.parse(regex)).substrings()
+
+
+def eq_simplified(regex, expected, **kwargs):
     """Visit a regex, simplify it, and return whether it's equal to an
     expected value.
 
@@ -92,7 +100,7 @@ def eq_simplified(regex, expected):
     SimplificationTests.
 
     """
-    eq_(visit_regex(regex).simplified(min_length=1), expected)
+    eq_(visit_regex(regex, **kwargs).simplified(min_length=1), expected)
 
 
 class StringExtractionTests(TestCase):
@@ -103,46 +111,67 @@ class StringExtractionTests(TestCase):
     """
     def test_merge_literals(self):
         """Make sure we know how to merge adjacent char literals."""
-        eq_(visit_regex('abcd'), Or([And(['abcd'])]))
+        eq_simplified('abcd', 'abcd')
 
     def test_2_branches(self):
-        eq_(visit_regex('ab|cd'), Or([And(['ab']), And(['cd'])]))
+        eq_simplified('ab|cd', Or(['ab', 'cd']))
 
     def test_3_branches(self):
-        eq_(visit_regex('ab|cd|ef'),
-            Or([And(['ab']), And(['cd']), And(['ef'])]))
+        eq_simplified('ab|cd|ef', Or(['ab', 'cd', 'ef']))
 
     def test_anded_uselesses(self):
-        """Make USELESSes break up contiguous strings of literals."""
-        eq_(visit_regex('ab[^q]cd'),
-            Or([And(['ab', 'cd'])]))
+        """Make uncertainties break up contiguous strings of literals."""
+        eq_simplified('ab[^q]cd', And(['ab', 'cd']))
 
     def test_empty_branch(self):
-        """Make sure the right kind of tree is built when a branch is empty."""
-        eq_(visit_regex('(a||b)'),
-            Or([And([Or([And(['a']), And(['']), And(['b'])])])]))
+        """An empty branch can match anywhere, so nothing is required."""
+        eq_simplified('(a||b)', '')
 
     def test_nested_tree(self):
-        """Make sure Ors containing Ands build properly."""
-        eq_(visit_regex('ab[^q](cd|ef)'),
-            Or([And(['ab', Or([And(['cd']), And(['ef'])])])]))
-        eq_(visit_regex('ab(cd|ef)'),
-            Or([And(['ab', Or([And(['cd']), And(['ef'])])])]))
-
-    def test_and_containing_ors(self):
-        """Does this explode? Right now, visit_branch assumes that Ands receive only strings or USELESS."""
-        eq_(visit_regex('(a|b)(c|d)'),
-            Or([And([Or([And(['a']), And(['b'])]), Or([And(['c']), And(['d'])])])]))
-
-    def test_wtf(self):
-        """Guard against an ill-defined WTF we had."""
-        eq_(visit_regex('(aa|b)(c|d)'),
-            Or([And([Or([And(['aa']), And(['b'])]), Or([And(['c']), And(['d'])])])]))
+        """Make sure prefixes carry across unknown chars, and alternations
+        multiply out."""
+        eq_simplified('ab[^q](cd|ef)', And(['ab', Or(['cd', 'ef'])]))
+        eq_simplified('ab(cd|ef)', Or(['abcd', 'abef']))
+
+    def test_cross_products(self):
+        """Adjacent alternations should multiply into exact strings."""
+        eq_simplified('(a|b)(c|d)', Or(['ac', 'ad', 'bc', 'bd']))
+        eq_simplified('(aa|b)(c|d)', Or(['aac', 'aad', 'bc', 'bd']))
+        eq_(visit_regex('foo(bar|baz)qux').simplified(),
+            Or(['foobarqux', 'foobazqux']))
+
+    def test_size_limit(self):
+        """Cross products too big to track should be given up on, keeping
+        what we can."""
+        eq_(visit_regex('(ab|cd)(ef|gh)').simplified(),
+            Or(['abef', 'abgh', 'cdef', 'cdgh']))
+        eq_simplified('(ab|cd)(ef|gh)',
+                      And([Or(['ab', 'cd']), Or(['ef', 'gh'])]),
+                      max_set_size=3)
 
     def test_wildcards(self):
         """Wildcards should be stripped off as useless."""
         eq_simplified('.*abc.*', 'abc')
 
+    def test_quantifiers(self):
+        """Repeated atoms should contribute their first few copies, and
+        optional ones their presence and absence."""
+        eq_(visit_regex('spr+').simplified(), 'spr')
+        eq_(visit_regex('hello+ dolly').simplified(),
+            And(['hello', 'o dolly']))
+        eq_(visit_regex('ab{3}c').simplified(), 'abbbc')
+        eq_(visit_regex('x{2,5}yz').simplified(), 'xxyz')
+        eq_simplified('ab?c', Or(['abc', 'ac']))
+        eq_(visit_regex('ab?c').simplified(), '')
+        eq_(visit_regex('(abc)*def').simplified(), 'def')
+
+    def test_anchors(self):
+        """Anchors should act like empty strings."""
+        eq_(visit_regex(r'(/|^)foo\.c$').simplified(), 'foo.c')
+
+    def test_hex(self):
+        """Hex escapes should turn into their chars."""
+        eq_(visit_regex(r'\x41bc').simplified(), 'Abc')
 
 
 class ClassTests(TestCase):
@@ -151,6 +180,7 @@ class ClassTests(TestCase):
     def test_classes(self):
         """Exercise the enumerated case."""
         eq_simplified('[abc]', Or(['a', 'b', 'c']))
+        eq_(visit_regex('ab[cd]').simplified(), Or(['abc', 'abd']))
 
     def test_range(self):
         """Make sure character ranges expand."""
@@ -0,0 +1,57 @@
+"""Tests for the pieces of dxr.vcs that don't need a full index"""
+
+from os import remove
+from os.path import join
+from shutil import rmtree
+from subprocess import check_call
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from nose.tools import eq_
+
+from dxr.vcs import Git
+
+
+class GitChangedPathsTests(TestCase):
+    """Tests for ``Git.changed_paths()``, which drives incremental builds"""
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self._git('init', '-q', '.')
+        for name in ['kept', 'edited', 'deleted', 'moved']:
+            self._write(name, name)
+        self._git('add', '.')
+        self._git('commit', '-qm', 'Initial.')
+        self.revision = Git(self.root).revision
+
+    def tearDown(self):
+        rmtree(self.root)
+
+    def _git(self, *args):
+        check_call(['git', '-c', 'user.name=DXR', '-c', 'user.email=dxr@example.com'] +
+                   list(args),
+                   cwd=self.root)
+
+    def _write(self, name, contents):
+        with open(join(self.root, name), 'w') as file:
+            file.write(contents)
+
+    def test_unchanged(self):
+        """Nothing should be reported if nothing changed."""
+        eq_(Git(self.root).changed_paths(self.revision), set())
+
+    def test_committed_and_uncommitted(self):
+        """Report committed edits, deletions, and both halves of renames, as
+        well as uncommitted edits to the working copy."""
+        self._write('edited', 'different')
+        self._git('mv', 'moved', 'new home')
+        self._git('rm', '-q', 'deleted')
+        self._git('commit', '-qm', 'Shuffle things.')
+        self._write('kept', 'uncommitted change')
+        eq_(Git(self.root).changed_paths(self.revision),
+            set(['edited', 'moved', 'new home', 'deleted', 'kept']))
+
+    def test_working_copy_deletion(self):
+        """Report files deleted from the working copy but not yet committed."""
+        remove(join(self.root, 'kept'))
+        eq_(Git(self.root).changed_paths(self.revision), set(['kept']))